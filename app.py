@@ -1,26 +1,65 @@
 from fastapi import FastAPI
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import Response, JSONResponse
 
-from database.database import engine, SessionLocal
+from config import Config
+from database.database import engine, SessionLocal, open_session, close_session, mark_written, WRITE_METHODS
 from database import models
 from routes import user, recipe
+from service.recipe import get_top_recipes_board
+from service.hashtag import get_tag_dictionary
+from service.photo import photo_pool
+from service.likes import stop_flusher
+from utils.responses import FastJSONResponse
 
 models.Base.metadata.create_all(bind=engine)
 
 app = FastAPI(title="Recipe-Service",
               description="This is a test project, with auto docs for the API",
-              version="0.1")
+              version="0.1",
+              default_response_class=FastJSONResponse)
+
+
+@app.on_event("startup")
+def warm_up_caches():
+    db = SessionLocal()
+    try:
+        get_top_recipes_board(db)
+        get_tag_dictionary(db)
+    finally:
+        db.close()
+
+
+# room for the multipart boundaries and headers around the photo
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+@app.on_event("shutdown")
+def finish_background_work():
+    photo_pool.shutdown(wait=True)
+    stop_flusher()
 
 
 @app.middleware("http")
 async def db_session_middleware(request: Request, call_next):
+    if request.headers.get('content-type', '').startswith('multipart/form-data'):
+        # rejected before the body is read; without the length (chunked) the whole body would be spooled first
+        content_length = request.headers.get('content-length', '')
+        if not content_length.isdigit():
+            return JSONResponse({'detail': 'Content-Length is required'}, status_code=411)
+        if int(content_length) > Config.MAX_PHOTO_SIZE + MULTIPART_OVERHEAD:
+            return JSONResponse({'detail': 'The photo is too large'}, status_code=413)
     response = Response("Internal server error", status_code=500)
     try:
-        request.state.db = SessionLocal()
+        request.state.db = open_session()
         response = await call_next(request)
+        if request.method in WRITE_METHODS and response.status_code < 400:
+            mark_written(request, response)
     finally:
-        request.state.db.close()
+        await close_session(request.state.db)
+        read_db = getattr(request.state, 'read_db', None)
+        if read_db is not None:
+            await close_session(read_db)
     return response
 
 
@@ -0,0 +1,54 @@
+"""Recipes per second: one create_recipe call per recipe (what POST /recipe does) against import_recipes
+by batches of Config.BULK_BATCH_SIZE (what POST /recipe/bulk does)
+
+Usage: URL_DB=postgresql://... python -m benchmarks.bulk_import [recipes]
+"""
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('URL_DB', 'sqlite:////tmp/benchmark_import.db')
+
+from config import Config
+from database import models, schemas
+from database.database import engine, SessionLocal
+from service import recipe
+
+TAGS = [f'tag{i}' for i in range(500)]
+
+
+def make_recipes(count: int):
+    random.seed(count)
+    return [schemas.RecipeImport(name=f'Recipe {i}', description='Description of the recipe',
+                                 steps_making='1. Step one 2. Step two', type='salad', date_creation='2020-04-09',
+                                 tags=random.sample(TAGS, 3)) for i in range(count)]
+
+
+def main(count: int):
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    if db.query(models.User).filter(models.User.nickname == 'benchmark-import').first() is None:
+        db.add(models.User(nickname='benchmark-import', hashed_password='', role='admin'))
+        db.commit()
+    author_id = db.query(models.User.id).filter(models.User.nickname == 'benchmark-import').scalar()
+
+    one_by_one = make_recipes(min(count, 1000))
+    start = time.perf_counter()
+    for recipe_data in one_by_one:
+        recipe.create_recipe(db, schemas.RecipeCreate(**recipe_data.dict(exclude={'tags'}), author_id=author_id),
+                             author_id, recipe_data.tags)
+    create_rate = len(one_by_one) / (time.perf_counter() - start)
+
+    batches = make_recipes(count)
+    start = time.perf_counter()
+    for offset in range(0, count, Config.BULK_BATCH_SIZE):
+        recipe.import_recipes(db, batches[offset:offset + Config.BULK_BATCH_SIZE], author_id)
+    import_rate = count / (time.perf_counter() - start)
+
+    print(f'create_recipe: {create_rate:.0f} recipes/s, import_recipes: {import_rate:.0f} recipes/s')
+    db.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,62 @@
+"""Latency of the first page of the name search depending on the catalog size, end to end through
+get_recipe_by_filter: substring search (ilike) against name_fuzzy=true (the in-process trigram index
+on SQLite). Every tenth recipe has a chocolate name, so the number of matches grows with the catalog
+
+Usage: python -m benchmarks.fuzzy_search [sizes...]
+"""
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('URL_DB', 'sqlite://')
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database import models
+from service import recipe
+
+SYLLABLES = ['ba', 'ko', 'ri', 'sha', 'lo', 'mek', 'tur', 'vin', 'dra', 'pel', 'zu', 'gor', 'chi', 'nok', 'fe']
+QUERIES = ['chocolat', 'lemn pie', 'borsch', 'mushrom soup', 'pancakes']
+REPEAT = 5
+
+
+def word() -> str:
+    return ''.join(random.choice(SYLLABLES) for _ in range(random.randint(2, 4)))
+
+
+def fill(db, size: int):
+    random.seed(size)
+    words = [word() for _ in range(size // 2)] + ['lemon', 'pie', 'borscht', 'mushroom', 'soup', 'pancake']
+    db.bulk_insert_mappings(models.Recipe, [
+        {'name': ' '.join(['chocolate'] * (i % 10 == 0) + random.sample(words, 2)), 'description': '',
+         'steps_making': '', 'type': 'salad', 'is_active': True, 'likes_count': 0} for i in range(size)])
+    db.commit()
+
+
+def measure(search) -> float:
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        for query in QUERIES:
+            search(query)
+    return (time.perf_counter() - start) / (REPEAT * len(QUERIES)) * 1000
+
+
+def main(sizes):
+    print(f'{"recipes":>10} {"matches":>10} {"ilike, ms":>12} {"fuzzy, ms":>12}')
+    for size in sizes:
+        engine = create_engine('sqlite://')
+        models.Base.metadata.create_all(bind=engine)
+        db = sessionmaker(bind=engine)()
+        fill(db, size)
+        recipe.names_index.build(db.query(models.Recipe.id, models.Recipe.name))
+        matches = len(recipe.names_index.search('chocolat'))
+        ilike = measure(lambda query: recipe.get_recipe_by_filter(db, name=query))
+        fuzzy = measure(lambda query: recipe.get_recipe_by_filter(db, name=query, name_fuzzy=True))
+        print(f'{size:>10} {matches:>10} {ilike:>12.3f} {fuzzy:>12.3f}')
+        db.close()
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,66 @@
+"""Like storm on one recipe: toggles per second written one transaction per click (like_it) against
+the write-behind buffer flushed in batches (toggle_like + flush_likes, Config.LIKES_WRITE_BEHIND)
+
+Usage: URL_DB=postgresql://... python -m benchmarks.like_storm [users] [clicks per user]
+"""
+import os
+import random
+import sys
+import time
+from datetime import date
+
+os.environ.setdefault('URL_DB', 'sqlite:////tmp/benchmark_likes.db')
+
+from sqlalchemy import or_
+
+from database import models, schemas
+from database.database import engine, SessionLocal
+from service import likes
+
+
+def storm(db, users_id, recipe_id: int, clicks: int, toggle) -> float:
+    random.seed(clicks)
+    events = [random.choice(users_id) for _ in range(len(users_id) * clicks)]
+    start = time.perf_counter()
+    for user_id in events:
+        toggle(db, schemas.LikeCreate(user_id=user_id, recipe_id=recipe_id))
+    likes.flush_likes()
+    return len(events) / (time.perf_counter() - start)
+
+
+def remove(db, users_id, recipe_id: int = None):
+    """Remove the benchmark users and recipe with their likes, the other rows of the database are kept"""
+    db.query(models.Likes).filter(or_(models.Likes.user_id.in_(users_id), models.Likes.recipe_id == recipe_id)) \
+        .delete(synchronize_session=False)
+    db.query(models.Recipe).filter(models.Recipe.id == recipe_id).delete(synchronize_session=False)
+    db.query(models.User).filter(models.User.id.in_(users_id)).delete(synchronize_session=False)
+    db.commit()
+
+
+def benchmark_users(db):
+    return [user_id for user_id, in db.query(models.User.id).filter(models.User.nickname.like('benchmark-like-%'))]
+
+
+def main(users: int, clicks: int):
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    # left by an interrupted run
+    remove(db, benchmark_users(db))
+    db.add_all(models.User(nickname=f'benchmark-like-{i}', hashed_password='', role='user') for i in range(users))
+    recipe = models.Recipe(name='Viral', description='', steps_making='', type='salad', is_active=True,
+                           date_creation=date(2020, 4, 9), likes_count=0)
+    db.add(recipe)
+    db.commit()
+    users_id = benchmark_users(db)
+    try:
+        direct = storm(db, users_id, recipe.id, clicks, likes.like_it)
+        buffered = storm(db, users_id, recipe.id, clicks, likes.toggle_like)
+        likes.stop_flusher()
+        print(f'like_it: {direct:.0f} toggles/s, write-behind: {buffered:.0f} toggles/s')
+    finally:
+        remove(db, users_id, recipe.id)
+        db.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200, int(sys.argv[2]) if len(sys.argv) > 2 else 5)
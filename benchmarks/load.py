@@ -0,0 +1,96 @@
+"""Requests per second and latency of GET /recipe under high concurrency: the sync stack (threadpool and
+a blocking driver) against the async one (ASYNC_DB=true)
+
+Both servers are started with uvicorn on the database from URL_DB, the results are only meaningful on
+PostgreSQL (asyncpg against psycopg2); aiosqlite runs SQLite in a thread, so on SQLite it is a smoke test.
+
+Usage: URL_DB=postgresql://... python -m benchmarks.load [concurrency] [seconds]
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from datetime import date
+
+os.environ.setdefault('URL_DB', 'sqlite:////tmp/benchmark_load.db')
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from config import Config
+from database import models
+from utils.auth import create_access_token, get_password_hash
+
+PORT = 8765
+RECIPES = 1000
+URL = f'http://127.0.0.1:{PORT}/recipe?limit=20'
+
+
+def fill() -> str:
+    engine = create_engine(Config.URL_DB)
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    if db.query(models.User).filter(models.User.nickname == 'benchmark').first() is None:
+        db.add(models.User(nickname='benchmark', hashed_password=get_password_hash('benchmark'), role='user'))
+        db.commit()
+    user = db.query(models.User).filter(models.User.nickname == 'benchmark').first()
+    if db.query(models.Recipe).count() < RECIPES:
+        db.add_all(models.Recipe(author_id=user.id, name=f'Recipe {i}', description='Description',
+                                 steps_making='1. Step one 2. Step two', type='salad', is_active=True,
+                                 date_creation=date.today()) for i in range(RECIPES))
+        db.commit()
+    db.close()
+    return create_access_token(data={'sub': 'benchmark'})
+
+
+def start_server(async_db: bool) -> subprocess.Popen:
+    env = dict(os.environ, ASYNC_DB='true' if async_db else 'false')
+    server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app:app', '--port', str(PORT), '--log-level',
+                               'warning'], env=env)
+    for _ in range(100):
+        try:
+            httpx.get(f'http://127.0.0.1:{PORT}/docs')
+            return server
+        except httpx.TransportError:
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError('The server did not start')
+
+
+async def load(token: str, concurrency: int, seconds: float) -> list:
+    latencies = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(headers={'jwt': token}, limits=limits, timeout=60) as client:
+        deadline = time.perf_counter() + seconds
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get(URL)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+def main(concurrency: int, seconds: float):
+    token = fill()
+    print(f'{"stack":>6} {"req/s":>10} {"p50, ms":>10} {"p99, ms":>10}')
+    for async_db in (False, True):
+        server = start_server(async_db)
+        try:
+            asyncio.run(load(token, concurrency, 1))
+            latencies = sorted(asyncio.run(load(token, concurrency, seconds)))
+        finally:
+            server.terminate()
+            server.wait()
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000
+        print(f'{"async" if async_db else "sync":>6} {len(latencies) / seconds:>10.1f} {p50:>10.1f} {p99:>10.1f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200, float(sys.argv[2]) if len(sys.argv) > 2 else 10)
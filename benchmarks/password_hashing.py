@@ -0,0 +1,59 @@
+"""Event loop latency during concurrent logins: the password is verified right in the event loop (as the
+login route did before) against the password pool (utils.auth.verify_password_async)
+
+The latency is how late a coroutine that wakes up every TICK seconds is woken up, i.e. how long any other
+request on the same worker would wait.
+
+Usage: python -m benchmarks.password_hashing [logins] [concurrency]
+"""
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault('URL_DB', 'sqlite://')
+
+from utils.auth import pwd_context, verify_password_async
+
+TICK = 0.005
+
+
+async def inline_verify(password: str, hashed_password: str):
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+async def measure(verify, logins: int, concurrency: int):
+    hashed_password = pwd_context.hash('password')
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - start - TICK)
+
+    async def worker(count: int):
+        for _ in range(count):
+            await verify('password', hashed_password)
+            await asyncio.sleep(0)
+
+    ticking = asyncio.ensure_future(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(logins // concurrency) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await ticking
+    lags.sort()
+    return logins / elapsed, lags[int(len(lags) * 0.99)] * 1000, lags[-1] * 1000
+
+
+def main(logins: int, concurrency: int):
+    print(f'{"verify":>8} {"logins/s":>10} {"p99 lag, ms":>12} {"max lag, ms":>12}')
+    for name, verify in (('inline', inline_verify), ('pool', verify_password_async)):
+        rate, p99, worst = asyncio.run(measure(verify, logins, concurrency))
+        print(f'{name:>8} {rate:>10.1f} {p99:>12.1f} {worst:>12.1f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 64, int(sys.argv[2]) if len(sys.argv) > 2 else 16)
@@ -0,0 +1,63 @@
+"""Cost of turning a page of recipes into a response body, per recipe: RecipeShow models encoded with
+jsonable_encoder and the json module (the path of the list routes before) against plain dicts
+from get_recipes_data encoded by FastJSONResponse (orjson)
+
+Usage: python -m benchmarks.serialization [page sizes...]
+"""
+import os
+import sys
+import time
+from datetime import date
+from types import SimpleNamespace
+
+os.environ.setdefault('URL_DB', 'sqlite://')
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from database import schemas
+from service import recipe
+from utils.responses import FastJSONResponse, orjson
+
+REPEAT = 20
+
+
+def make_recipes(size: int):
+    author = SimpleNamespace(nickname='author')
+    return [SimpleNamespace(id=i, name=f'Recipe {i}', description='Description of the recipe ' * 5,
+                            steps_making='1. Step one 2. Step two 3. Step three', type='salad', is_active=True,
+                            date_creation=date(2020, 4, 9), photo=f'ab/cd/{i:064x}.jpg',
+                            photo_variants={'thumbnail': f'ab/cd/{i:064x}.thumbnail.jpg'}, author=author,
+                            likes_count=i % 100) for i in range(size)]
+
+
+def measure(function, size: int) -> float:
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        function()
+    return (time.perf_counter() - start) / REPEAT / size * 1e6
+
+
+def main(sizes):
+    # only the serialization is measured: the tags and likes queries are replaced with prepared rows
+    tags = [(i, tag) for i in range(max(sizes)) for tag in ('tag1', 'tag2', 'tag3')]
+    recipe.get_recipes_tags = lambda db, recipes_id: [row for row in tags if row[0] < len(recipes_id)]
+    recipe.get_liked_recipes_id = lambda db, user_id, recipes_id: recipes_id[::3]
+    print(f'orjson: {"yes" if orjson else "no (json module)"}')
+    for size in sizes:
+        recipes = make_recipes(size)
+
+        def before():
+            shown = [schemas.RecipeShow(**data) for data in recipe.get_recipes_data(None, recipes, 1)]
+            return JSONResponse(jsonable_encoder(shown)).body
+
+        def after():
+            return FastJSONResponse(recipe.get_recipes_data(None, recipes, 1)).body
+
+        assert len(before()) == len(after())
+        print(f'{size} recipes: RecipeShow + json {measure(before, size):.1f} us/recipe, '
+              f'dicts + FastJSONResponse {measure(after, size):.1f} us/recipe')
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or [50, 1000])
@@ -3,6 +3,10 @@ import os
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 
+def async_url(url: str) -> str:
+    return url.replace('postgresql://', 'postgresql+asyncpg://', 1).replace('sqlite://', 'sqlite+aiosqlite://', 1)
+
+
 class Config(object):
     SECRET_KEY = os.environ.get('SECRET_KEY', 'test-recipe-service')
     DATABASE_USER = os.environ.get('DATABASE_USER', 'admin')
@@ -13,4 +17,47 @@ class Config(object):
     ALGORITHM = os.environ.get('ALGORITHM', "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES = os.environ.get('ACCESS_TOKEN_EXPIRE_MINUTES', 30)
     BASE_DIR_IMAGES = os.environ.get('BASE_DIR_IMAGES', '/usr/src/images')
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'local')
+    OBJECT_STORAGE_BUCKET = os.environ.get('OBJECT_STORAGE_BUCKET', os.path.join(BASE_DIR_IMAGES, 'bucket'))
+    MAX_PHOTO_SIZE = int(os.environ.get('MAX_PHOTO_SIZE', 10 * 1024 * 1024))
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 64 * 1024))
+    PHOTO_VARIANTS = {
+        'thumbnail': int(os.environ.get('PHOTO_THUMBNAIL_SIZE', 160)),
+        'card': int(os.environ.get('PHOTO_CARD_SIZE', 480)),
+        'full': int(os.environ.get('PHOTO_FULL_SIZE', 1600)),
+    }
+    PHOTO_QUALITY = int(os.environ.get('PHOTO_QUALITY', 80))
+    PHOTO_MAX_AGE = int(os.environ.get('PHOTO_MAX_AGE', 60))
+    PHOTO_WORKERS = int(os.environ.get('PHOTO_WORKERS', 2))
     TYPES_RECIPE = os.environ.get('TYPES_RECIPE', ['salad', 'first', 'second', 'soup', 'dessert', 'drink'])
+    BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', 1000))
+    BULK_INSERT_SIZE = int(os.environ.get('BULK_INSERT_SIZE', 500))
+    TAGS_RELOAD_SECONDS = int(os.environ.get('TAGS_RELOAD_SECONDS', 60))
+    TAGS_SUGGEST_LIMIT = int(os.environ.get('TAGS_SUGGEST_LIMIT', 10))
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+    PAGE_LIMIT = int(os.environ.get('PAGE_LIMIT', 50))
+    PAGE_LIMIT_MAX = int(os.environ.get('PAGE_LIMIT_MAX', 100))
+    SEARCH_CONFIG = os.environ.get('SEARCH_CONFIG', 'russian')
+    FUZZY_THRESHOLD = float(os.environ.get('FUZZY_THRESHOLD', 0.3))
+    LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', 100))
+    LEADERBOARD_SIZE_MAX = int(os.environ.get('LEADERBOARD_SIZE_MAX', 1000))
+    LEADERBOARD_RECONCILE_SECONDS = int(os.environ.get('LEADERBOARD_RECONCILE_SECONDS', 60))
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 10000))
+    PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 5))
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 10000))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 10))
+    LIKES_WRITE_BEHIND = os.environ.get('LIKES_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+    LIKES_FLUSH_MS = int(os.environ.get('LIKES_FLUSH_MS', 200))
+    LIKES_FLUSH_EVENTS = int(os.environ.get('LIKES_FLUSH_EVENTS', 1000))
+    LIKES_RETRY_SECONDS = int(os.environ.get('LIKES_RETRY_SECONDS', 3600))
+    ASYNC_DB = os.environ.get('ASYNC_DB', 'false').lower() in ('1', 'true', 'yes')
+    URL_DB_ASYNC = os.environ.get('URL_DB_ASYNC', async_url(URL_DB))
+    REPLICA_URLS = [url for url in os.environ.get('REPLICA_URLS', '').split(',') if url]
+    REPLICA_RETRY_SECONDS = int(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+    PASSWORD_WORKERS = int(os.environ.get('PASSWORD_WORKERS', os.cpu_count() or 1))
+    PASSWORD_QUEUE_SIZE = int(os.environ.get('PASSWORD_QUEUE_SIZE', 64))
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+    REPLICA_STICKY_SIZE = int(os.environ.get('REPLICA_STICKY_SIZE', 10000))
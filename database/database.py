@@ -1,16 +1,145 @@
+import itertools
+import threading
+import time
+from typing import List
+
 from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker, declarative_base, Session
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
+from starlette.responses import Response
 
-from config import Config
+from config import Config, async_url
+from utils.cache import TTLCache
 
 
-engine = create_engine(Config.URL_DB)
+# a session is opened in the middleware and used in the threadpool, SQLite must allow it
+connect_args = {'check_same_thread': False} if Config.URL_DB.startswith('sqlite') else {}
+engine = create_engine(Config.URL_DB, connect_args=connect_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# async mode: the same ORM code runs on an asyncio driver (asyncpg, aiosqlite) through AsyncSession.run_sync
+async_engine = create_async_engine(Config.URL_DB_ASYNC) if Config.ASYNC_DB else None
+AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=async_engine, class_=AsyncSession) \
+    if Config.ASYNC_DB else None
+
 Base = declarative_base()
 
+# methods that change data, the client reads from the primary after them
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+STICKY_COOKIE = 'read_primary'
+
 
 def get_db(request: Request):
     return request.state.db
+
+
+async def get_read_db(request: Request):
+    """Connection for read-only requests: a replica, or the primary (request.state.db) if there are no
+    healthy replicas or the client has written something within Config.REPLICA_STICKY_SECONDS
+    (so it reads its own writes)
+
+    Routes that can answer from a cache await it only when the response is made, so no replica
+    session is opened for cached responses.
+    """
+    if not replicas.sessions or written_recently(request):
+        return request.state.db
+    request.state.read_db = await replicas.open()
+    return request.state.read_db or request.state.db
+
+
+def written_recently(request: Request) -> bool:
+    """Whether the client has written something within Config.REPLICA_STICKY_SECONDS: the token is in
+    recent_writers of this process or the client sent back the cookie set by mark_written (it is seen
+    by all the processes of the service)
+    """
+    return STICKY_COOKIE in request.cookies or bool(recent_writers.get(request.headers.get('jwt')))
+
+
+def mark_written(request: Request, response: Response):
+    """Send the next reads of the client to the primary for Config.REPLICA_STICKY_SECONDS"""
+    if 'jwt' not in request.headers:
+        return
+    recent_writers.set(request.headers['jwt'], True)
+    response.set_cookie(STICKY_COOKIE, '1', max_age=Config.REPLICA_STICKY_SECONDS, httponly=True)
+
+
+def open_session():
+    return AsyncSessionLocal() if Config.ASYNC_DB else SessionLocal()
+
+
+async def close_session(db):
+    if isinstance(db, AsyncSession):
+        await db.close()
+    else:
+        db.close()
+
+
+async def run_db(db, fn, *args, **kwargs):
+    """Call fn(session, *args, **kwargs), where fn works with a usual (sync) Session
+
+    In async mode fn runs in AsyncSession.run_sync, so it doesn't block the event loop while waiting
+    for the database, otherwise it runs in the threadpool.
+
+    :param db: database connection of the request (Session or AsyncSession)
+    :param fn: function that takes the session as the first argument
+    :return: result of fn
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+
+class Replicas:
+    """Read replicas taken in turn (round-robin). A replica whose connection failed is skipped
+    for Config.REPLICA_RETRY_SECONDS"""
+
+    def __init__(self, urls: List[str], async_db: bool = False, retry: float = Config.REPLICA_RETRY_SECONDS):
+        self.sessions = []
+        for url in urls:
+            if async_db:
+                replica_engine = create_async_engine(async_url(url), pool_pre_ping=True)
+                self.sessions.append(sessionmaker(autocommit=False, autoflush=False, bind=replica_engine,
+                                                  class_=AsyncSession))
+            else:
+                replica_engine = create_engine(url, pool_pre_ping=True, connect_args={
+                    'check_same_thread': False} if url.startswith('sqlite') else {})
+                self.sessions.append(sessionmaker(autocommit=False, autoflush=False, bind=replica_engine))
+        self.failed_at = [None] * len(urls)
+        self.retry = retry
+        self.turn = itertools.count()
+        self.lock = threading.Lock()
+
+    def available(self) -> List[int]:
+        """Numbers of the replicas that are not known to be down, starting from the next in turn"""
+        with self.lock:
+            start = next(self.turn)
+        now = time.monotonic()
+        order = [(start + i) % len(self.sessions) for i in range(len(self.sessions))]
+        return [i for i in order if self.failed_at[i] is None or now - self.failed_at[i] >= self.retry]
+
+    async def open(self):
+        """Open a session on the next healthy replica. The connection is checked out (and pinged)
+        right away, so a replica that is down is noticed here and the next one is tried
+
+        :return: Session (AsyncSession in async mode), None if all replicas are down
+        """
+        for i in self.available():
+            db = self.sessions[i]()
+            try:
+                await run_db(db, Session.connection)
+            except (DBAPIError, OSError) as e:
+                print(f'Error: replica {i} is unavailable: {e}')
+                self.failed_at[i] = time.monotonic()
+                await close_session(db)
+                continue
+            self.failed_at[i] = None
+            return db
+        return None
+
+
+replicas = Replicas(Config.REPLICA_URLS, Config.ASYNC_DB)
+# per process: with several workers only the clients keeping the cookie read their writes on any of them
+recent_writers = TTLCache(Config.REPLICA_STICKY_SIZE, Config.REPLICA_STICKY_SECONDS)
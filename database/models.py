@@ -1,7 +1,22 @@
-from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Text, Date, UniqueConstraint
-from sqlalchemy.orm import relationship
+from sqlalchemy import Boolean, Column, Integer, String, ForeignKey, Text, Date, UniqueConstraint, Index, DDL, \
+    event, inspect, JSON, DateTime, func
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import relationship, deferred
+from sqlalchemy.types import TypeDecorator
 
 from database.database import Base
+from utils.search import recipe_vector
+
+
+class TSVector(TypeDecorator):
+    """tsvector in PostgreSQL, text with the words of a document in other databases"""
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.TSVECTOR())
+        return dialect.type_descriptor(Text())
 
 
 class User(Base):
@@ -24,6 +39,7 @@ class User(Base):
 
 class Recipe(Base):
     __tablename__ = "recipes"
+    __table_args__ = (Index('ix_recipes_likes_count_id', 'likes_count', 'id'),)
 
     id = Column(Integer, primary_key=True, index=True)
     author_id = Column(Integer, ForeignKey("users.id"))
@@ -31,9 +47,15 @@ class Recipe(Base):
     description = Column(String)
     steps_making = Column(Text)
     photo = Column(String)
+    photo_variants = Column(JSON)
     type = Column(String)
     is_active = Column(Boolean, default=True)
     date_creation = Column(Date)
+    likes_count = Column(Integer, default=0, server_default='0', nullable=False)
+    # only the search filters by it, the recipes are loaded without it
+    search_vector = deferred(Column(TSVector))
+    # changed by every UPDATE of the row (likes too), incremental exports read the recipes changed since a time
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), index=True)
 
     author = relationship("User", back_populates="my_recipe")
     recipe_likes = relationship("Likes", back_populates="recipe")
@@ -42,9 +64,33 @@ class Recipe(Base):
 
     def __str__(self):
         return f"id={self.id} | author_id={self.author_id} | name={self.name} | description={self.description} | " \
-               f"steps_making={self.steps_making} | photo={self.photo} | type={self.type} | is_active={self.is_active} | " \
-               f"date_creation={self.date_creation} | author={self.author} | recipe_likes={self.recipe_likes} | " \
-               f"tags={self.tags}"
+               f"steps_making={self.steps_making} | photo={self.photo} | photo_variants={self.photo_variants} | " \
+               f"type={self.type} | is_active={self.is_active} | " \
+               f"date_creation={self.date_creation} | likes_count={self.likes_count} | updated_at={self.updated_at} | " \
+               f"author={self.author} | " \
+               f"recipe_likes={self.recipe_likes} | tags={self.tags}"
+
+
+@event.listens_for(Recipe, 'before_insert')
+def set_search_vector(mapper, connection, target):
+    target.search_vector = recipe_vector(connection.dialect.name, target.name, target.description,
+                                         target.steps_making)
+
+
+@event.listens_for(Recipe, 'before_update')
+def update_search_vector(mapper, connection, target):
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in ('name', 'description', 'steps_making')):
+        set_search_vector(mapper, connection, target)
+
+
+event.listen(Recipe.__table__, 'before_create', DDL(
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql'))
+event.listen(Recipe.__table__, 'after_create', DDL(
+    'CREATE INDEX ix_recipes_search_vector ON recipes USING gin (search_vector)').execute_if(dialect='postgresql'))
+event.listen(Recipe.__table__, 'after_create', DDL(
+    'CREATE INDEX ix_recipes_name_trgm ON recipes USING gin (name gin_trgm_ops)').execute_if(dialect='postgresql'))
+
 
 class Hashtag(Base):
     __tablename__ = "hashtags"
@@ -83,4 +129,27 @@ class Likes(Base):
 
     def __str__(self):
         return f"id={self.id} | user_id={self.user_id} | recipe_id={self.recipe_id} | recipe={self.recipe} | " \
-               f"user={self.user}"
\ No newline at end of file
+               f"user={self.user}"
+
+class Photo(Base):
+    """Stored photo file (the key in utils.storage) and the number of recipes that use it"""
+    __tablename__ = "photos"
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, index=True)
+    refcount = Column(Integer, default=0, nullable=False)
+
+    def __str__(self):
+        return f"id={self.id} | key={self.key} | refcount={self.refcount}"
+
+
+class TagCount(Base):
+    """Number of active recipes of the type with the hashtag, changed together with the recipes"""
+    __tablename__ = "tag_counts"
+    __table_args__ = (UniqueConstraint('tag_id', 'type', name='unique_tag_count'),)
+    id = Column(Integer, primary_key=True, index=True)
+    tag_id = Column(Integer, ForeignKey("hashtags.id"), index=True)
+    type = Column(String, index=True)
+    count = Column(Integer, default=0, nullable=False)
+
+    def __str__(self):
+        return f"id={self.id} | tag_id={self.tag_id} | type={self.type} | count={self.count}"
@@ -49,6 +49,10 @@ class RecipeCreate(RecipeBase):
     author_id: int
 
 
+class RecipeImport(RecipeBase):
+    tags: List[str] = []
+
+
 class RecipeChange(BaseModel):
     name: str = None
     description: str = None
@@ -59,9 +63,11 @@ class RecipeChange(BaseModel):
 class RecipeShow(RecipeBase):
     id: int
     photo: str = None
+    photo_variants: dict = None
     author: str
     likes: int
     tags: list
+    liked_by_me: bool = None
 
 
 class Recipe(RecipeBase):
@@ -115,6 +121,10 @@ class Hashtag(HashtagBase):
         orm_mode = True
 
 
+class HashtagCount(HashtagBase):
+    count: int
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
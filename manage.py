@@ -0,0 +1,49 @@
+import argparse
+
+from database.database import SessionLocal
+from service import likes, recipe, hashtag
+
+
+def reconcile_likes(args):
+    db = SessionLocal()
+    try:
+        fixed = likes.reconcile_likes_count(db)
+    finally:
+        db.close()
+    print(f'Like counters fixed: {fixed}')
+
+
+def reconcile_tags(args):
+    db = SessionLocal()
+    try:
+        fixed = hashtag.reconcile_tag_counts(db)
+    finally:
+        db.close()
+    print(f'Tag counters fixed: {fixed}')
+
+
+def reindex_search(args):
+    db = SessionLocal()
+    try:
+        updated = recipe.reindex_search(db)
+    finally:
+        db.close()
+    print(f'Search vectors updated: {updated}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recipe-Service maintenance commands')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    commands.add_parser('reconcile-likes', help='recount recipes.likes_count from the likes table') \
+        .set_defaults(handler=reconcile_likes)
+    commands.add_parser('reconcile-tags', help='recount tag_counts from the active recipes') \
+        .set_defaults(handler=reconcile_tags)
+    commands.add_parser('reindex-search', help='recalculate full-text search vectors of recipes') \
+        .set_defaults(handler=reindex_search)
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,20 +2,82 @@ import os
 from datetime import datetime
 from typing import List
 
-from fastapi import status, Body, APIRouter, HTTPException, Depends, Header, UploadFile, File
+from fastapi import status, Body, APIRouter, HTTPException, Depends, Header, UploadFile, File, Query, Request
+from pydantic import ValidationError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
 
 from database import schemas
-from database.database import get_db
-from service import recipe, likes, user
-from utils import auth
+from database.database import get_db, get_read_db, run_db, SessionLocal
+from service import recipe, likes, user, hashtag, photo as photo_service
+from utils import auth, upload, versions, bulk
 from config import Config
+from utils.http_cache import ConditionalResponse
+from utils.pagination import Page
+from utils.responses import FileRangeResponse, accepts_encoding
+from utils.storage import storage
 
 router = APIRouter()
 
+# data shown in lists of recipes, their responses are cached until it changes
+RECIPES_DATA = (versions.RECIPES, versions.LIKES, versions.TAGS)
+
+
+def stat_photo(key: str):
+    path = storage.local_path(key)
+    try:
+        return path, os.stat(path) if path else None
+    except FileNotFoundError:
+        return path, None
+
+
+def export_batches(since: datetime = None):
+    # a session of its own: the batches are read from the threadpool after the request session is closed.
+    # It is closed when the stream ends or is dropped (write_items closes the generator)
+    export_db = SessionLocal()
+    try:
+        yield from recipe.export_recipes(export_db, since)
+    finally:
+        export_db.close()
+
+
+async def save_photo(db, recipe_id: int, received: upload.StoredFile):
+    """recipe.add_photo with the storage I/O in the threadpool: in async mode the database calls run on
+    the event loop. The transaction stays open meanwhile, so the photo rows are locked as in add_photo"""
+    try:
+        change = await run_db(db, recipe.change_photo, recipe_id, received.key)
+        if change is None:
+            return None
+        await run_in_threadpool(recipe.store_photo_files, change, received.path)
+        return await run_db(db, recipe.commit_photo, change)
+    except Exception as e:
+        print(f'Error: {e}')
+        await run_db(db, Session.rollback)
+        return None
+
+
+async def remove_recipe(db, recipe_id: int) -> bool:
+    """recipe.delete_recipe with the files of the released photo deleted in the threadpool"""
+    try:
+        removal = await run_db(db, recipe.remove_recipe, recipe_id)
+        if removal is None:
+            return False
+        if removal.released_photo is not None:
+            await run_in_threadpool(photo_service.delete_photo_files, removal.released_photo)
+        await run_db(db, recipe.commit_removal, removal)
+    except Exception as e:
+        print(f'Error: {e}')
+        await run_db(db, Session.rollback)
+    return True
+
+
+def cursor_headers(recipes: Page) -> dict:
+    return {'X-Next-Cursor': recipes.next_cursor} if recipes.next_cursor else {}
+
 
 @router.post("", status_code=status.HTTP_201_CREATED, response_model=schemas.RecipeShow)
-def create_recipe(recipe_data: schemas.RecipeCreate = Body(
+async def create_recipe(recipe_data: schemas.RecipeCreate = Body(
     ...,
     example={
         'name': 'Recipe',
@@ -26,159 +88,294 @@ def create_recipe(recipe_data: schemas.RecipeCreate = Body(
         'date_creation': datetime.today().date(),
         'author_id': 1}), tags=Body(..., example={'tags': ['tag1', 'tag2']}),
         jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
-    db_user = auth.get_current_user(jwt)
+    db_user = await auth.get_current_user_async(jwt, db)
     if not db_user.is_active:
         raise HTTPException(status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
                             detail='You don`t have permission to create a recipe')
     if recipe_data.type not in Config.TYPES_RECIPE:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid recipe type')
-    db_recipe = recipe.create_recipe(db, schemas.RecipeCreate(**recipe_data.dict()), db_user.id, tags)
-    return schemas.RecipeShow(id=db_recipe.id, name=db_recipe.name, description=db_recipe.description,
-                              steps_making=db_recipe.steps_making, type=db_recipe.type,
-                              tags=[tag.tag.tag for tag in db_recipe.tags],
-                              likes=len(db_recipe.recipe_likes), is_active=db_recipe.is_active,
-                              date_creation=db_recipe.date_creation, photo=db_recipe.photo,
-                              author=db_recipe.author.nickname)
+    db_recipe = await run_db(db, recipe.create_recipe, schemas.RecipeCreate(**recipe_data.dict()), db_user.id,
+                             tags)
+    if db_recipe is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='The recipe could not be saved')
+    return (await run_db(db, recipe.get_recipes_show, [db_recipe]))[0]
+
+
+def parse_import_item(item) -> tuple:
+    """Validate an item of the bulk import
+
+    :return: object RecipeImport and None, or None and the error
+    """
+    if isinstance(item, bulk.InvalidItem):
+        return None, str(item)
+    try:
+        recipe_data = schemas.RecipeImport.parse_obj(item)
+    except ValidationError as e:
+        return None, e.errors()
+    if recipe_data.type not in Config.TYPES_RECIPE:
+        return None, 'Invalid recipe type'
+    return recipe_data, None
+
+
+@router.post('/bulk', status_code=status.HTTP_200_OK)
+async def import_recipes(request: Request, jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
+    """Create recipes from a JSON array or from NDJSON (Content-Type: application/x-ndjson, a recipe per line).
+    A recipe has the fields of recipe_data in POST /recipe and its hashtags in the field tags"""
+    db_user = await auth.get_current_user_async(jwt, db)
+    if db_user.role != 'admin':
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="No access")
+    recipes_id, errors = [], []
+    try:
+        async for batch in bulk.read_items(request, Config.BULK_BATCH_SIZE):
+            valid = []
+            for index, item in batch:
+                recipe_data, error = parse_import_item(item)
+                if error is None:
+                    valid.append((index, recipe_data))
+                else:
+                    errors.append({'index': index, 'error': error})
+            created = await run_db(db, recipe.import_recipes, [recipe_data for _, recipe_data in valid], db_user.id)
+            if created is None:
+                errors += [{'index': index, 'error': 'The recipe could not be saved'} for index, _ in valid]
+            else:
+                recipes_id += created
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail='Invalid body, a JSON array or NDJSON is expected')
+    errors.sort(key=lambda error: error['index'])
+    return {'created': len(recipes_id), 'ids': recipes_id, 'errors': errors}
+
+
+@router.get('/export', status_code=status.HTTP_200_OK)
+async def export_recipes(request: Request, since: datetime = None, jwt: str = Header(..., example='key'),
+                         db: Session = Depends(get_db)):
+    """All recipes as NDJSON (one recipe per line, in the order of id), gzip-compressed if the client
+    accepts it. The recipes are read by batches of Config.EXPORT_BATCH_SIZE while the response is sent;
+    with `since` only the recipes changed at that time or later are exported
+    """
+    db_user = await auth.get_current_user_async(jwt, db)
+    if db_user.role != 'admin':
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="No access")
+    compress = accepts_encoding(request.headers.get('accept-encoding', ''), 'gzip')
+    return StreamingResponse(bulk.write_items(export_batches(since), compress),
+                             media_type='application/x-ndjson',
+                             headers={'content-encoding': 'gzip', 'vary': 'accept-encoding'} if compress else {})
 
 
 @router.put("/{recipe_id}", status_code=status.HTTP_200_OK, response_model=schemas.RecipeShow)
-def change_recipe(recipe_id: str, recipe_data: schemas.RecipeChange = Body(
+async def change_recipe(recipe_id: str, recipe_data: schemas.RecipeChange = Body(
     ...,
     example={
         'name': 'Recipe',
         'description': 'Description',
         'steps_making': '1. Step one 2. Step two',
         'type': 'Десерт'}), jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
-    db_user = auth.get_current_user(jwt)
-    db_recipe = recipe.change_recipe(db, int(recipe_id), schemas.RecipeChange(**recipe_data.dict()), db_user.id)
+    db_user = await auth.get_current_user_async(jwt, db)
+    db_recipe = await run_db(db, recipe.change_recipe, int(recipe_id), schemas.RecipeChange(**recipe_data.dict()),
+                             db_user.id)
     if db_recipe is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail='The user does not have a recipe with this ID')
-    return schemas.RecipeShow(id=db_recipe.id, name=db_recipe.name, description=db_recipe.description,
-                              steps_making=db_recipe.steps_making, type=db_recipe.type,
-                              tags=[tag.tag.tag for tag in db_recipe.tags],
-                              likes=len(db_recipe.recipe_likes), is_active=db_recipe.is_active,
-                              date_creation=db_recipe.date_creation, photo=db_recipe.photo,
-                              author=db_recipe.author.nickname)
+    return (await run_db(db, recipe.get_recipes_show, [db_recipe]))[0]
 
 
 @router.post("/{recipe_id}", status_code=status.HTTP_201_CREATED, response_model=schemas.RecipeShow)
-def add_photo(recipe_id: str, photo: UploadFile = File(...), jwt: str = Header(..., example='key'),
-              db: Session = Depends(get_db)):
-    auth.get_current_user(jwt)
-    file_extension = photo.filename.split('.')[1]
-    if file_extension not in ['jpg', 'jpeg', 'png']:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid file extension')
-    url_photo = f"{Config.BASE_DIR_IMAGES}/{recipe_id}_{photo.filename}"
-    with open(url_photo, 'wb') as f:
-        f.write(photo.file.read())
-    db_recipe = recipe.add_photo(db, int(recipe_id), url_photo)
-    return schemas.RecipeShow(id=db_recipe.id, name=db_recipe.name, description=db_recipe.description,
-                              steps_making=db_recipe.steps_making, type=db_recipe.type,
-                              tags=[tag.tag.tag for tag in db_recipe.tags],
-                              likes=len(db_recipe.recipe_likes), is_active=db_recipe.is_active,
-                              date_creation=db_recipe.date_creation, photo=db_recipe.photo,
-                              author=db_recipe.author.nickname)
+async def add_photo(recipe_id: str, photo: UploadFile = File(...), jwt: str = Header(..., example='key'),
+                    db: Session = Depends(get_db)):
+    await auth.get_current_user_async(jwt, db)
+    try:
+        recipe_id = int(recipe_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid recipe_id must be a number')
+    if await run_db(db, recipe.get_recipe, recipe_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The recipe was not found')
+    try:
+        received = await run_in_threadpool(upload.receive_upload, photo.file, storage)
+    except upload.InvalidImage:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid file, only jpg and png images')
+    except upload.PhotoTooLarge:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail='The photo is too large')
+    try:
+        db_recipe = await save_photo(db, recipe_id, received)
+    finally:
+        await run_in_threadpool(upload.discard_upload, received)
+    if db_recipe is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='The photo could not be saved')
+    photo_service.schedule_variants(recipe_id, received.key)
+    return (await run_db(db, recipe.get_recipes_show, [db_recipe]))[0]
+
+
+@router.api_route('/{recipe_id}/photo', methods=['GET', 'HEAD'], status_code=status.HTTP_200_OK,
+                  response_class=FileRangeResponse)
+async def get_photo(recipe_id: str, request: Request, variant: str = None, db: Session = Depends(get_read_db)):
+    if variant is not None and variant not in Config.PHOTO_VARIANTS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid photo variant')
+    try:
+        key, final = await run_db(db, recipe.get_photo_key, int(recipe_id), variant)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid recipe_id must be a number')
+    url_photo, stat_result = await run_in_threadpool(stat_photo, key) if key else (None, None)
+    if stat_result is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='The recipe has no photo')
+    # the URL stays the same when the photo is replaced, so it is cached briefly and then revalidated by ETag;
+    # the original photo in place of a variant that isn't made yet is not cached at all
+    cache_control = f'public, max-age={Config.PHOTO_MAX_AGE}' if final else 'no-store'
+    return FileRangeResponse(url_photo, stat_result, request.headers, request.method,
+                             headers={'cache-control': cache_control})
 
 
 @router.get("", status_code=status.HTTP_200_OK, response_model=List[schemas.RecipeShow])
-def get_recipes(jwt: str = Header(..., example='key'), name: str = None, type: str = None, tag: str = None,
-                db: Session = Depends(get_db)):
-    db_user = auth.get_current_user(jwt)
-    recipes = recipe.get_recipe_by_filter(db, name, type, tag)
-    return [schemas.RecipeShow(id=db_recipe.id, name=db_recipe.name, description=db_recipe.description,
-                               steps_making=db_recipe.steps_making, type=db_recipe.type,
-                               tags=[tag.tag.tag for tag in db_recipe.tags],
-                               likes=len(db_recipe.recipe_likes), is_active=db_recipe.is_active,
-                               date_creation=db_recipe.date_creation, photo=db_recipe.photo,
-                               author=db_recipe.author.nickname) for db_recipe in recipes]
+async def get_recipes(request: Request, jwt: str = Header(..., example='key'), name: str = None,
+                      type: str = None, tag: str = None, tags: List[str] = Query(None),
+                      tags_mode: str = Query('all', regex='^(all|any)$'), q: str = None, name_fuzzy: bool = False,
+                      cursor: str = None, limit: int = Config.PAGE_LIMIT, db: Session = Depends(get_db)):
+    db_user = await auth.get_current_user_async(jwt, db)
+    conditional = ConditionalResponse(request, db_user.id, RECIPES_DATA)
+    cached = conditional.cached()
+    if cached is not None:
+        return cached
+    read_db = await get_read_db(request)
+    try:
+        recipes = await run_db(read_db, recipe.get_recipe_by_filter, name, type, tag, cursor, limit, q, name_fuzzy,
+                               tags, tags_mode)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor')
+    return conditional.respond(await run_db(read_db, recipe.get_recipes_data, recipes, db_user.id),
+                               cursor_headers(recipes))
 
 
 @router.get('/top', status_code=status.HTTP_200_OK, response_model=List[schemas.RecipeShow])
-def get_top_recipes(limit: int = 10, jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
-    db_user = auth.get_current_user(jwt)
-    recipes = recipe.get_top_recipe(db, limit)
-    return [schemas.RecipeShow(id=db_recipe.id, name=db_recipe.name, description=db_recipe.description,
-                               steps_making=db_recipe.steps_making, type=db_recipe.type,
-                               tags=[tag.tag.tag for tag in db_recipe.tags],
-                               likes=len(db_recipe.recipe_likes), is_active=db_recipe.is_active,
-                               date_creation=db_recipe.date_creation, photo=db_recipe.photo,
-                               author=db_recipe.author.nickname) for db_recipe in recipes]
+async def get_top_recipes(request: Request, limit: int = 10, cursor: str = None,
+                          jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
+    db_user = await auth.get_current_user_async(jwt, db)
+    conditional = ConditionalResponse(request, db_user.id, RECIPES_DATA)
+    cached = conditional.cached()
+    if cached is not None:
+        return cached
+    read_db = await get_read_db(request)
+    try:
+        recipes = await run_db(read_db, recipe.get_top_recipe, limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor')
+    return conditional.respond(await run_db(read_db, recipe.get_recipes_data, recipes, db_user.id),
+                               cursor_headers(recipes))
 
 
 @router.post('/{recipe_id}/like', status_code=status.HTTP_200_OK)
-def like_recipe(recipe_id: str, jwt: str = Header(..., example='key'),
-                db: Session = Depends(get_db)):
-    db_user = auth.get_current_user(jwt)
+async def like_recipe(recipe_id: str, jwt: str = Header(..., example='key'),
+                      db: Session = Depends(get_db)):
+    db_user = await auth.get_current_user_async(jwt, db)
     try:
         like = schemas.LikeCreate(user_id=db_user.id, recipe_id=int(recipe_id))
-        db_like = likes.like_it(db, like)
     except ValueError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid recipe_id must be a number')
-    if db_like.id is None:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='There is no such recipe')
-    profile = user.get_profile(db, db_user.id)
+    if Config.LIKES_WRITE_BEHIND:
+        liked = await run_db(db, likes.toggle_like, like)
+        result = likes.MISSING if liked is None else likes.ADDED if liked else likes.REMOVED
+    else:
+        result = await run_db(db, likes.like_it, like)
+    if result == likes.MISSING:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='There is no such recipe')
+    if result == likes.FAILED:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='The like could not be saved')
+    # the profile is read from the primary: it must contain the like that has just been written
+    profile = await run_db(db, user.get_profile, db_user.id)
     return {'user_id': profile['id'], 'favorites': profile['favorites']}
 
 
 @router.get('/like', status_code=status.HTTP_200_OK, response_model=List[schemas.RecipeShow])
-def get_favorites_recipe(jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
-    db_user = auth.get_current_user(jwt)
-    favorites = user.get_profile(db, db_user.id)['favorites']
-    recipes = recipe.get_recipes_by_id(db, favorites)
-    return [schemas.RecipeShow(id=db_recipe.id, name=db_recipe.name, description=db_recipe.description,
-                               steps_making=db_recipe.steps_making, type=db_recipe.type,
-                               tags=[tag.tag.tag for tag in db_recipe.tags],
-                               likes=len(db_recipe.recipe_likes), is_active=db_recipe.is_active,
-                               date_creation=db_recipe.date_creation, photo=db_recipe.photo,
-                               author=db_recipe.author.nickname) for db_recipe in recipes]
+async def get_favorites_recipe(request: Request, cursor: str = None, limit: int = Config.PAGE_LIMIT,
+                               jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
+    db_user = await auth.get_current_user_async(jwt, db)
+    if likes.like_buffer.user_changes(db_user.id):
+        # the favorites are paginated by the database, so the likes of the user are written first
+        await run_in_threadpool(likes.flush_likes)
+    conditional = ConditionalResponse(request, db_user.id, RECIPES_DATA)
+    cached = conditional.cached()
+    if cached is not None:
+        return cached
+    read_db = await get_read_db(request)
+    try:
+        recipes = await run_db(read_db, recipe.get_favorite_recipes, db_user.id, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor')
+    return conditional.respond(await run_db(read_db, recipe.get_recipes_data, recipes, db_user.id),
+                               cursor_headers(recipes))
 
 
 @router.get('/my', status_code=status.HTTP_200_OK, response_model=List[schemas.RecipeShow])
-def get_my_recipes(jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
-    db_user = auth.get_current_user(jwt)
-    my_recipe = recipe.get_user_recipes(db, db_user.id)
-    return [schemas.RecipeShow(id=db_recipe.id, name=db_recipe.name, description=db_recipe.description,
-                               steps_making=db_recipe.steps_making, type=db_recipe.type,
-                               tags=[tag.tag.tag for tag in db_recipe.tags],
-                               likes=len(db_recipe.recipe_likes), is_active=db_recipe.is_active,
-                               date_creation=db_recipe.date_creation, photo=db_recipe.photo,
-                               author=db_recipe.author.nickname) for db_recipe in my_recipe]
+async def get_my_recipes(request: Request, cursor: str = None, limit: int = Config.PAGE_LIMIT,
+                         jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
+    db_user = await auth.get_current_user_async(jwt, db)
+    conditional = ConditionalResponse(request, db_user.id, RECIPES_DATA)
+    cached = conditional.cached()
+    if cached is not None:
+        return cached
+    read_db = await get_read_db(request)
+    try:
+        my_recipe = await run_db(read_db, recipe.get_user_recipes, db_user.id, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid cursor')
+    return conditional.respond(await run_db(read_db, recipe.get_recipes_data, my_recipe, db_user.id),
+                               cursor_headers(my_recipe))
+
+
+@router.get('/tags', status_code=status.HTTP_200_OK, response_model=List[schemas.HashtagCount])
+async def get_tags(request: Request, type: str = None, jwt: str = Header(..., example='key'),
+                   db: Session = Depends(get_db)):
+    await auth.get_current_user_async(jwt, db)
+    # the same for all users
+    conditional = ConditionalResponse(request, None, (versions.TAGS,))
+    cached = conditional.cached()
+    if cached is not None:
+        return cached
+    read_db = await get_read_db(request)
+    return conditional.respond(await run_db(read_db, hashtag.get_tags_statistics, type))
+
+
+@router.get('/tags/suggest', status_code=status.HTTP_200_OK, response_model=List[schemas.HashtagCount])
+async def suggest_tags(request: Request, prefix: str = '', limit: int = Config.TAGS_SUGGEST_LIMIT,
+                       jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
+    await auth.get_current_user_async(jwt, db)
+    if hashtag.tag_dictionary_outdated():
+        await run_db(await get_read_db(request), hashtag.get_tag_dictionary)
+    suggestions = hashtag.tag_dictionary.suggest(prefix, min(max(limit, 1), Config.PAGE_LIMIT_MAX))
+    return [{'tag': tag, 'count': count} for tag, count in suggestions]
 
 
 @router.put('/{recipe_id}/ban', status_code=status.HTTP_200_OK, response_model=schemas.RecipeShow)
-def ban_recipe(recipe_id: str, jwt: str = Header(..., example='key'),
-               db: Session = Depends(get_db)):
-    db_user = auth.get_current_user(jwt)
+async def ban_recipe(recipe_id: str, jwt: str = Header(..., example='key'),
+                     db: Session = Depends(get_db)):
+    db_user = await auth.get_current_user_async(jwt, db)
     if db_user.role != 'admin':
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="No access")
     try:
-        db_recipe = recipe.ban_recipe(db, int(recipe_id))
+        db_recipe = await run_db(db, recipe.ban_recipe, int(recipe_id))
     except ValueError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid recipe_id must be a number')
     if db_recipe is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='There is no such recipe')
-    return schemas.RecipeShow(id=db_recipe.id, name=db_recipe.name, description=db_recipe.description,
-                              steps_making=db_recipe.steps_making, type=db_recipe.type,
-                              tags=[tag.tag.tag for tag in db_recipe.tags],
-                              likes=len(db_recipe.recipe_likes), is_active=db_recipe.is_active,
-                              date_creation=db_recipe.date_creation, photo=db_recipe.photo,
-                              author=db_recipe.author.nickname)
+    return (await run_db(db, recipe.get_recipes_show, [db_recipe]))[0]
 
 
 @router.delete('/{recipe_id}', status_code=status.HTTP_200_OK)
-def delete_recipe(recipe_id: str, jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
-    db_user = auth.get_current_user(jwt)
+async def delete_recipe(recipe_id: str, jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
+    db_user = await auth.get_current_user_async(jwt, db)
     if db_user.role != 'admin':
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="No access")
     try:
-        db_recipe = recipe.delete_recipe(db, int(recipe_id))
+        recipe_id = int(recipe_id)
     except ValueError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid recipe_id must be a number')
+    db_recipe = await remove_recipe(db, recipe_id)
     if db_recipe is False:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='There is no such recipe')
     return {'detail': f'The recipe ({recipe_id}) was deleted'}
\ No newline at end of file
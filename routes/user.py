@@ -1,22 +1,31 @@
-from fastapi import status, Body, APIRouter, HTTPException, Depends, Header
+from fastapi import status, Body, APIRouter, HTTPException, Depends, Header, Query
 from sqlalchemy.orm import Session
 
+from config import Config
 from database import schemas
-from database.database import get_db
+from database.database import get_db, get_read_db, run_db
 from service import user
 from utils import auth
 
 router = APIRouter()
 
 
+def password_queue_full() -> HTTPException:
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Too many requests, try again later',
+                         headers={'Retry-After': '1'})
+
+
 @router.post("", status_code=status.HTTP_201_CREATED, response_model=schemas.UserShow)
-def create_user(user_data: schemas.UserCreate = Body(
+async def create_user(user_data: schemas.UserCreate = Body(
     ...,
     example={
         "nickname": "nick",
         "password": "password"
     }), db: Session = Depends(get_db)):
-    db_user = user.registration(db, user_data, 'user')
+    try:
+        db_user = await user.registration_async(db, user_data, 'user')
+    except auth.PasswordQueueFull:
+        raise password_queue_full()
     if not db_user.id:
         raise HTTPException(status_code=400, detail="Nickname already registered")
     return schemas.UserShow(id=db_user.id, nickname=db_user.nickname, is_active=db_user.is_active)
@@ -29,28 +38,34 @@ async def login(user_data: schemas.UserCreate = Body(
         "nickname": "nick",
         "password": "password"
     }), db: Session = Depends(get_db)):
-    token = user.login(db, user_data)
+    try:
+        token = await user.login_async(db, user_data)
+    except auth.PasswordQueueFull:
+        raise password_queue_full()
     if 'error' in token.keys():
         raise HTTPException(status_code=400, detail=token['error'])
     return token
 
 
 @router.get("")
-def user_profile(jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
-    db_user = auth.get_current_user(jwt)
-    return user.get_profile(db, db_user.id)
+async def user_profile(favorites_limit: int = Query(None, ge=1, le=Config.PAGE_LIMIT_MAX),
+                       favorites_after: int = None,
+                       jwt: str = Header(..., example='key'), db: Session = Depends(get_db),
+                       read_db: Session = Depends(get_read_db)):
+    db_user = await auth.get_current_user_async(jwt, db)
+    return await run_db(read_db, user.get_profile, db_user.id, favorites_limit, favorites_after)
 
 
 @router.put('/{user_id}/ban', status_code=status.HTTP_200_OK, response_model=schemas.UserShow)
-def ban_recipe(user_id: str, jwt: str = Header(..., example='key'),
-               db: Session = Depends(get_db)):
-    db_user = auth.get_current_user(jwt)
+async def ban_recipe(user_id: str, jwt: str = Header(..., example='key'),
+                     db: Session = Depends(get_db)):
+    db_user = await auth.get_current_user_async(jwt, db)
     if db_user.role != 'admin':
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="No access")
     try:
-        db_user = user.ban_user(db, int(user_id))
+        db_user = await run_db(db, user.ban_user, int(user_id))
     except ValueError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid user_id must be a number')
     if db_user is None:
@@ -59,14 +74,14 @@ def ban_recipe(user_id: str, jwt: str = Header(..., example='key'),
 
 
 @router.delete('/{user_id}', status_code=status.HTTP_200_OK)
-def delete_user(user_id: str, jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
-    db_user = auth.get_current_user(jwt)
+async def delete_user(user_id: str, jwt: str = Header(..., example='key'), db: Session = Depends(get_db)):
+    db_user = await auth.get_current_user_async(jwt, db)
     if db_user.role != 'admin':
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="No access")
     try:
-        db_recipe = user.delete_user(db, int(user_id))
+        db_recipe = await run_db(db, user.delete_user, int(user_id))
     except ValueError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid recipe_id must be a number')
     if db_recipe is False:
@@ -1,9 +1,17 @@
-from typing import List
+import time
+from typing import List, Dict, Iterable, Tuple
 
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 
+from config import Config
 from database import models
-from utils.db import get_hashtags, get_hashtags_by_tags
+from utils.db import get_hashtags_by_tags, get_hashtags_id, get_hashtags_usage, get_recipe_tags_id, get_tag_counts, \
+    count_active_recipes_tags
+from utils.tags import TagDictionary
+from utils.versions import versions, TAGS
+
+tag_dictionary = TagDictionary()
 
 
 def create_hashtag(db: Session, tags: list) -> List[models.Hashtag]:
@@ -11,42 +19,159 @@ def create_hashtag(db: Session, tags: list) -> List[models.Hashtag]:
 
     :param db: database connection
     :param tags: list hashtags
-    :return: list (object Hashtag) added hashtags
+    :return: list (object Hashtag) of the hashtags
     """
-    hashtags_db = get_hashtags(db)
-    hashtags_set = set([hashtag.tag for hashtag in hashtags_db])
-    tags = set(tags) - hashtags_set
-    hashtags = []
-    for tag in tags:
-        hashtags.append(models.Hashtag(tag=tag))
     try:
-        db.add_all(hashtags)
+        upsert_hashtags(db, tags)
         db.commit()
-        db.refresh(hashtags)
     except BaseException as e:
         print(f'Error: {e}')
         db.rollback()
+    return get_hashtags_by_tags(db, tags)
+
+
+def add_recipe_hashtags(db: Session, recipe_id: int, hashtags_id: Iterable[int]):
+    """Add hashtags to a recipe in the current transaction, with one statement
+
+    :param db: database connection
+    :param recipe_id: ID of the recipe to add to
+    :param hashtags_id: ids of the hashtags
+    """
+    links = [{'recipe_id': recipe_id, 'tag_id': tag_id} for tag_id in dict.fromkeys(hashtags_id)]
+    if links:
+        db.execute(models.RecipeHashtag.__table__.insert(), links)
+
+
+def upsert_hashtags(db: Session, tags: Iterable[str]) -> Dict[str, int]:
+    """Create the hashtags that don't exist yet in the current transaction, without loading all hashtags.
+    Hashtags created concurrently by another transaction are not an error (ON CONFLICT DO NOTHING).
+    Ids of the hashtags in the tag dictionary are taken from it
 
+    :param db: database connection
+    :param tags: hashtags
+    :return: hashtag -> hashtag id
+    """
+    tags = set(tags)
+    hashtags = {tag: tag_dictionary.get(tag) for tag in tags}
+    hashtags = {tag: tag_id for tag, tag_id in hashtags.items() if tag_id is not None}
+    tags = sorted(tags - hashtags.keys())
+    if not tags:
+        return hashtags
+    dialect = db.bind.dialect.name
+    table = models.Hashtag.__table__
+    if dialect == 'postgresql':
+        # RETURNING gives the ids of the created hashtags only, the existing ones are selected
+        hashtags.update(db.execute(postgresql.insert(table).values([{'tag': tag} for tag in tags]).on_conflict_do_nothing(
+            index_elements=['tag']).returning(table.c.tag, table.c.id)).all())
+        missing = [tag for tag in tags if tag not in hashtags]
+        if missing:
+            hashtags.update(get_hashtags_id(db, missing))
+        return hashtags
+    if dialect == 'sqlite':
+        db.execute(sqlite.insert(table).values([{'tag': tag} for tag in tags]).on_conflict_do_nothing(
+            index_elements=['tag']))
+    else:
+        existing = {tag for tag, _ in get_hashtags_id(db, tags)}
+        db.add_all(models.Hashtag(tag=tag) for tag in tags if tag not in existing)
+        db.flush()
+    hashtags.update(get_hashtags_id(db, tags))
     return hashtags
 
 
-def create_recipe_hashtags(db: Session, recipe_id: int, hashtags: List[str]) -> List[models.RecipeHashtag]:
-    """Add hashtags to a recipe
+def get_tag_dictionary(db: Session) -> TagDictionary:
+    """Get the in-process dictionary of hashtags. It is built on first use and every
+    Config.TAGS_RELOAD_SECONDS (to see the hashtags created by other processes)
 
     :param db: database connection
-    :param recipe_id: ID of the recipe to add to
-    :param hashtags: list hashtags
-    :return:
+    :return: dictionary of hashtags
+    """
+    if tag_dictionary_outdated():
+        tag_dictionary.build(get_hashtags_usage(db))
+    return tag_dictionary
+
+
+def tag_dictionary_outdated() -> bool:
+    return not tag_dictionary.built or time.monotonic() - tag_dictionary.built_at > Config.TAGS_RELOAD_SECONDS
+
+
+def count_hashtags(hashtags: Dict[str, int], tags: Iterable[str], delta: int = 1):
+    """Update the tag dictionary after recipes with the hashtags were committed
+
+    :param hashtags: hashtag -> hashtag id
+    :param tags: hashtags of the recipes, a hashtag once per recipe
+    :param delta: change of the number of recipes with each hashtag
+    """
+    if not tag_dictionary.built:
+        return
+    for tag in tags:
+        tag_dictionary.add(tag, hashtags[tag], delta)
+
+
+def change_tag_counts(db: Session, counts: Dict[Tuple[int, str], int]):
+    """Change the numbers of active recipes by hashtag and recipe type in the current transaction,
+    with one INSERT ... ON CONFLICT DO UPDATE. Rows are written in the order of the key,
+    so concurrent transactions lock them in the same order
+
+    :param db: database connection
+    :param counts: (hashtag id, recipe type) -> change of the number of recipes
+    """
+    rows = [{'tag_id': tag_id, 'type': type, 'count': delta} for (tag_id, type), delta in sorted(counts.items())
+            if delta]
+    if not rows:
+        return
+    table = models.TagCount.__table__
+    dialect = db.bind.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table).values(rows)
+        db.execute(insert.on_conflict_do_update(index_elements=['tag_id', 'type'],
+                                                set_={'count': table.c.count + insert.excluded.count}))
+        return
+    for row in rows:
+        updated = db.query(models.TagCount).filter(
+            models.TagCount.tag_id == row['tag_id'], models.TagCount.type == row['type']).update(
+            {models.TagCount.count: models.TagCount.count + row['count']}, synchronize_session=False)
+        if not updated:
+            db.add(models.TagCount(**row))
+    db.flush()
+
+
+def count_recipe_tags(db: Session, recipe_id: int, type: str, delta: int):
+    """Change the numbers of active recipes for the hashtags of the recipe in the current transaction
+
+    :param db: database connection
+    :param recipe_id: recipe id
+    :param type: recipe type
+    :param delta: 1 if the recipe becomes active, -1 if it stops being active
+    """
+    change_tag_counts(db, {(tag_id, type): delta for tag_id in get_recipe_tags_id(db, recipe_id)})
+
+
+def get_tags_statistics(db: Session, type: str = None) -> List[dict]:
+    """Get hashtags with the number of active recipes using them, the most used first
+
+    :param db: database connection
+    :param type: count only the recipes of the type
+    :return: list with hashtag and count
+    """
+    return [{'tag': tag, 'count': count} for tag, count in get_tag_counts(db, type)]
+
+
+def reconcile_tag_counts(db: Session) -> int:
+    """Recount the numbers of active recipes by hashtag and type from the recipes
+
+    :param db: database connection
+    :return: number of counters fixed
     """
-    hashtags_db = get_hashtags_by_tags(db, hashtags)
-    hashtags_list = []
-    for hashtag in hashtags_db:
-        hashtags_list.append(models.RecipeHashtag(tag_id=hashtag.id, recipe_id=recipe_id))
+    actual = {(tag_id, type): count for tag_id, type, count in count_active_recipes_tags(db)}
+    stored = {(row.tag_id, row.type): row.count for row in db.query(models.TagCount)}
+    counts = {key: actual.get(key, 0) - stored.get(key, 0) for key in actual.keys() | stored.keys()}
+    counts = {key: delta for key, delta in counts.items() if delta}
     try:
-        db.add_all(hashtags_list)
+        change_tag_counts(db, counts)
         db.commit()
-        db.refresh(hashtags_list)
+        versions.bump(TAGS)
     except BaseException as e:
         print(f'Error: {e}')
         db.rollback()
-    return hashtags_list
+        return 0
+    return len(counts)
@@ -1,31 +1,268 @@
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, func, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 
+from config import Config
 from database import models, schemas
-from utils.db import get_likes_by_user_recipe
+from database.database import SessionLocal
+from service.recipe import update_top_recipes
+from utils.cache import invalidate_profile
+from utils.db import get_like_state, get_existing_recipes_id
+from utils.like_buffer import like_buffer
+from utils.versions import versions, LIKES
+
+# results of like_it
+ADDED, REMOVED, MISSING, FAILED = 'added', 'removed', 'missing', 'failed'
+# the longest pause between the attempts to write a batch that failed, seconds
+FLUSH_RETRY_DELAY_MAX = 30
+flush_lock = threading.Lock()
+flush_requested = threading.Event()
+flusher_stopped = threading.Event()
+flusher: threading.Thread = None
+failed_flushes = 0
+# time.monotonic() of the first failure of the current batch and of the next attempt to write it
+failing_since: float = None
+retry_at = 0.0
+
 
+def change_likes_count(db: Session, recipe_id: int, delta: int) -> int:
+    """Change the like counter of the recipe in the current transaction
 
-def like_it(db: Session, like: schemas.LikeCreate) -> models.Likes:
-    """Like and add to the user's favorites
+    The counter is changed by the database itself (likes_count = likes_count + delta),
+    so concurrent likes of the same recipe don't overwrite each other.
+
+    :param db: database connection
+    :param recipe_id: recipe id
+    :param delta: how much to change the counter
+    :return: number of updated recipes (0 if there is no such recipe)
+    """
+    return db.query(models.Recipe).filter(models.Recipe.id == recipe_id).update(
+        {models.Recipe.likes_count: models.Recipe.likes_count + delta}, synchronize_session=False)
+
+
+def like_it(db: Session, like: schemas.LikeCreate) -> str:
+    """Like and add to the user's favorites. If the user already likes the recipe, the like is removed.
+    The like and the like counter of the recipe are changed in one transaction
 
     :param db: database connection
     :param like: info about like (user id and recipe id)
-    :return: object Likes
+    :return: ADDED, REMOVED, MISSING (there is no such recipe) or FAILED (the change couldn't be saved)
     """
-    likes = get_likes_by_user_recipe(db, like.user_id, like.recipe_id)
-    print(likes)
-    db_like = models.Likes(**like.dict())
     try:
-        if likes is not None:
-            db.query(models.Likes.id).filter_by(id=likes.id).delete()
+        deleted = db.query(models.Likes).filter(
+            and_(models.Likes.user_id == like.user_id, models.Likes.recipe_id == like.recipe_id)
+        ).delete(synchronize_session=False)
+        if deleted:
+            change_likes_count(db, like.recipe_id, -deleted)
+        elif change_likes_count(db, like.recipe_id, 1):
+            db.add(models.Likes(**like.dict()))
         else:
-            db.add(db_like)
+            db.rollback()
+            return MISSING
         db.commit()
-        db.refresh(db_like)
+        invalidate_profile(like.user_id)
+        update_top_recipes(db, like.recipe_id, -deleted if deleted else 1)
+        versions.bump(LIKES)
+        return REMOVED if deleted else ADDED
     except IntegrityError:
+        # the same like was added concurrently
+        db.rollback()
+        return ADDED
+    except BaseException as e:
+        print(f'Error: {e}')
         db.rollback()
+        return FAILED
+
+
+def toggle_like(db: Session, like: schemas.LikeCreate) -> Optional[bool]:
+    """Like or unlike the recipe in the write-behind mode: the toggle is kept in memory and written
+    to the database with other toggles by the flusher thread. The database is only read when the
+    buffer doesn't know whether the user likes the recipe
+
+    :param db: database connection
+    :param like: info about like (user id and recipe id)
+    :return: whether the user likes the recipe now, None if there is no such recipe
+    """
+    stored = None
+    if like_buffer.state(like.user_id, like.recipe_id) is None:
+        state = get_like_state(db, like.user_id, like.recipe_id)
+        if state is None:
+            return None
+        stored = state[1] is not None
+    liked = like_buffer.toggle(like.user_id, like.recipe_id, stored)
+    # the cached lists are made stale by flush_likes, once per batch
+    start_flusher()
+    if like_buffer.events >= Config.LIKES_FLUSH_EVENTS:
+        flush_requested.set()
+    return liked
+
+
+def apply_pending_likes(user_id: int, recipes_id: List[int], complete: bool = True, after: int = None) -> List[int]:
+    """Apply the likes of the user that are not written yet to the recipes the user likes
+
+    :param user_id: user id
+    :param recipes_id: ids of the recipes the user likes according to the database, ascending
+    :param complete: recipes_id are all the liked recipes after `after`, otherwise only the first of them
+    :param after: recipes_id are bigger than this id
+    :return: ids of the recipes the user likes, ascending
+    """
+    changes = like_buffer.user_changes(user_id)
+    if not changes:
+        return recipes_id
+    last = None if complete or not recipes_id else recipes_id[-1]
+    liked = {recipe_id for recipe_id in recipes_id if changes.get(recipe_id, True)}
+    liked.update(recipe_id for recipe_id, like in changes.items()
+                 if like and (after is None or recipe_id > after) and (last is None or recipe_id < last))
+    return sorted(liked)
+
+
+def write_likes(db: Session, changes: Dict[Tuple[int, int], Tuple[bool, bool]]) -> Dict[int, int]:
+    """Write like toggles in the current transaction: INSERTs of the new likes, one DELETE per recipe
+    for the removed ones and one UPDATE of the like counters. Likes of deleted recipes are skipped.
+    The counters change by the rows really inserted and deleted, a like that is already in the table
+    (written by another process) isn't counted twice
+
+    :param db: database connection
+    :param changes: (user id, recipe id) -> (the database has the like, the user likes the recipe)
+    :return: recipe id -> change of its likes
+    """
+    recipes_id = set(get_existing_recipes_id(db, list({recipe_id for _, recipe_id in changes})))
+    added, removed = defaultdict(list), defaultdict(list)
+    for (user_id, recipe_id), (_, liked) in changes.items():
+        if recipe_id not in recipes_id:
+            continue
+        (added if liked else removed)[recipe_id].append(user_id)
+    deltas = Counter()
+    if added:
+        table = models.Likes.__table__
+        dialect = db.bind.dialect.name
+        if dialect == 'postgresql':
+            rows = [{'user_id': user_id, 'recipe_id': recipe_id}
+                    for recipe_id, users_id in added.items() for user_id in users_id]
+            for start in range(0, len(rows), Config.BULK_INSERT_SIZE):
+                insert = postgresql.insert(table).values(rows[start:start + Config.BULK_INSERT_SIZE])
+                deltas.update(recipe_id for recipe_id, in db.execute(insert.on_conflict_do_nothing(
+                    index_elements=['user_id', 'recipe_id']).returning(table.c.recipe_id)))
+        else:
+            insert = sqlite.insert(table).on_conflict_do_nothing(index_elements=['user_id', 'recipe_id']) \
+                if dialect == 'sqlite' else table.insert()
+            # without RETURNING the rowcount of an executemany is the number of inserted rows,
+            # so the likes of a recipe are inserted together
+            for recipe_id, users_id in added.items():
+                deltas[recipe_id] += db.execute(
+                    insert, [{'user_id': user_id, 'recipe_id': recipe_id} for user_id in users_id]).rowcount
+    for recipe_id, users_id in removed.items():
+        deltas[recipe_id] -= db.query(models.Likes).filter(
+            models.Likes.recipe_id == recipe_id, models.Likes.user_id.in_(users_id)).delete(synchronize_session=False)
+    deltas = {recipe_id: delta for recipe_id, delta in deltas.items() if delta}
+    if deltas:
+        table = models.Recipe.__table__
+        db.execute(table.update().where(table.c.id == bindparam('recipe_id')).values(
+            likes_count=table.c.likes_count + bindparam('delta')),
+            [{'recipe_id': recipe_id, 'delta': delta} for recipe_id, delta in sorted(deltas.items())])
+    return deltas
+
+
+def flush_likes(force: bool = False) -> int:
+    """Write the buffered like toggles to the database in one transaction. If it fails the toggles
+    are kept in the buffer and written with the next batch, the attempts are made with a growing pause
+    (up to FLUSH_RETRY_DELAY_MAX). Toggles that couldn't be written for Config.LIKES_RETRY_SECONDS
+    are dropped and printed to the log, so they can be applied by hand
+
+    :param force: write now even if the pause after a failure isn't over (on shutdown)
+    :return: number of written toggles
+    """
+    global failed_flushes, failing_since, retry_at
+    with flush_lock:
+        now = time.monotonic()
+        if not force and now < retry_at:
+            return 0
+        changes = like_buffer.take()
+        if not changes:
+            like_buffer.done()
+            return 0
+        db = SessionLocal()
+        try:
+            try:
+                deltas = write_likes(db, changes)
+                db.commit()
+            except BaseException as e:
+                print(f'Error: {e}')
+                db.rollback()
+                failed_flushes += 1
+                failing_since = now if failing_since is None else failing_since
+                if now - failing_since < Config.LIKES_RETRY_SECONDS:
+                    like_buffer.restore()
+                    retry_at = now + min(Config.LIKES_FLUSH_MS / 1000 * 2 ** failed_flushes, FLUSH_RETRY_DELAY_MAX)
+                else:
+                    print(f'Error: dropped like toggles (user id, recipe id, liked): '
+                          f'{[(user_id, recipe_id, liked) for (user_id, recipe_id), (_, liked) in changes.items()]}')
+                    failed_flushes, failing_since, retry_at = 0, None, 0.0
+                    like_buffer.done()
+                return 0
+            failed_flushes, failing_since, retry_at = 0, None, 0.0
+            like_buffer.done()
+            for user_id in {user_id for user_id, _ in changes}:
+                invalidate_profile(user_id)
+            for recipe_id, delta in deltas.items():
+                update_top_recipes(db, recipe_id, delta)
+        finally:
+            db.close()
+    versions.bump(LIKES)
+    return len(changes)
+
+
+def run_flusher():
+    while not flusher_stopped.is_set():
+        flush_requested.wait(Config.LIKES_FLUSH_MS / 1000)
+        flush_requested.clear()
+        if len(like_buffer):
+            flush_likes()
+
+
+def start_flusher():
+    """Start the thread writing the buffered likes every Config.LIKES_FLUSH_MS milliseconds
+    or after Config.LIKES_FLUSH_EVENTS toggles"""
+    global flusher
+    if flusher is not None and flusher.is_alive():
+        return
+    with flush_lock:
+        if flusher is None or not flusher.is_alive():
+            flusher_stopped.clear()
+            flusher = threading.Thread(target=run_flusher, name='likes-flusher', daemon=True)
+            flusher.start()
+
+
+def stop_flusher():
+    """Stop the flusher thread and write what is left in the buffer"""
+    flusher_stopped.set()
+    flush_requested.set()
+    if flusher is not None:
+        flusher.join()
+    flush_likes(force=True)
+
+
+def reconcile_likes_count(db: Session) -> int:
+    """Recount the like counters of all recipes from the likes table
+
+    :param db: database connection
+    :return: number of recipes whose counter was fixed
+    """
+    likes_count = db.query(func.count(models.Likes.id)).filter(
+        models.Likes.recipe_id == models.Recipe.id).correlate(models.Recipe).scalar_subquery()
+    try:
+        fixed = db.query(models.Recipe).filter(models.Recipe.likes_count != likes_count).update(
+            {models.Recipe.likes_count: likes_count}, synchronize_session=False)
+        db.commit()
+        versions.bump(LIKES)
     except BaseException as e:
         print(f'Error: {e}')
         db.rollback()
-    print(db_like)
-    return db_like
+        fixed = 0
+    return fixed
@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from config import Config
+from database import models
+from database.database import SessionLocal
+from utils.images import make_variants
+from utils.storage import storage, derived_key
+from utils.versions import versions, RECIPES
+
+# Pillow releases the GIL while decoding, resizing and encoding, so the variants are made on threads
+photo_pool = ThreadPoolExecutor(max_workers=Config.PHOTO_WORKERS, thread_name_prefix='photo')
+
+
+def acquire_photo(db: Session, key: str):
+    """Count one more recipe using the stored photo, in the current transaction, with one
+    INSERT ... ON CONFLICT DO UPDATE: two first uploads of the same image don't conflict on the key,
+    and the row stays locked until the commit, so the photo can't be released meanwhile
+
+    :param db: database connection
+    :param key: key of the photo in the storage
+    """
+    table = models.Photo.__table__
+    dialect = db.bind.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table).values(key=key, refcount=1)
+        db.execute(insert.on_conflict_do_update(index_elements=['key'],
+                                                set_={'refcount': table.c.refcount + insert.excluded.refcount}))
+        return
+    updated = db.query(models.Photo).filter(models.Photo.key == key).update(
+        {models.Photo.refcount: models.Photo.refcount + 1}, synchronize_session=False)
+    if not updated:
+        db.add(models.Photo(key=key, refcount=1))
+    db.flush()
+
+
+def release_photo(db: Session, key: str) -> bool:
+    """Count one recipe less using the stored photo, in the current transaction. The photo that isn't
+    used anymore is removed from the table, its files are removed by delete_photo_files before the commit,
+    while the row is locked: an upload of the same image waits in acquire_photo and puts the file back
+
+    :param db: database connection
+    :param key: key of the photo in the storage
+    :return: the photo isn't used anymore
+    """
+    db.query(models.Photo).filter(models.Photo.key == key).update(
+        {models.Photo.refcount: models.Photo.refcount - 1}, synchronize_session=False)
+    return db.query(models.Photo).filter(models.Photo.key == key, models.Photo.refcount <= 0).delete(
+        synchronize_session=False) > 0
+
+
+def delete_photo_files(key: str):
+    """Delete the photo and its variants from the storage
+
+    :param key: key of the photo in the storage
+    """
+    try:
+        for name in Config.PHOTO_VARIANTS:
+            storage.delete(derived_key(key, name))
+        storage.delete(key)
+    except OSError as e:
+        print(f'Error: {e}')
+
+
+def create_variants(db: Session, recipe_id: int, key: str) -> dict:
+    """Make the variants of the recipe photo (Config.PHOTO_VARIANTS) and save their keys in the recipe.
+    Variants of a photo that is already stored (the same image was uploaded before) are not made again.
+    The keys are not saved if the photo of the recipe was replaced meanwhile
+
+    :param db: database connection
+    :param recipe_id: recipe id
+    :param key: key of the photo in the storage
+    :return: variant name -> key of the variant, None if the variants couldn't be made
+    """
+    variants = {name: derived_key(key, name) for name in Config.PHOTO_VARIANTS}
+    try:
+        if not all(storage.exists(variant_key) for variant_key in variants.values()):
+            path = storage.local_path(key)
+            if path is None:
+                raise FileNotFoundError(f'The photo {key} is not in the storage')
+            made = make_variants(path, Config.PHOTO_VARIANTS, Config.PHOTO_QUALITY, storage.temp_dir())
+            for name, variant_path in made.items():
+                storage.put(variants[name], variant_path)
+    except (OSError, ValueError) as e:
+        print(f'Error: {e}')
+        return None
+    try:
+        db.query(models.Recipe).filter(models.Recipe.id == recipe_id, models.Recipe.photo == key).update(
+            {models.Recipe.photo_variants: variants}, synchronize_session=False)
+        db.commit()
+        versions.bump(RECIPES)
+    except BaseException as e:
+        print(f'Error: {e}')
+        db.rollback()
+    return variants
+
+
+def schedule_variants(recipe_id: int, key: str) -> Future:
+    """Make the variants of the recipe photo in the background
+
+    :param recipe_id: recipe id
+    :param key: key of the photo in the storage
+    :return: future with the result of create_variants
+    """
+    def run():
+        db = SessionLocal()
+        try:
+            return create_variants(db, recipe_id, key)
+        finally:
+            db.close()
+
+    return photo_pool.submit(run)
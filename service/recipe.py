@@ -1,130 +1,516 @@
-from typing import List
+import time
+from collections import defaultdict, Counter
+from datetime import datetime
+from typing import List, Iterator, NamedTuple, Optional, Tuple
 
-from sqlalchemy import and_
+from sqlalchemy import and_, literal_column, Float
 from sqlalchemy.orm import Session
 
 from database import models
 from database.models import Recipe
 from database import schemas
 from service import hashtag
-from utils.db import get_recipes, get_hashtags_by_tags, get_recipe_hashtag, get_top_likes, \
-    get_recipes_by_id, get_recipes_by_user, get_recipe_for_admin
+from service.photo import acquire_photo, release_photo, delete_photo_files
+from config import Config
+from utils.cache import invalidate_profile
+from utils.db import get_recipes_by_id, get_recipe_for_admin, query_recipes, get_recipes_tags, \
+    query_recipes_id_by_tags, get_top_likes, get_recipe_photo, get_liked_recipes_id
+from utils.leaderboard import Leaderboard
+from utils.like_buffer import like_buffer
+from utils.pagination import Page, paginate, decode_cursor, encode_cursor
+from utils.search import search, recipe_vector, trigram_search
+from utils.storage import storage
+from utils.trigram import TrigramIndex
+from utils.versions import versions, RECIPES, LIKES, TAGS
+
+NEWEST_FIRST = [models.Recipe.date_creation, models.Recipe.id]
+MOST_LIKED_FIRST = [models.Recipe.likes_count, models.Recipe.id]
+# similarity of a fuzzy match, the first value of its cursor (see get_fuzzy_page)
+FUZZY_RANK = literal_column('rank', Float)
+
+names_index = TrigramIndex()
+top_recipes = Leaderboard(Config.LEADERBOARD_SIZE)
 
 
 def create_recipe(db: Session, recipe: schemas.RecipeCreate, author_id: int, tags: list) -> Recipe:
-    """Create new a recipe
+    """Create new a recipe with its hashtags in one transaction
 
     :param db: database connection
     :param recipe: object RecipeCreate with data a recipe for create
     :param author_id: creator id
-    :return: data the recipe
+    :param tags: hashtags of the recipe, the missing ones are created
+    :return: data the recipe, None if it couldn't be created
     """
-    hashtag.create_hashtag(db, tags)
     recipe.author_id = author_id
     new_recipe = models.Recipe(**recipe.dict())
     try:
+        hashtags = hashtag.upsert_hashtags(db, tags)
         db.add(new_recipe)
+        db.flush()
+        hashtag.add_recipe_hashtags(db, new_recipe.id, (hashtags[tag] for tag in tags))
+        if new_recipe.is_active:
+            hashtag.change_tag_counts(db, {(hashtags[tag], new_recipe.type): 1 for tag in tags})
         db.commit()
         db.refresh(new_recipe)
     except BaseException as e:
         print(f'Error: {e}')
         db.rollback()
+        return None
 
-    hashtag.create_recipe_hashtags(db, new_recipe.id, tags)
-    db.refresh(new_recipe)
+    hashtag.count_hashtags(hashtags, dict.fromkeys(tags))
+    invalidate_profile(author_id)
+    update_names_index(new_recipe.id, new_recipe.name)
+    versions.bump(RECIPES, TAGS)
+    if new_recipe.is_active:
+        top_recipes.update(new_recipe.id, 0)
     return new_recipe
 
 
-def add_photo(db: Session, recipe_id: int, url_photo: str) -> Recipe:
-    """Add a photo to the recipe
+def insert_recipes(db: Session, rows: List[dict]) -> List[int]:
+    """Insert recipes in the current transaction, on PostgreSQL with one multi-row INSERT ... RETURNING
 
     :param db: database connection
-    :param recipe_id: recipe id
-    :param url_photo: path to the photo on the server
-    :return: data the recipe
+    :param rows: values of the recipes columns
+    :return: ids of the recipes in the order of the rows
+    """
+    table = models.Recipe.__table__
+    if db.bind.dialect.name == 'postgresql':
+        # ids of one statement are taken from the sequence in the order of the rows
+        return sorted(db.execute(table.insert().values(rows).returning(table.c.id)).scalars().all())
+    return [db.execute(table.insert().values(row)).inserted_primary_key[0] for row in rows]
+
+
+def import_recipes(db: Session, recipes: List[schemas.RecipeImport], author_id: int) -> List[int]:
+    """Create many recipes in one transaction: hashtags are created with one statement, recipes
+    and their hashtags are inserted with multi-row statements
+
+    :param db: database connection
+    :param recipes: recipes with their hashtags
+    :param author_id: creator id
+    :return: ids of the created recipes in the order of recipes, None if they couldn't be created
     """
-    recipe = get_recipes_by_id(db, [recipe_id])[0]
-    recipe.photo = url_photo
+    if not recipes:
+        return []
+    dialect = db.bind.dialect.name
     try:
-        db.add(recipe)
+        hashtags = hashtag.upsert_hashtags(db, (tag for recipe in recipes for tag in recipe.tags))
+        rows = []
+        for recipe in recipes:
+            row = recipe.dict(exclude={'tags'})
+            row.update(author_id=author_id, likes_count=0, search_vector=recipe_vector(
+                dialect, recipe.name, recipe.description, recipe.steps_making))
+            rows.append(row)
+        recipes_id = []
+        for start in range(0, len(rows), Config.BULK_INSERT_SIZE):
+            recipes_id += insert_recipes(db, rows[start:start + Config.BULK_INSERT_SIZE])
+        links = [{'recipe_id': recipe_id, 'tag_id': hashtags[tag]}
+                 for recipe_id, recipe in zip(recipes_id, recipes) for tag in dict.fromkeys(recipe.tags)]
+        if links:
+            db.execute(models.RecipeHashtag.__table__.insert(), links)
+        hashtag.change_tag_counts(db, Counter((hashtags[tag], recipe.type) for recipe in recipes if recipe.is_active
+                                              for tag in set(recipe.tags)))
         db.commit()
-        db.refresh(recipe)
     except BaseException as e:
         print(f'Error: {e}')
         db.rollback()
-    return recipe
+        return None
+    invalidate_profile(author_id)
+    for recipe_id, recipe in zip(recipes_id, recipes):
+        hashtag.count_hashtags(hashtags, dict.fromkeys(recipe.tags))
+        update_names_index(recipe_id, recipe.name)
+        if recipe.is_active:
+            top_recipes.update(recipe_id, 0)
+    versions.bump(RECIPES, TAGS)
+    return recipes_id
 
 
-def get_recipe_by_filter(db: Session, name: str = None, type: str = None, tag: str = None) -> List[Recipe]:
-    """Get recipes by filter. If no filters are set all recipes are returned.
+def get_recipe(db: Session, recipe_id: int) -> Recipe:
+    """Get an active recipe
+
+    :param db: database connection
+    :param recipe_id: recipe id
+    :return: data the recipe, None if there is no such recipe
+    """
+    recipes = get_recipes_by_id(db, [recipe_id])
+    return recipes[0] if recipes else None
+
+
+class PhotoChange(NamedTuple):
+    """Photo of a recipe changed in a transaction that isn't committed yet (see change_photo)"""
+    recipe: Recipe
+    key: str
+    old_key: Optional[str]
+    # the previous photo isn't used anymore, its files are deleted before the commit
+    released: bool
+
+
+def add_photo(db: Session, recipe_id: int, key: str, path: str = None) -> Recipe:
+    """Add a photo to the recipe. The previous photo is deleted from the storage if no recipe uses it
+
+    The photo is counted (acquire_photo) before its file is put to the storage and both are done
+    in one transaction, so the file can't be deleted by a release of the same photo meanwhile.
+    The steps are change_photo, store_photo_files and commit_photo; the routes call them one by one
+    to put the file from the threadpool.
+
+    :param db: database connection
+    :param recipe_id: recipe id
+    :param key: key of the photo in the storage (see utils.storage)
+    :param path: file with the photo to put to the storage under the key, None if it is already stored
+    :return: data the recipe, None if there is no such recipe or the photo couldn't be saved
+    """
+    try:
+        change = change_photo(db, recipe_id, key)
+        if change is None:
+            return None
+        store_photo_files(change, path)
+        return commit_photo(db, change)
+    except BaseException as e:
+        print(f'Error: {e}')
+        db.rollback()
+        return None
+
+
+def change_photo(db: Session, recipe_id: int, key: str) -> Optional[PhotoChange]:
+    """Set the photo of the recipe without committing: the photo is counted and the previous one is
+    released, their rows stay locked until commit_photo
+
+    :param db: database connection
+    :param recipe_id: recipe id
+    :param key: key of the photo in the storage
+    :return: the change, None if there is no such recipe
+    """
+    recipe = get_recipe(db, recipe_id)
+    if recipe is None:
+        return None
+    old_key = recipe.photo
+    if old_key == key:
+        return PhotoChange(recipe, key, old_key, False)
+    acquire_photo(db, key)
+    recipe.photo = key
+    recipe.photo_variants = None
+    released = old_key is not None and release_photo(db, old_key)
+    db.add(recipe)
+    db.flush()
+    return PhotoChange(recipe, key, old_key, released)
+
+
+def store_photo_files(change: PhotoChange, path: str = None):
+    """Put the uploaded file to the storage and delete the files of the released photo, between
+    change_photo and commit_photo. Only the storage is used, no database
+
+    :param change: result of change_photo
+    :param path: file with the photo, None if it is already stored
+    """
+    if path is not None:
+        # the file is dropped if it is stored, or put back if it was lost
+        storage.put(change.key, path)
+    if change.released:
+        delete_photo_files(change.old_key)
+
+
+def commit_photo(db: Session, change: PhotoChange) -> Recipe:
+    """Commit the change made by change_photo
+
+    :param db: database connection
+    :param change: result of change_photo
+    :return: data the recipe
+    """
+    if change.key != change.old_key:
+        db.commit()
+        db.refresh(change.recipe)
+        versions.bump(RECIPES)
+    return change.recipe
+
+
+def get_photo_key(db: Session, recipe_id: int, variant: str = None) -> Tuple[Optional[str], bool]:
+    """Get the key of the recipe photo in the storage. If the variant isn't made yet, it is the original photo
+
+    :param db: database connection
+    :param recipe_id: recipe id
+    :param variant: name of the photo variant (see Config.PHOTO_VARIANTS), None for the original photo
+    :return: key of the photo (None if the recipe has no photo) and False if the original photo stands
+        in for the variant
+    """
+    db_photo = get_recipe_photo(db, recipe_id)
+    if db_photo is None or db_photo.photo is None:
+        return None, False
+    if variant is None:
+        return db_photo.photo, True
+    key = (db_photo.photo_variants or {}).get(variant)
+    return (key, True) if key else (db_photo.photo, False)
+
+
+def get_names_index(db: Session) -> TrigramIndex:
+    """Get the in-process trigram index of recipe names, it is built on first use
+
+    :param db: database connection
+    :return: index of recipe names
+    """
+    if not names_index.built:
+        names_index.build(db.query(models.Recipe.id, models.Recipe.name))
+    return names_index
+
+
+def update_names_index(recipe_id: int, name: str = None):
+    """Update the name of the recipe in the in-process trigram index (remove the recipe if name is None)
+
+    :param recipe_id: recipe id
+    :param name: new recipe name
+    """
+    if not names_index.built:
+        return
+    if name is None:
+        names_index.remove(recipe_id)
+    else:
+        names_index.add(recipe_id, name)
+
+
+def get_recipe_by_filter(db: Session, name: str = None, type: str = None, tag: str = None, cursor: str = None,
+                         limit: int = Config.PAGE_LIMIT, q: str = None, name_fuzzy: bool = False,
+                         tags: List[str] = None, tags_mode: str = 'all') -> Page:
+    """Get active recipes by filter. If no filters are set all recipes are returned.
+    Recipes are returned by pages, the newest first or the most relevant first if q is set
+    or the name is searched fuzzy. Filters are combined into one query.
 
     :param db: database connection
     :param name: recipe name
     :param type: recipe type
-    :param tag: recipe hashtags
+    :param tag: recipe hashtag
+    :param cursor: cursor from the previous page
+    :param limit: page size
+    :param q: full-text search query (by name, description and steps)
+    :param name_fuzzy: search by name tolerating typos (trigram similarity) instead of substring
+    :param tags: recipe hashtags (together with tag)
+    :param tags_mode: 'all' - a recipe has all the hashtags, 'any' - at least one of them
     :return: list with recipe
     """
-    if name and type and tag:
-        tag_id = get_hashtags_by_tags(db, [tag])[0].id
-        recipe_id = [recipe.recipe_id for recipe in get_recipe_hashtag(db, tag_id)]
-        recipes = db.query(models.Recipe).filter(and_(
-            models.Recipe.name.ilike(f"%{name}%"),
-            models.Recipe.type == type,
-            models.Recipe.id.in_(recipe_id)
-        )).all()
-    elif name and type:
-        recipes = db.query(models.Recipe).filter(and_(
-            models.Recipe.name.ilike(f"%{name}%"),
-            models.Recipe.type == type
-        )).all()
-    elif name and tag:
-        tag_id = get_hashtags_by_tags(db, [tag])[0].id
-        recipe_id = [recipe.recipe_id for recipe in get_recipe_hashtag(db, tag_id)]
-        recipes = db.query(models.Recipe).filter(and_(
-            models.Recipe.name.ilike(f"%{name}%"),
-            models.Recipe.id.in_(recipe_id)
-        )).all()
-    elif type and tag:
-        tag_id = get_hashtags_by_tags(db, [tag])[0].id
-        recipe_id = [recipe.recipe_id for recipe in get_recipe_hashtag(db, tag_id)]
-        recipes = db.query(models.Recipe).filter(and_(
-            models.Recipe.type == type,
-            models.Recipe.id.in_(recipe_id)
-        )).all()
-    elif name:
-        recipes = db.query(models.Recipe).filter(models.Recipe.name.ilike(f"%{name}%")).all()
-    elif type:
-        recipes = db.query(models.Recipe).filter(models.Recipe.type == type).all()
-    elif tag:
-        tag_id = get_hashtags_by_tags(db, [tag])[0].id
-        recipe_id = [recipe.recipe_id for recipe in get_recipe_hashtag(db, tag_id)]
-        recipes = db.query(models.Recipe).filter(models.Recipe.id.in_(recipe_id)).all()
+    tags = set(tags or [])
+    if tag:
+        tags.add(tag)
+    recipes = query_recipes(db).filter(models.Recipe.is_active == True)
+    if name and not name_fuzzy:
+        recipes = recipes.filter(models.Recipe.name.ilike(f"%{name}%"))
+    if type:
+        recipes = recipes.filter(models.Recipe.type == type)
+    if tags:
+        recipes = recipes.filter(models.Recipe.id.in_(query_recipes_id_by_tags(db, tags, tags_mode == 'all')))
+    ranks = []
+    if q:
+        condition, rank = search(db, models.Recipe.search_vector, q)
+        recipes = recipes.filter(condition)
+        ranks.append(rank)
+    if name and name_fuzzy:
+        if db.bind.dialect.name != 'postgresql':
+            return get_fuzzy_page(db, recipes, name, ranks[0] if ranks else None, cursor, limit)
+        condition, rank = trigram_search(db, models.Recipe.name, name)
+        recipes = recipes.filter(condition)
+        ranks.append(rank)
+    if ranks:
+        rank = sum(ranks[1:], ranks[0])
+        recipes = recipes.add_columns(rank.label('rank'))
+        page = paginate(recipes, [rank, models.Recipe.id], cursor, limit,
+                        key=lambda row: [row.rank, row.Recipe.id])
+        return Page([row.Recipe for row in page], page.next_cursor)
+    return paginate(recipes, NEWEST_FIRST, cursor, limit)
+
+
+def get_fuzzy_page(db: Session, recipes, name: str, rank=None, cursor: str = None,
+                   limit: int = Config.PAGE_LIMIT) -> Page:
+    """Get a page of the recipes with names similar to the name by the in-process trigram index (databases
+    without pg_trgm). The matches are ordered and the cursor is applied in Python, the database only gets
+    the ids of about a page at a time to apply the other filters, so the queries don't grow with the
+    number of matches
+
+    :param db: database connection
+    :param recipes: query with the other filters
+    :param name: recipe name
+    :param rank: relevance of the full-text search (q), added to the similarity
+    :param cursor: cursor from the previous page
+    :param limit: page size
+    :return: list with recipe, the most similar first
+    """
+    limit = max(1, min(limit, Config.PAGE_LIMIT_MAX))
+    scores = get_names_index(db).search(name, Config.FUZZY_THRESHOLD)
+    if rank is not None:
+        # the full-text condition is already in the query, only its matches are kept
+        ranks = dict(recipes.with_entities(models.Recipe.id, rank))
+        scores = {recipe_id: score + ranks[recipe_id] for recipe_id, score in scores.items() if recipe_id in ranks}
+    keys = [(score, recipe_id) for recipe_id, score in scores.items()]
+    if cursor:
+        last = tuple(decode_cursor(cursor, [FUZZY_RANK, models.Recipe.id]))
+        keys = [key for key in keys if key < last]
+    keys.sort(reverse=True)
+    rows, start, size = [], 0, limit + 1
+    while start < len(keys) and len(rows) <= limit:
+        chunk = keys[start:start + size]
+        found = {db_recipe.id: db_recipe for db_recipe in
+                 recipes.filter(models.Recipe.id.in_([recipe_id for _, recipe_id in chunk]))}
+        rows.extend((key, found[key[1]]) for key in chunk if key[1] in found)
+        # the other filters dropped some of the matches, next time more ids are checked at once
+        start, size = start + size, size * 2
+    if len(rows) > limit:
+        return Page([db_recipe for _, db_recipe in rows[:limit]], encode_cursor(list(rows[limit - 1][0])))
+    return Page([db_recipe for _, db_recipe in rows])
+
+
+def get_recipes_show(db: Session, recipes: List[Recipe], user_id: int = None) -> List[schemas.RecipeShow]:
+    """Get recipes in the form shown to users
+
+    :param db: database connection
+    :param recipes: list with recipe
+    :param user_id: id of the user the recipes are shown to
+    :return: list with data the recipes
+    """
+    return [schemas.RecipeShow(**recipe_data) for recipe_data in get_recipes_data(db, recipes, user_id)]
+
+
+def get_recipes_data(db: Session, recipes: List[Recipe], user_id: int = None) -> List[dict]:
+    """Get recipes in the form shown to users as plain dicts with the fields of schemas.RecipeShow,
+    made without validation, for responses encoded directly (utils.responses.FastJSONResponse)
+
+    Tags of all recipes are loaded with one query, the author is expected to be loaded
+    together with the recipes (see utils.db.query_recipes). If the user is given, the likes
+    of the user among the recipes are loaded with one more query (liked_by_me).
+
+    :param db: database connection
+    :param recipes: list with recipe
+    :param user_id: id of the user the recipes are shown to
+    :return: list with data the recipes
+    """
+    recipes_id = [db_recipe.id for db_recipe in recipes]
+    if not recipes_id:
+        return []
+    tags = defaultdict(list)
+    for recipe_id, tag in get_recipes_tags(db, recipes_id):
+        tags[recipe_id].append(tag)
+    liked = None
+    if user_id is not None:
+        liked = set(get_liked_recipes_id(db, user_id, recipes_id))
+        for recipe_id, like in like_buffer.user_changes(user_id).items():
+            if like:
+                liked.add(recipe_id)
+            else:
+                liked.discard(recipe_id)
+    return [{'name': db_recipe.name, 'description': db_recipe.description, 'steps_making': db_recipe.steps_making,
+             'type': db_recipe.type, 'is_active': db_recipe.is_active, 'date_creation': db_recipe.date_creation,
+             'id': db_recipe.id, 'photo': db_recipe.photo, 'photo_variants': db_recipe.photo_variants,
+             'author': db_recipe.author.nickname, 'likes': db_recipe.likes_count, 'tags': tags[db_recipe.id],
+             'liked_by_me': None if liked is None else db_recipe.id in liked} for db_recipe in recipes]
+
+
+def export_recipes(db: Session, since: datetime = None,
+                   batch_size: int = Config.EXPORT_BATCH_SIZE) -> Iterator[List[dict]]:
+    """Read all recipes (active or not) in the order of id by batches. Rows are fetched from a server-side
+    cursor batch_size at a time, tags and authors are loaded for a whole batch, so memory doesn't depend
+    on the number of recipes
+
+    :param db: database connection
+    :param since: only the recipes changed at this time or later (Recipe.updated_at)
+    :param batch_size: number of recipes in a batch
+    :return: batches of recipes in the form of get_recipes_data with updated_at
+    """
+    recipes = query_recipes(db).order_by(models.Recipe.id)
+    if since is not None:
+        recipes = recipes.filter(models.Recipe.updated_at >= since)
+    batch = []
+    for db_recipe in recipes.execution_options(stream_results=True).yield_per(batch_size):
+        batch.append(db_recipe)
+        if len(batch) == batch_size:
+            yield export_batch(db, batch)
+            batch = []
+    if batch:
+        yield export_batch(db, batch)
+
+
+def export_batch(db: Session, recipes: List[Recipe]) -> List[dict]:
+    recipes_data = get_recipes_data(db, recipes)
+    for recipe_data, db_recipe in zip(recipes_data, recipes):
+        del recipe_data['liked_by_me']
+        recipe_data['updated_at'] = db_recipe.updated_at
+    return recipes_data
+
+
+def get_top_recipes_board(db: Session, size: int = None) -> Leaderboard:
+    """Get the in-memory top of recipes by likes. It is built on first use, when a bigger size is needed
+    and every Config.LEADERBOARD_RECONCILE_SECONDS (to reconcile with the database)
+
+    :param db: database connection
+    :param size: number of recipes the board must hold
+    :return: top of recipes
+    """
+    size = min(max(size or 0, top_recipes.size), Config.LEADERBOARD_SIZE_MAX)
+    if not top_recipes.built or size > top_recipes.size or \
+            time.monotonic() - top_recipes.built_at > Config.LEADERBOARD_RECONCILE_SECONDS:
+        top_recipes.build(get_top_likes(db, size), size)
+    return top_recipes
+
+
+def update_top_recipes(db: Session, recipe_id: int, delta: int = None):
+    """Update the recipe in the in-memory top after its likes or state changed
+
+    :param db: database connection
+    :param recipe_id: recipe id
+    :param delta: change of the recipe likes, if it is unknown the recipe is read from the database
+    """
+    if not top_recipes.built or delta is not None and top_recipes.change(recipe_id, delta):
+        return
+    recipe_data = get_recipe_for_admin(db, recipe_id)
+    if recipe_data is None or not recipe_data.is_active:
+        top_recipes.remove(recipe_id)
     else:
-        recipes = get_recipes(db)
-    return recipes
+        top_recipes.update(recipe_id, recipe_data.likes_count)
 
 
-def get_top_recipe(db: Session, limit: int) -> List[models.Recipe]:
-    """Get top recipes
+def get_top_recipe(db: Session, limit: int, cursor: str = None) -> Page:
+    """Get top recipes. The order is taken from the in-memory top if it holds enough recipes
 
     :param db: database connection
     :param limit: number of recipes to output
+    :param cursor: cursor from the previous page
     :return: list with recipe
     """
-    top_recipe = get_top_likes(db, limit)
-    top_recipe = [like[0] for like in top_recipe]
-    recipe_list = get_recipes_by_id(db, top_recipe)
-    return recipe_list
+    limit = max(1, min(limit, Config.PAGE_LIMIT_MAX))
+    after = decode_cursor(cursor, MOST_LIKED_FIRST) if cursor else None
+    board = get_top_recipes_board(db, limit + 1)
+    top = board.page(limit + 1, after)
+    if top is None:
+        top = get_top_recipes_board(db, board.size * 2).page(limit + 1, after)
+    if top is None:
+        recipes = query_recipes(db).filter(models.Recipe.is_active == True)
+        return paginate(recipes, MOST_LIKED_FIRST, cursor, limit)
+    recipes = {db_recipe.id: db_recipe for db_recipe in get_recipes_by_id(db, [recipe_id for recipe_id, _ in top])}
+    for recipe_id, _ in top:
+        if recipe_id not in recipes:
+            board.remove(recipe_id)
+    next_cursor = encode_cursor(list(reversed(top[limit - 1]))) if len(top) > limit else None
+    return Page([recipes[recipe_id] for recipe_id, _ in top[:limit] if recipe_id in recipes], next_cursor)
 
 
-def get_user_recipes(db: Session, user_id: int) -> List[models.Recipe]:
+def get_user_recipes(db: Session, user_id: int, cursor: str = None, limit: int = Config.PAGE_LIMIT) -> Page:
     """Get recipes that belongs to the user
 
     :param db: database connection
     :param user_id: user id
+    :param cursor: cursor from the previous page
+    :param limit: page size
     :return: list with recipe
     """
-    return get_recipes_by_user(db, user_id)
+    recipes = query_recipes(db).filter(and_(models.Recipe.author_id == user_id, models.Recipe.is_active == True))
+    return paginate(recipes, NEWEST_FIRST, cursor, limit)
+
+
+def get_favorite_recipes(db: Session, user_id: int, cursor: str = None, limit: int = Config.PAGE_LIMIT) -> Page:
+    """Get recipes that the user likes
+
+    :param db: database connection
+    :param user_id: user id
+    :param cursor: cursor from the previous page
+    :param limit: page size
+    :return: list with recipe
+    """
+    recipes = query_recipes(db).join(models.Likes, models.Likes.recipe_id == models.Recipe.id).filter(
+        and_(models.Likes.user_id == user_id, models.Recipe.is_active == True))
+    return paginate(recipes, NEWEST_FIRST, cursor, limit)
 
 
 def change_recipe(db: Session, recipe_id: int, recipe: schemas.RecipeChange, user_id: int) -> models.Recipe:
@@ -136,22 +522,28 @@ def change_recipe(db: Session, recipe_id: int, recipe: schemas.RecipeChange, use
     :param user_id: user id
     :return: data updated recipe
     """
-    my_recipes = [recipe.id for recipe in get_user_recipes(db, user_id)]
-    if recipe_id not in my_recipes:
+    recipe_data = get_recipe_for_admin(db, recipe_id)
+    if recipe_data is None or recipe_data.author_id != user_id or not recipe_data.is_active:
         return None
-    recipe_data = get_recipes_by_id(db, [recipe_id])[0]
     if recipe.name:
         recipe_data.name = recipe.name
     if recipe.description:
         recipe_data.description = recipe.description
     if recipe.steps_making:
         recipe_data.steps_making = recipe.steps_making
-    if recipe.type:
-        recipe_data.type = recipe.type
+    type_changed = bool(recipe.type) and recipe.type != recipe_data.type
     try:
+        if type_changed:
+            hashtag.count_recipe_tags(db, recipe_id, recipe_data.type, -1)
+            hashtag.count_recipe_tags(db, recipe_id, recipe.type, 1)
+            recipe_data.type = recipe.type
         db.add(recipe_data)
         db.commit()
         db.refresh(recipe_data)
+        update_names_index(recipe_data.id, recipe_data.name)
+        versions.bump(RECIPES)
+        if type_changed:
+            versions.bump(TAGS)
     except BaseException as e:
         print(f'Error: {e}')
         db.rollback()
@@ -166,31 +558,111 @@ def ban_recipe(db: Session, recipe_id: int) -> models.Recipe:
     :return: data updated recipe
     """
     recipe_data = get_recipe_for_admin(db, recipe_id)
+    if recipe_data is None:
+        return None
     recipe_data.is_active = not recipe_data.is_active
     try:
+        hashtag.count_recipe_tags(db, recipe_id, recipe_data.type, 1 if recipe_data.is_active else -1)
         db.add(recipe_data)
         db.commit()
         db.refresh(recipe_data)
+        update_top_recipes(db, recipe_id)
+        versions.bump(RECIPES, TAGS)
     except BaseException as e:
         print(f'Error: {e}')
         db.rollback()
     return recipe_data
 
 
+class RecipeRemoval(NamedTuple):
+    """Recipe deleted in a transaction that isn't committed yet (see remove_recipe)"""
+    recipe_id: int
+    tags: List[str]
+    # key of the photo that isn't used anymore, its files are deleted before the commit
+    released_photo: Optional[str]
+
+
 def delete_recipe(db: Session, recipe_id: int) -> bool:
     """Delete user
 
+    The steps are remove_recipe, deleting the files of the released photo and commit_removal; the routes
+    call them one by one to delete the files from the threadpool.
+
     :param db: database connection
     :param recipe_id: recipe id
     :return: the result of the removal
     """
+    try:
+        removal = remove_recipe(db, recipe_id)
+        if removal is None:
+            return False
+        if removal.released_photo is not None:
+            delete_photo_files(removal.released_photo)
+        commit_removal(db, removal)
+    except BaseException as e:
+        print(f'Error: {e}')
+        db.rollback()
+    return True
+
+
+def remove_recipe(db: Session, recipe_id: int) -> Optional[RecipeRemoval]:
+    """Delete the recipe without committing, the row of its photo stays locked until commit_removal
+
+    :param db: database connection
+    :param recipe_id: recipe id
+    :return: the removal, None if there is no such recipe
+    """
     recipe_data = get_recipe_for_admin(db, recipe_id)
     if recipe_data is None:
-        return False
+        return None
+    key = recipe_data.photo
+    tags = [tag for _, tag in get_recipes_tags(db, [recipe_id])]
+    if recipe_data.is_active:
+        hashtag.count_recipe_tags(db, recipe_id, recipe_data.type, -1)
+    released = key is not None and release_photo(db, key)
+    db.delete(recipe_data)
+    db.flush()
+    return RecipeRemoval(recipe_id, tags, key if released else None)
+
+
+def commit_removal(db: Session, removal: RecipeRemoval):
+    """Commit the removal made by remove_recipe and drop the recipe from the in-memory indexes
+
+    :param db: database connection
+    :param removal: result of remove_recipe
+    """
+    db.commit()
+    for tag in dict.fromkeys(removal.tags):
+        hashtag.tag_dictionary.count(tag, -1)
+    # the recipe is gone from the favorites of every user who liked it
+    invalidate_profile()
+    update_names_index(removal.recipe_id)
+    top_recipes.remove(removal.recipe_id)
+    versions.bump(RECIPES, LIKES, TAGS)
+
+
+def reindex_search(db: Session) -> int:
+    """Recalculate the full-text search vectors of all recipes
+
+    :param db: database connection
+    :return: number of updated recipes
+    """
+    dialect = db.bind.dialect.name
     try:
-        db.delete(recipe_data)
+        if dialect == 'postgresql':
+            updated = db.query(models.Recipe).update({models.Recipe.search_vector: recipe_vector(
+                dialect, models.Recipe.name, models.Recipe.description, models.Recipe.steps_making)},
+                synchronize_session=False)
+        else:
+            updated = 0
+            for recipe_data in db.query(models.Recipe).yield_per(500):
+                recipe_data.search_vector = recipe_vector(dialect, recipe_data.name, recipe_data.description,
+                                                          recipe_data.steps_making)
+                updated += 1
         db.commit()
+        versions.bump(RECIPES)
     except BaseException as e:
         print(f'Error: {e}')
         db.rollback()
-    return True
\ No newline at end of file
+        updated = 0
+    return updated
@@ -6,19 +6,27 @@ from sqlalchemy.orm import Session
 from config import Config
 from database import schemas
 from database import models
-from utils.auth import get_password_hash, verify_password, create_access_token
-from utils.db import get_user_by_nickname, get_user
+from database.database import run_db
+from service.likes import apply_pending_likes
+from utils.auth import get_password_hash, create_access_token, invalidate_user, pwd_context, \
+    get_password_hash_async, verify_password_async
+from utils.cache import profiles_cache, invalidate_profile
+from utils.db import get_user_by_nickname, get_user, get_user_password, get_user_profile, get_favorites_id
+from utils.like_buffer import like_buffer
 
 
-def registration(db: Session, user_data: schemas.UserCreate, role: str = 'user') -> models.User:
+def registration(db: Session, user_data: schemas.UserCreate, role: str = 'user',
+                 hashed_password: str = None) -> models.User:
     """Registration new a user
 
     :param db: database connection
     :param user_data: object UserCreate with data a user for registration
     :param role: role the user in the app
+    :param hashed_password: hash of the password if it is already computed (see registration_async)
     :return: data the user
     """
-    hashed_password = get_password_hash(user_data.password)
+    if hashed_password is None:
+        hashed_password = get_password_hash(user_data.password)
     new_user = models.User(nickname=user_data.nickname, hashed_password=hashed_password, is_active=True, role=role)
     try:
         db.add(new_user)
@@ -34,8 +42,43 @@ def registration(db: Session, user_data: schemas.UserCreate, role: str = 'user')
     return new_user
 
 
+async def registration_async(db, user_data: schemas.UserCreate, role: str = 'user') -> models.User:
+    """Registration new a user, the password is hashed in the password pool
+
+    :param db: database connection of the request (Session or AsyncSession)
+    :param user_data: object UserCreate with data a user for registration
+    :param role: role the user in the app
+    :return: data the user
+    :raise PasswordQueueFull: too many passwords are being hashed
+    """
+    hashed_password = await get_password_hash_async(user_data.password)
+    return await run_db(db, registration, user_data, role, hashed_password)
+
+
+def issue_token(nickname: str) -> dict:
+    access_token_expires = timedelta(minutes=Config.ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(data={"sub": nickname}, expires_delta=access_token_expires)
+    return {"access_token": access_token, "token_type": "bearer"}
+
+
+def update_password_hash(db: Session, user_id: int, hashed_password: str):
+    """Replace the hash of the user password, e.g. after Config.BCRYPT_ROUNDS was changed
+
+    :param db: database connection
+    :param user_id: user id
+    :param hashed_password: new hash of the password
+    """
+    try:
+        db.query(models.User).filter(models.User.id == user_id).update(
+            {models.User.hashed_password: hashed_password}, synchronize_session=False)
+        db.commit()
+    except BaseException as e:
+        print(f'Error: {e}')
+        db.rollback()
+
+
 def login(db: Session, user_data: schemas.UserCreate) -> dict:
-    """User authorization
+    """User authorization. The hash of the password is replaced if it was made with other settings
 
     :param db: database connection
     :param user_data: object UserCreate with data a user for login
@@ -43,36 +86,66 @@ def login(db: Session, user_data: schemas.UserCreate) -> dict:
     """
     db_user = get_user_by_nickname(db, user_data.nickname)
     if db_user:
-        if verify_password(user_data.password, db_user.hashed_password):
-            access_token_expires = timedelta(minutes=Config.ACCESS_TOKEN_EXPIRE_MINUTES)
-            access_token = create_access_token(
-                data={"sub": user_data.nickname}, expires_delta=access_token_expires
-            )
-            return {"access_token": access_token, "token_type": "bearer"}
+        valid, new_hash = pwd_context.verify_and_update(user_data.password, db_user.hashed_password)
+        if valid:
+            if new_hash:
+                update_password_hash(db, db_user.id, new_hash)
+            return issue_token(user_data.nickname)
         else:
             return {'error': 'Invalid password'}
     return {'error': 'Invalid username'}
 
 
-def get_profile(db: Session, user_id: int) -> dict:
-    """Get user profile
+async def login_async(db, user_data: schemas.UserCreate) -> dict:
+    """User authorization like login, the password is verified in the password pool
+
+    :param db: database connection of the request (Session or AsyncSession)
+    :param user_data: object UserCreate with data a user for login
+    :return: Dictionary with access token and token type
+    :raise PasswordQueueFull: too many passwords are being verified
+    """
+    db_user = await run_db(db, get_user_password, user_data.nickname)
+    if db_user is None:
+        return {'error': 'Invalid username'}
+    valid, new_hash = await verify_password_async(user_data.password, db_user.hashed_password)
+    if not valid:
+        return {'error': 'Invalid password'}
+    if new_hash:
+        await run_db(db, update_password_hash, db_user.id, new_hash)
+    return issue_token(user_data.nickname)
+
+
+def get_profile(db: Session, user_id: int, favorites_limit: int = None, favorites_after: int = None) -> dict:
+    """Get user profile. The number of recipes is counted by the database and the favorites are read
+    as a list of recipe ids, the result is cached until the likes or the recipes of the user change
 
     :param db: database connection
     :param user_id: user id
+    :param favorites_limit: number of favorites, all of them if None
+    :param favorites_after: recipe id, only the favorites with bigger ids are returned
     :return: Dictionary with info about the user
     """
-    db_user = get_user(db, user_id)
-    if db_user:
-        profile = {
-            'id': db_user.id,
-            'nickname': db_user.nickname,
-            'is_active': db_user.is_active,
-            'favorites': [like.recipe_id for like in db_user.user_likes],
-            'number_my_recipe': len(db_user.my_recipe)
-        }
-        return profile
-    else:
-        return {'error': 'The user does not exist'}
+    # the pending likes may hide some favorites, so as many more are read
+    fetch = favorites_limit + len(like_buffer.user_changes(user_id)) if favorites_limit else None
+    pages = profiles_cache.get(user_id)
+    if pages is None:
+        pages = {}
+        profiles_cache.set(user_id, pages)
+    profile = pages.get((fetch, favorites_after))
+    if profile is None:
+        db_user = get_user_profile(db, user_id)
+        if db_user is None:
+            return {'error': 'The user does not exist'}
+        profile = pages[(fetch, favorites_after)] = (db_user, get_favorites_id(db, user_id, fetch, favorites_after))
+    db_user, favorites = profile
+    favorites = apply_pending_likes(user_id, favorites, fetch is None or len(favorites) < fetch, favorites_after)
+    return {
+        'id': db_user.id,
+        'nickname': db_user.nickname,
+        'is_active': db_user.is_active,
+        'favorites': favorites[:favorites_limit] if favorites_limit else favorites,
+        'number_my_recipe': db_user.number_my_recipe
+    }
 
 
 def ban_user(db: Session, user_id: int) -> models.User:
@@ -83,11 +156,15 @@ def ban_user(db: Session, user_id: int) -> models.User:
     :return: object User with data the user
     """
     user_data = get_user(db, user_id)
+    if user_data is None:
+        return None
     user_data.is_active = not user_data.is_active
     try:
         db.add(user_data)
         db.commit()
         db.refresh(user_data)
+        invalidate_user(user_data.nickname)
+        invalidate_profile(user_id)
     except BaseException as e:
         print(f'Error: {e}')
         db.rollback()
@@ -105,8 +182,11 @@ def delete_user(db: Session, user_id: int) -> bool:
     if user_data is None:
         return False
     try:
+        nickname = user_data.nickname
         db.delete(user_data)
         db.commit()
+        invalidate_user(nickname)
+        invalidate_profile(user_id)
     except BaseException as e:
         print(f'Error: {e}')
         db.rollback()
@@ -1,16 +1,20 @@
+import json
 import os
 import time
 import unittest
 from datetime import datetime
 from typing import List
+from unittest import mock
 
 from fastapi import UploadFile
 from fastapi.testclient import TestClient
 
 from app import app
+from config import Config
 from database import schemas, models
 from database.database import SessionLocal
-from service import user
+from service import user, hashtag
+from utils.pagination import encode_cursor
 
 client = TestClient(app)
 
@@ -34,12 +38,15 @@ class TestRoutes:
 
     def teardown_class(cls):
         cls.db.query(models.Likes).delete()
+        cls.db.query(models.Photo).delete()
+        cls.db.query(models.TagCount).delete()
         cls.db.query(models.RecipeHashtag).delete()
         cls.db.query(models.Recipe).delete()
         cls.db.query(models.User).delete()
         cls.db.query(models.Hashtag).delete()
         cls.db.commit()
         cls.db.close()
+        hashtag.tag_dictionary.clear()
 
     def test_create_user(self):
         response = client.post('/user', json=self.new_user)
@@ -91,7 +98,7 @@ class TestRoutes:
         assert response.status_code == 201
         response = response.json()
         assert list(response.keys()) == ['name', 'description', 'steps_making', 'type', 'is_active', 'date_creation',
-                                         'id', 'photo', 'author', 'likes', 'tags']
+                                         'id', 'photo', 'photo_variants', 'author', 'likes', 'tags', 'liked_by_me']
         TestRoutes.recipe_id = int(response['id'])
 
     def test_create_recipe_invalid_type(self):
@@ -115,6 +122,48 @@ class TestRoutes:
         print(response.json())
         assert response.status_code == 201
         assert response.json()['photo'] is not None
+        response = client.post(f'/recipe/{self.recipe_id + 1000}', files=file, headers=headers)
+        assert response.status_code == 404
+
+    def test_get_photo(self):
+        with open(basedir + r'/photo.jpg', 'rb') as f:
+            file_data = f.read()
+        response = client.get(f'/recipe/{self.recipe_id}/photo')
+        assert response.status_code == 200
+        assert response.content == file_data
+        assert response.headers['content-type'] == 'image/jpeg'
+        assert response.headers['cache-control'] == f'public, max-age={Config.PHOTO_MAX_AGE}'
+        etag = response.headers['etag']
+        response = client.get(f'/recipe/{self.recipe_id}/photo', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.content == b''
+        response = client.get(f'/recipe/{self.recipe_id}/photo', headers={'Range': 'bytes=10-19'})
+        assert response.status_code == 206
+        assert response.headers['content-range'] == f'bytes 10-19/{len(file_data)}'
+        assert response.content == file_data[10:20]
+        response = client.get(f'/recipe/{self.recipe_id}/photo', headers={'Range': 'bytes=-10', 'If-Range': '"old"'})
+        assert response.status_code == 200
+        response = client.get(f'/recipe/{self.recipe_id}/photo', headers={'Range': f'bytes={len(file_data)}-'})
+        assert response.status_code == 416
+        response = client.get(f'/recipe/{self.recipe_id}/photo?variant=thumbnail')
+        assert (response.headers['cache-control'] == 'no-store') == (response.content == file_data)
+        response = client.get(f'/recipe/{self.recipe_id}/photo?variant=invalid')
+        assert response.status_code == 400
+        response = client.get(f'/recipe/{self.recipe_id + 1000}/photo')
+        assert response.status_code == 404
+
+    def test_add_photo_invalid(self):
+        headers = {'jwt': self.jwt['user']}
+        file = {'photo': ('photo.jpg', b'not an image')}
+        response = client.post(f'/recipe/{self.recipe_id}', files=file, headers=headers)
+        assert response.status_code == 400
+        file = {'photo': ('photo.jpg', b'\xff\xd8\xff' + bytes(Config.MAX_PHOTO_SIZE))}
+        response = client.post(f'/recipe/{self.recipe_id}', files=file, headers=headers)
+        assert response.status_code == 413
+        # chunked body without Content-Length
+        response = client.post(f'/recipe/{self.recipe_id}', data=iter([b'--x\r\n']),
+                               headers={**headers, 'Content-Type': 'multipart/form-data; boundary=x'})
+        assert response.status_code == 411
 
     def test_get_recipes(self):
         headers = {'jwt': self.jwt['user']}
@@ -132,6 +181,31 @@ class TestRoutes:
         response = response.json()
         assert len(response) == 3
 
+    def test_get_recipes_by_pages(self):
+        headers = {'jwt': self.jwt['user']}
+        response = client.get(f'/recipe?limit=2', headers=headers)
+        assert response.status_code == 200
+        first_page = response.json()
+        assert len(first_page) == 2
+        cursor = response.headers['X-Next-Cursor']
+        response = client.get(f'/recipe?limit=2&cursor={cursor}', headers=headers)
+        assert response.status_code == 200
+        second_page = response.json()
+        assert len(second_page) == 1
+        assert 'X-Next-Cursor' not in response.headers
+        assert {recipe['id'] for recipe in first_page + second_page} == \
+               {recipe['id'] for recipe in client.get(f'/recipe', headers=headers).json()}
+        response = client.get(f'/recipe?cursor=invalid', headers=headers)
+        assert response.status_code == 400
+        assert response.json() == {'detail': 'Invalid cursor'}
+        # values of a wrong type in a well-formed cursor
+        cursor = encode_cursor(['x', 'y'])
+        for url in (f'/recipe?cursor={cursor}', f'/recipe?name=recipe&name_fuzzy=true&cursor={cursor}',
+                    f'/recipe/top?cursor={cursor}'):
+            response = client.get(url, headers=headers)
+            assert response.status_code == 400
+            assert response.json() == {'detail': 'Invalid cursor'}
+
     def test_get_recipe_by_name(self):
         headers = {'jwt': self.jwt['user']}
         response = client.get(f'/recipe?name=recipe', headers=headers)
@@ -182,18 +256,43 @@ class TestRoutes:
         assert len(response) == 1
         assert response[0]['name'] == 'Recipe'
 
+    def test_get_recipe_by_tags(self):
+        headers = {'jwt': self.jwt['user']}
+        response = client.get(f'/recipe?tags=tags1&tags=tags3', headers=headers)
+        assert response.status_code == 200
+        assert [recipe['name'] for recipe in response.json()] == ['Recipe 2']
+        response = client.get(f'/recipe?tags=tags2&tags=tags4&tags_mode=any', headers=headers)
+        assert response.status_code == 200
+        assert {recipe['name'] for recipe in response.json()} == {'Recipe', 'Vodka'}
+        response = client.get(f'/recipe?tag=unknown', headers=headers)
+        assert response.status_code == 200
+        assert response.json() == []
+
+    def test_search_recipes(self):
+        headers = {'jwt': self.jwt['user']}
+        response = client.get(f'/recipe?q=vodka', headers=headers)
+        assert response.status_code == 200
+        assert [recipe['name'] for recipe in response.json()] == ['Vodka']
+        response = client.get(f'/recipe?q=description&type=second', headers=headers)
+        assert response.status_code == 200
+        assert [recipe['name'] for recipe in response.json()] == ['Recipe 2']
+
     def test_like_it(self):
         headers = {'jwt': self.jwt['user']}
         response = client.post(f'/recipe/{self.recipe_id}/like', headers=headers)
         assert response.status_code == 200
         response = response.json()
         assert response == {'user_id': response['user_id'], 'favorites': [int(self.recipe_id)]}
+        response = client.post(f'/recipe/{self.recipe_id}/like', headers=headers)
+        assert response.status_code == 200
+        assert response.json()['favorites'] == []
+        client.post(f'/recipe/{self.recipe_id}/like', headers=headers)
 
     def test_like_it_invalid_recipe_id(self):
         headers = {'jwt': self.jwt['user']}
         response = client.post(f'/recipe/{self.recipe_id-100}/like', headers=headers)
         print(response.json())
-        assert response.status_code == 400
+        assert response.status_code == 404
         assert response.json() == {'detail': 'There is no such recipe'}
         response = client.post(f'/recipe/asd/like', headers=headers)
         assert response.status_code == 400
@@ -212,6 +311,10 @@ class TestRoutes:
         assert response.status_code == 200
         response = response.json()
         assert response[0]['id'] == self.recipe_id
+        assert response[0]['liked_by_me'] is True
+        response = client.get('/recipe/my', headers=headers)
+        assert [recipe['liked_by_me'] for recipe in response.json()] == [
+            recipe['id'] == self.recipe_id for recipe in response.json()]
 
     def test_get_my_recipe(self):
         headers = {'jwt': self.jwt['user']}
@@ -220,6 +323,28 @@ class TestRoutes:
         response = response.json()
         assert len(response) == 3
 
+    def test_get_recipes_not_modified(self):
+        headers = {'jwt': self.jwt['user']}
+        response = client.get('/recipe/my', headers=headers)
+        etag = response.headers['etag']
+        response = client.get('/recipe/my', headers=dict(headers, **{'If-None-Match': etag}))
+        assert response.status_code == 304
+        cached = client.get('/recipe/my', headers=headers)
+        assert cached.status_code == 200
+        assert cached.headers['etag'] == etag
+        # the next epoch: the response is made again, the same body keeps its validators
+        with mock.patch('time.time', return_value=time.time() + Config.RESPONSE_CACHE_TTL):
+            response = client.get('/recipe/my', headers=dict(headers, **{'If-None-Match': etag}))
+        assert response.status_code == 304
+        assert response.headers['etag'] == etag
+        client.post(f'/recipe/{self.recipe_id}/like', headers=headers)
+        response = client.get('/recipe/my', headers=dict(headers, **{
+            'If-None-Match': etag, 'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'}))
+        assert response.status_code == 200
+        assert response.headers['etag'] != etag
+        assert response.json() != cached.json()
+        client.post(f'/recipe/{self.recipe_id}/like', headers=headers)
+
     def test_change_my_recipe(self):
         headers = {'jwt': self.jwt['user']}
         json = {"name": 'New Name', "description": 'New Description', "type": 'drink',
@@ -228,6 +353,7 @@ class TestRoutes:
         response = client.put(f'/recipe/{self.recipe_id}', json=json, headers=headers)
         print(response.json())
         assert response.status_code == 200
+        assert response.cookies.get('read_primary') == '1'
 
     def test_ban_recipe(self):
         headers = {'jwt': self.jwt['admin']}
@@ -264,6 +390,63 @@ class TestRoutes:
         response = response.json()
         assert response['is_active'] is True
 
+    def test_import_recipes(self):
+        headers = {'jwt': self.jwt['admin']}
+        recipe = dict(self.new_recipe, name='Imported', tags=['tags1', 'imported'])
+        invalid = dict(self.new_recipe, type='invalid')
+        response = client.post('/recipe/bulk', json=[recipe, invalid, {'name': 'No fields'}, recipe], headers=headers)
+        assert response.status_code == 200
+        response = response.json()
+        assert response['created'] == 2
+        assert [error['index'] for error in response['errors']] == [1, 2]
+        ndjson = '\n'.join(json.dumps(item) for item in [recipe, recipe]) + '\n{invalid json\n'
+        response = client.post('/recipe/bulk', data=ndjson,
+                               headers=dict(headers, **{'Content-Type': 'application/x-ndjson'}))
+        assert response.status_code == 200
+        response = response.json()
+        assert response['created'] == 2
+        assert [error['index'] for error in response['errors']] == [2]
+        response = client.get('/recipe?tag=imported', headers=headers)
+        assert len(response.json()) == 4
+        assert response.json()[0]['tags'] == ['tags1', 'imported']
+        response = client.post('/recipe/bulk', json=[recipe], headers={'jwt': self.jwt['user']})
+        assert response.status_code == 401
+
+    def test_get_tags(self):
+        headers = {'jwt': self.jwt['user']}
+        response = client.get('/recipe/tags', params={'type': self.new_recipe['type']}, headers=headers)
+        assert response.status_code == 200
+        assert {'tag': 'imported', 'count': 4} in response.json()
+        response = client.get('/recipe/tags', params={'type': 'unknown'}, headers=headers)
+        assert response.json() == []
+
+    def test_suggest_tags(self):
+        response = client.get('/recipe/tags/suggest', params={'prefix': 'IMP'}, headers={'jwt': self.jwt['user']})
+        assert response.status_code == 200
+        assert response.json() == [{'tag': 'imported', 'count': 4}]
+
+    def test_export_recipes(self):
+        headers = {'jwt': self.jwt['admin']}
+        count = self.db.query(models.Recipe).count()
+        response = client.get('/recipe/export', headers=dict(headers, **{'Accept-Encoding': 'identity'}))
+        assert response.status_code == 200
+        assert response.headers['content-type'] == 'application/x-ndjson'
+        recipes = [json.loads(line) for line in response.text.splitlines()]
+        assert len(recipes) == count
+        assert [recipe['id'] for recipe in recipes] == sorted(recipe['id'] for recipe in recipes)
+        assert recipes[-1]['tags'] == ['tags1', 'imported']
+        assert 'updated_at' in recipes[-1]
+        response = client.get('/recipe/export', headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+        assert response.headers['content-encoding'] == 'gzip'
+        assert len(response.text.splitlines()) == count
+        response = client.get('/recipe/export', headers=dict(headers, **{'Accept-Encoding': 'gzip;q=0, br'}))
+        assert 'content-encoding' not in response.headers
+        assert len(response.text.splitlines()) == count
+        response = client.get('/recipe/export', params={'since': '2999-01-01T00:00:00'}, headers=headers)
+        assert response.text == ''
+        response = client.get('/recipe/export', headers={'jwt': self.jwt['user']})
+        assert response.status_code == 401
+
     def test_delete_recipe(self):
         headers = {'jwt': self.jwt['admin']}
         response = client.delete(f'/recipe/{self.recipe_id}', headers=headers)
@@ -1,11 +1,37 @@
+import asyncio
+import io
+import os
 import unittest
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List
+from typing import Iterator, List
+from unittest import mock
 
-from database.database import SessionLocal
+import pytest
+from PIL import Image
+from sqlalchemy import event
+
+from config import Config
+from database.database import SessionLocal, Replicas
 from database import schemas, models
-from service import user, recipe, hashtag, likes
-from utils import db
+from service import user, recipe, hashtag, likes, photo
+from utils import db, auth, upload, bulk
+from utils.storage import storage, derived_key
+
+
+@contextmanager
+def recorded_statements(session) -> Iterator[List[str]]:
+    """Collect the SQL statements the session sends to the database inside the block"""
+    statements = []
+
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(session.bind, 'before_cursor_execute', record_statement)
+    try:
+        yield statements
+    finally:
+        event.remove(session.bind, 'before_cursor_execute', record_statement)
 
 
 class TestService:
@@ -27,12 +53,15 @@ class TestService:
 
     def teardown_class(cls):
         cls.db.query(models.Likes).delete()
+        cls.db.query(models.Photo).delete()
+        cls.db.query(models.TagCount).delete()
         cls.db.query(models.RecipeHashtag).delete()
         cls.db.query(models.Recipe).delete()
         cls.db.query(models.User).delete()
         cls.db.query(models.Hashtag).delete()
         cls.db.commit()
         cls.db.close()
+        hashtag.tag_dictionary.clear()
 
     def test_registration(self):
         user_data = user.registration(self.db, self.new_user, 'user')
@@ -59,6 +88,25 @@ class TestService:
         jwt = user.login(self.db, invalid_user)
         assert jwt == {'error': 'Invalid password'}
 
+    def test_login_rehash_password(self):
+        old_hash = auth.pwd_context.handler('bcrypt').using(rounds=4).hash(self.new_user.password)
+        user.update_password_hash(self.db, self.user.id, old_hash)
+        jwt = asyncio.run(user.login_async(self.db, self.new_user))
+        assert 'access_token' in jwt.keys()
+        self.db.refresh(self.user)
+        assert self.user.hashed_password != old_hash
+        assert not auth.pwd_context.needs_update(self.user.hashed_password)
+
+    def test_password_queue_full(self):
+        for _ in range(Config.PASSWORD_QUEUE_SIZE):
+            auth.password_slots.acquire()
+        try:
+            with pytest.raises(auth.PasswordQueueFull):
+                asyncio.run(user.login_async(self.db, self.new_user))
+        finally:
+            for _ in range(Config.PASSWORD_QUEUE_SIZE):
+                auth.password_slots.release()
+
     def test_get_profile(self):
         profile = user.get_profile(self.db, self.user.id)
         assert profile == {
@@ -86,6 +134,12 @@ class TestService:
         assert type(db_recipe.id) is int
         TestService.recipe = db_recipe
 
+    def test_create_recipe_hashtags(self):
+        assert sorted(link.tag.tag for link in self.recipe.tags) == sorted(set(self.tags))
+        db_recipe = recipe.create_recipe(self.db, self.new_recipe, self.user.id, [self.tags[0], 'new tag', 'new tag'])
+        assert sorted(link.tag.tag for link in db_recipe.tags) == sorted([self.tags[0], 'new tag'])
+        assert recipe.delete_recipe(self.db, db_recipe.id)
+
     def test_get_recipes(self):
         recipes = db.get_recipes(self.db)
         assert recipes[0].id == self.recipe.id
@@ -122,12 +176,73 @@ class TestService:
         recipes = recipe.get_recipe_by_filter(self.db, name='re', type='Десерт', tag='Chocolate')
         assert len(recipes) == 2
 
+    def test_search_recipes(self):
+        cake = schemas.RecipeCreate(name='Chocolate cake', description='Cake with chocolate cream',
+                                    steps_making='1. Melt the chocolate 2. Bake', type='Десерт', is_active=True,
+                                    date_creation=datetime.today(), author_id=0)
+        cake = recipe.create_recipe(self.db, cake, self.user.id, ['chocolate'])
+        cocktail = schemas.RecipeCreate(name='Cocktail', description='Cold drink',
+                                        steps_making='1. Add chocolate syrup 2. Shake', type='Напиток',
+                                        is_active=True, date_creation=datetime.today(), author_id=0)
+        cocktail = recipe.create_recipe(self.db, cocktail, self.user.id, ['drink'])
+        recipes = recipe.get_recipe_by_filter(self.db, q='Chocolate')
+        assert [db_recipe.id for db_recipe in recipes] == [cake.id, cocktail.id]
+        recipes = recipe.get_recipe_by_filter(self.db, q='chocolate', type='Напиток')
+        assert [db_recipe.id for db_recipe in recipes] == [cocktail.id]
+        recipes = recipe.get_recipe_by_filter(self.db, q='chocolate', limit=1)
+        assert [db_recipe.id for db_recipe in recipes] == [cake.id]
+        recipes = recipe.get_recipe_by_filter(self.db, q='chocolate', limit=1, cursor=recipes.next_cursor)
+        assert [db_recipe.id for db_recipe in recipes] == [cocktail.id]
+        assert recipes.next_cursor is None
+        recipe.change_recipe(self.db, cocktail.id, schemas.RecipeChange(steps_making='1. Shake'), self.user.id)
+        recipes = recipe.get_recipe_by_filter(self.db, q='chocolate')
+        assert [db_recipe.id for db_recipe in recipes] == [cake.id]
+
+    def test_search_recipes_by_fuzzy_name(self):
+        recipes = recipe.get_recipe_by_filter(self.db, name='Vodak', name_fuzzy=True)
+        assert [db_recipe.name for db_recipe in recipes] == ['Vodka']
+        recipes = recipe.get_recipe_by_filter(self.db, name='Chocolat cake', name_fuzzy=True)
+        assert recipes[0].name == 'Chocolate cake'
+        recipes = recipe.get_recipe_by_filter(self.db, name='Chocolat cake', type='Напиток', name_fuzzy=True)
+        assert len(recipes) == 0
+        similar = [recipe.create_recipe(self.db, self.new_recipe.copy(update={'name': name}), self.user.id, [])
+                   for name in ('Chocolate cakes', 'Chocolate')]
+        pages, cursor = [], None
+        while True:
+            page = recipe.get_recipe_by_filter(self.db, name='Chocolat cake', name_fuzzy=True, cursor=cursor, limit=1)
+            pages.extend(db_recipe.name for db_recipe in page)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        assert pages == ['Chocolate cake', 'Chocolate cakes', 'Chocolate']
+        for db_recipe in similar:
+            recipe.delete_recipe(self.db, db_recipe.id)
+        recipes = recipe.get_recipe_by_filter(self.db, name='Chocolat cake', q='cake', name_fuzzy=True)
+        assert recipes[0].name == 'Chocolate cake'
+        vodka = recipe.get_recipe_by_filter(self.db, name='Vodka')[0]
+        recipe.change_recipe(self.db, vodka.id, schemas.RecipeChange(name='Whiskey'), self.user.id)
+        assert len(recipe.get_recipe_by_filter(self.db, name='Vodak', name_fuzzy=True)) == 0
+        assert len(recipe.get_recipe_by_filter(self.db, name='Whisky', name_fuzzy=True)) == 1
+        recipe.change_recipe(self.db, vodka.id, schemas.RecipeChange(name='Vodka'), self.user.id)
+
+    def test_get_recipe_by_tags(self):
+        recipes = recipe.get_recipe_by_filter(self.db, tags=['Chocolate', 'lemon'])
+        assert [db_recipe.name for db_recipe in recipes] == ['Re 2']
+        recipes = recipe.get_recipe_by_filter(self.db, tags=['Chocolate', 'lemon'], tags_mode='any')
+        assert {db_recipe.name for db_recipe in recipes} == {'Recipe', 'Re 2'}
+        recipes = recipe.get_recipe_by_filter(self.db, tag='drink', tags=['alcohol'])
+        assert [db_recipe.name for db_recipe in recipes] == ['Vodka']
+        assert len(recipe.get_recipe_by_filter(self.db, tag='unknown')) == 0
+        with recorded_statements(self.db) as statements:
+            recipes = recipe.get_recipe_by_filter(self.db, name='re', type='Десерт', tags=['Chocolate', 'Cake'])
+        assert len(statements) == 1
+        assert [db_recipe.name for db_recipe in recipes] == ['Recipe']
+
     def test_like_it(self):
         like = schemas.LikeCreate(user_id=self.user.id, recipe_id=self.recipe.id)
-        like_it = likes.like_it(self.db, like)
-        assert like_it.id is not None
-        like_it = likes.like_it(self.db, like)
-        assert like_it.id is None
+        assert likes.like_it(self.db, like) == likes.ADDED
+        assert likes.like_it(self.db, like) == likes.REMOVED
+        assert likes.like_it(self.db, schemas.LikeCreate(user_id=self.user.id, recipe_id=-1)) == likes.MISSING
 
     def test_get_top_recipe(self):
         like = schemas.LikeCreate(user_id=self.user.id, recipe_id=self.recipe.id + 1)
@@ -139,7 +254,149 @@ class TestService:
         like.recipe_id = self.recipe.id
         likes.like_it(self.db, like)
         top = recipe.get_top_recipe(self.db, 2)
-        assert top[0].id == self.recipe.id
+        assert [db_recipe.id for db_recipe in top] == [self.recipe.id + 1, self.recipe.id]
+        assert [db_recipe.likes_count for db_recipe in top] == [2, 1]
+
+    def test_top_recipes_board(self):
+        recipe.ban_recipe(self.db, self.recipe.id + 1)
+        top = recipe.get_top_recipe(self.db, 1)
+        assert [db_recipe.id for db_recipe in top] == [self.recipe.id]
+        recipe.ban_recipe(self.db, self.recipe.id + 1)
+        like = schemas.LikeCreate(user_id=self.user.id, recipe_id=self.recipe.id)
+        likes.like_it(self.db, like)
+        top = recipe.get_top_recipe(self.db, 1)
+        assert [db_recipe.id for db_recipe in top] == [self.recipe.id + 1]
+        with recorded_statements(self.db) as statements:
+            top = recipe.get_top_recipe(self.db, 1, top.next_cursor)
+        assert len(statements) == 1
+        assert [(db_recipe.id, db_recipe.likes_count) for db_recipe in top] == [(self.recipe.id, 2)]
+        likes.like_it(self.db, like)
+        assert recipe.top_recipes.scores[self.recipe.id] == 1
+
+    def test_reconcile_likes_count(self):
+        self.db.query(models.Recipe).filter(models.Recipe.id == self.recipe.id).update(
+            {models.Recipe.likes_count: 10}, synchronize_session=False)
+        self.db.commit()
+        assert likes.reconcile_likes_count(self.db) == 1
+        assert db.get_recipe_for_admin(self.db, self.recipe.id).likes_count == 1
+        assert likes.reconcile_likes_count(self.db) == 0
+
+    def test_write_behind_likes(self):
+        like = schemas.LikeCreate(user_id=self.user.id, recipe_id=self.recipe.id)
+        likes_count = db.get_recipe_for_admin(self.db, self.recipe.id).likes_count
+        liked = self.recipe.id in user.get_profile(self.db, self.user.id)['favorites']
+        assert likes.toggle_like(self.db, like) is not liked
+        assert likes.toggle_like(self.db, like) is liked
+        assert len(likes.like_buffer) == 0
+        assert likes.toggle_like(self.db, like) is not liked
+        assert (self.recipe.id in user.get_profile(self.db, self.user.id)['favorites']) is not liked
+        assert likes.like_buffer.user_changes(self.user.id) == {self.recipe.id: not liked}
+        likes.flush_likes()
+        assert len(likes.like_buffer) == 0
+        assert likes.like_buffer.users == {}
+        self.db.expire_all()
+        assert db.get_recipe_for_admin(self.db, self.recipe.id).likes_count == likes_count + (-1 if liked else 1)
+        assert (db.get_likes_by_user_recipe(self.db, self.user.id, self.recipe.id) is None) is liked
+        likes.toggle_like(self.db, like)
+        likes.stop_flusher()
+        self.db.expire_all()
+        assert db.get_recipe_for_admin(self.db, self.recipe.id).likes_count == likes_count
+        assert (self.recipe.id in user.get_profile(self.db, self.user.id)['favorites']) is liked
+        assert likes.toggle_like(self.db, schemas.LikeCreate(user_id=self.user.id, recipe_id=-1)) is None
+        # the like is in the table already (written by another process), it isn't counted again
+        if not liked:
+            likes.like_it(self.db, like)
+        likes_count = db.get_recipe_for_admin(self.db, self.recipe.id).likes_count
+        assert likes.write_likes(self.db, {(self.user.id, self.recipe.id): (False, True)}) == {}
+        self.db.commit()
+        self.db.expire_all()
+        assert db.get_recipe_for_admin(self.db, self.recipe.id).likes_count == likes_count
+        if not liked:
+            likes.like_it(self.db, like)
+        # a batch that couldn't be written is kept and written again after a pause
+        likes.like_buffer.toggle(self.user.id, self.recipe.id, liked)
+        with mock.patch.object(likes, 'write_likes', side_effect=OSError('database is down')):
+            assert likes.flush_likes() == 0
+            assert len(likes.like_buffer) == 1
+            assert likes.flush_likes() == 0
+            assert likes.failed_flushes == 1
+        assert likes.flush_likes(force=True) == 1
+        assert likes.failed_flushes == 0
+        likes.like_buffer.toggle(self.user.id, self.recipe.id, not liked)
+        assert likes.flush_likes() == 1
+
+    def test_get_profile_aggregates(self):
+        profile = user.get_profile(self.db, self.user.id)
+        assert profile['number_my_recipe'] == len(recipe.get_user_recipes(self.db, self.user.id))
+        with recorded_statements(self.db) as statements:
+            assert user.get_profile(self.db, self.user.id) == profile
+        assert statements == []
+        like = schemas.LikeCreate(user_id=self.user.id, recipe_id=self.recipe.id + 2)
+        likes.like_it(self.db, like)
+        favorites = user.get_profile(self.db, self.user.id)['favorites']
+        assert favorites == sorted(profile['favorites'] + [self.recipe.id + 2])
+        assert user.get_profile(self.db, self.user.id, 1)['favorites'] == favorites[:1]
+        assert user.get_profile(self.db, self.user.id, 2, favorites[0])['favorites'] == favorites[1:3]
+        likes.like_it(self.db, like)
+        assert user.get_profile(self.db, self.user.id) == profile
+
+    def test_get_recipes_show(self):
+        recipes = db.get_recipes(self.db)
+        with recorded_statements(self.db) as statements:
+            recipes_show = recipe.get_recipes_show(self.db, recipes)
+        assert len(statements) == 1
+        recipes_show = {recipe_show.id: recipe_show for recipe_show in recipes_show}
+        assert set(recipes_show[self.recipe.id].tags) == set(self.tags)
+        assert recipes_show[self.recipe.id].likes == 1
+        assert recipes_show[self.recipe.id + 1].likes == 2
+        assert recipes_show[self.recipe.id].author == self.user.nickname
+        assert recipes_show[self.recipe.id].liked_by_me is None
+        favorites = set(user.get_profile(self.db, self.user.id)['favorites'])
+        with recorded_statements(self.db) as statements:
+            recipes_show = recipe.get_recipes_show(self.db, recipes, self.user.id)
+        assert len(statements) == 2
+        assert favorites and [recipe_show.id for recipe_show in recipes_show if recipe_show.liked_by_me] == \
+            [db_recipe.id for db_recipe in recipes if db_recipe.id in favorites]
+
+    def test_create_photo_variants(self):
+        with open(os.path.join(os.path.dirname(__file__), 'photo.jpg'), 'rb') as f:
+            stored = upload.store_upload(f, storage)
+        recipe.add_photo(self.db, self.recipe.id, stored.key)
+        variants = photo.create_variants(self.db, self.recipe.id, stored.key)
+        assert list(variants.keys()) == ['thumbnail', 'card', 'full']
+        assert [Image.open(storage.local_path(variants[name])).size for name in variants] == [
+            (160, 160), (480, 480), (800, 800)]
+        self.db.refresh(self.recipe)
+        assert self.recipe.photo_variants == variants
+        assert recipe.get_recipes_show(self.db, [self.recipe])[0].photo_variants == variants
+
+    def test_photo_storage(self):
+        with open(os.path.join(os.path.dirname(__file__), 'photo.jpg'), 'rb') as f:
+            stored = upload.store_upload(f, storage)
+        assert stored.key == f'{stored.sha256[:2]}/{stored.sha256[2:4]}/{stored.sha256}.jpg'
+        assert stored.key == self.recipe.photo
+
+        def refcount():
+            return self.db.query(models.Photo.refcount).filter(models.Photo.key == stored.key).scalar()
+
+        copy = recipe.create_recipe(self.db, self.new_recipe, self.user.id, [])
+        with open(os.path.join(os.path.dirname(__file__), 'photo.jpg'), 'rb') as f:
+            received = upload.receive_upload(f, storage)
+        assert recipe.add_photo(self.db, copy.id + 1000, received.key, received.path) is None
+        assert recipe.add_photo(self.db, copy.id, received.key, received.path).photo == stored.key
+        assert refcount() == 2
+        assert not os.path.exists(received.path)
+        recipe.delete_recipe(self.db, copy.id)
+        assert refcount() == 1
+        assert storage.exists(stored.key)
+
+        png = io.BytesIO()
+        Image.new('RGBA', (10, 10)).save(png, 'PNG')
+        png.seek(0)
+        recipe.add_photo(self.db, self.recipe.id, upload.store_upload(png, storage).key)
+        assert refcount() is None
+        assert not storage.exists(stored.key)
+        assert not storage.exists(derived_key(stored.key, 'thumbnail'))
 
     def test_ban_recipe(self):
         recipes_before = db.get_recipes(self.db)
@@ -158,10 +415,98 @@ class TestService:
         user_data = user.ban_user(self.db, self.user.id)
         assert user_data.is_active is True
 
+    def test_get_current_user(self):
+        token = user.login(self.db, self.new_user)['access_token']
+        current_user = auth.get_current_user(token, self.db)
+        assert current_user == (self.user.id, self.user.nickname, 'user', True)
+        assert auth.get_current_user(token) is current_user
+        user.ban_user(self.db, self.user.id)
+        assert auth.get_current_user(token, self.db).is_active is False
+        user.ban_user(self.db, self.user.id)
+        assert auth.get_current_user(token, self.db).is_active is True
+
+    def test_read_replicas(self):
+        replicas = Replicas(['sqlite:////nonexistent/replica.db', Config.URL_DB])
+        read_db = asyncio.run(replicas.open())
+        assert user.get_user(read_db, self.user.id).id == self.user.id
+        assert replicas.available() == [1]
+        read_db.close()
+        assert asyncio.run(Replicas(['sqlite:////nonexistent/replica.db']).open()) is None
+
+    def test_import_recipes(self):
+        recipes = [schemas.RecipeImport(name='Imported pie', description='Apple pie', steps_making='Bake',
+                                        type='dessert', date_creation='2020-04-09', tags=['Cake', 'apple']),
+                   schemas.RecipeImport(name='Imported tea', description='Tea', steps_making='Brew',
+                                        type='drink', date_creation='2020-04-09', tags=['apple', 'apple'])]
+        recipes_id = recipe.import_recipes(self.db, recipes, self.user.id)
+        assert len(recipes_id) == 2
+        imported = recipe.get_recipes_show(self.db, db.get_recipes_by_id(self.db, recipes_id))
+        assert [(r.id, r.name, r.tags, r.author) for r in imported] == [
+            (recipes_id[0], 'Imported pie', ['Cake', 'apple'], self.user.nickname),
+            (recipes_id[1], 'Imported tea', ['apple'], self.user.nickname)]
+        assert [r.id for r in recipe.get_recipe_by_filter(self.db, q='apple pie')] == [recipes_id[0]]
+        assert self.db.query(models.Hashtag).filter(models.Hashtag.tag == 'Cake').count() == 1
+        for recipe_id in recipes_id:
+            recipe.delete_recipe(self.db, recipe_id)
+
+    def test_export_recipes(self):
+        count = self.db.query(models.Recipe).count()
+        batches = list(recipe.export_recipes(self.db, batch_size=2))
+        assert [len(batch) for batch in batches] == [2] * (count // 2) + [count % 2] * (count % 2)
+        exported = [recipe_data for batch in batches for recipe_data in batch]
+        recipes_id = [r.id for r in recipe.query_recipes(self.db).order_by(models.Recipe.id)]
+        assert [recipe_data['id'] for recipe_data in exported] == recipes_id
+        assert 'liked_by_me' not in exported[0] and exported[0]['updated_at'] is not None
+        assert list(recipe.export_recipes(self.db, since=datetime(2999, 1, 1))) == []
+        closed = []
+
+        def export():
+            try:
+                yield from recipe.export_recipes(self.db, batch_size=1)
+            finally:
+                closed.append(True)
+
+        async def read_first_chunk():
+            chunks = bulk.write_items(export())
+            first = await chunks.__anext__()
+            # the client went away, the stream is dropped
+            await chunks.aclose()
+            return first
+
+        assert asyncio.run(read_first_chunk()).count(b'\n') == 1
+        assert closed == [True]
+
+    def test_suggest_hashtags(self):
+        tags = hashtag.get_tag_dictionary(self.db)
+        assert tags.get('Cake') == db.get_hashtag(self.db, 'Cake').id
+        assert tags.suggest('CH', 2) == [('Chocolate', 2), ('chocolate', 1)]
+        db_recipe = recipe.create_recipe(self.db, self.new_recipe, self.user.id, ['Chocolate', 'cherry'])
+        assert tags.suggest('ch', 3) == [('Chocolate', 3), ('cherry', 1), ('chocolate', 1)]
+        recipe.delete_recipe(self.db, db_recipe.id)
+        assert tags.suggest('ch', 3) == [('Chocolate', 2), ('chocolate', 1), ('cherry', 0)]
+        assert tags.suggest('x', 3) == []
+
+    def test_tag_counts(self):
+        cream = {'tag': 'Cream', 'count': 1}
+        assert cream in hashtag.get_tags_statistics(self.db)
+        assert cream in hashtag.get_tags_statistics(self.db, 'Десерт')
+        assert cream not in hashtag.get_tags_statistics(self.db, 'Напиток')
+        recipe.ban_recipe(self.db, self.recipe.id)
+        assert cream not in hashtag.get_tags_statistics(self.db)
+        recipe.ban_recipe(self.db, self.recipe.id)
+        recipe.change_recipe(self.db, self.recipe.id, schemas.RecipeChange(type='dessert'), self.user.id)
+        assert cream in hashtag.get_tags_statistics(self.db, 'dessert')
+        assert cream not in hashtag.get_tags_statistics(self.db, 'Десерт')
+        assert hashtag.reconcile_tag_counts(self.db) == 0
+        self.db.query(models.TagCount).delete()
+        self.db.commit()
+        assert hashtag.reconcile_tag_counts(self.db) > 0
+        assert cream in hashtag.get_tags_statistics(self.db, 'dessert')
+
     def test_delete_recipe(self):
         result = recipe.delete_recipe(self.db, self.recipe.id)
         assert result is True
-        resipes_id = [db_recipe.id for db_recipe in recipe.get_recipes(self.db)]
+        resipes_id = [db_recipe.id for db_recipe in db.get_recipes(self.db)]
         assert self.recipe.id not in resipes_id
 
     def test_delete_user(self):
@@ -1,19 +1,44 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta, datetime
+from typing import NamedTuple, Tuple
 
 import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt import PyJWTError
 from passlib.context import CryptContext
+from sqlalchemy.orm import Session
 
 from config import Config
-from database.database import SessionLocal
+from database.database import SessionLocal, run_db
+from utils.cache import TTLCache
 from utils.db import get_user_by_nickname
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=Config.BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
 
 
+class CurrentUser(NamedTuple):
+    id: int
+    nickname: str
+    role: str
+    is_active: bool
+
+
+# nickname (sub of the token) -> CurrentUser
+users_cache = TTLCache(Config.USER_CACHE_SIZE, Config.USER_CACHE_TTL)
+
+# bcrypt releases the GIL, so hashing runs on its own threads and doesn't occupy the event loop or the threadpool
+password_pool = ThreadPoolExecutor(max_workers=Config.PASSWORD_WORKERS, thread_name_prefix='password')
+password_slots = threading.BoundedSemaphore(Config.PASSWORD_QUEUE_SIZE)
+
+
+class PasswordQueueFull(Exception):
+    """Too many passwords are waiting to be hashed"""
+
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
@@ -22,6 +47,33 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+async def run_password_pool(fn, *args):
+    """Call fn(*args) in the password pool. At most Config.PASSWORD_QUEUE_SIZE calls wait or run at once,
+    others are rejected right away instead of growing the queue
+
+    :raise PasswordQueueFull: the queue is full
+    """
+    if not password_slots.acquire(blocking=False):
+        raise PasswordQueueFull()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_pool, fn, *args)
+    finally:
+        password_slots.release()
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await run_password_pool(get_password_hash, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, str]:
+    """Verify the password in the password pool
+
+    :return: result of the verification and a new hash of the password if the old one must be replaced
+        (e.g. Config.BCRYPT_ROUNDS was changed), otherwise None
+    """
+    return await run_password_pool(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
 def create_access_token(*, data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -33,22 +85,67 @@ def create_access_token(*, data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def get_token_subject(token: str) -> str:
     try:
         payload = jwt.decode(token, Config.SECRET_KEY, algorithms=[Config.ALGORITHM])
         nickname: str = payload.get("sub")
         if nickname is None:
-            raise credentials_exception
+            raise credentials_exception()
     except PyJWTError:
-        raise credentials_exception
-    db = SessionLocal()
-    user = get_user_by_nickname(db, nickname)
-    db.close()
-    if user is None:
-        raise credentials_exception
+        raise credentials_exception()
+    return nickname
+
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = None) -> CurrentUser:
+    """Get the user of the token. The user is cached for Config.USER_CACHE_TTL seconds
+
+    :param token: access token
+    :param db: database connection, if it is not set a new connection is opened on a cache miss
+    :return: object CurrentUser with data the user
+    """
+    nickname = get_token_subject(token)
+    user = users_cache.get(nickname)
+    if user is not None:
+        return user
+    if db is None:
+        db = SessionLocal()
+        try:
+            db_user = get_user_by_nickname(db, nickname)
+        finally:
+            db.close()
+    else:
+        db_user = get_user_by_nickname(db, nickname)
+    if db_user is None:
+        raise credentials_exception()
+    user = CurrentUser(id=db_user.id, nickname=db_user.nickname, role=db_user.role, is_active=db_user.is_active)
+    users_cache.set(nickname, user)
     return user
+
+
+async def get_current_user_async(token: str, db) -> CurrentUser:
+    """Get the user of the token in an async route, the database is used only on a cache miss
+
+    :param token: access token
+    :param db: database connection of the request (Session or AsyncSession)
+    :return: object CurrentUser with data the user
+    """
+    user = users_cache.get(get_token_subject(token))
+    if user is not None:
+        return user
+    return await run_db(db, lambda session: get_current_user(token, session))
+
+
+def invalidate_user(nickname: str):
+    """Remove the user from the cache of get_current_user after the user was changed
+
+    :param nickname: user nickname
+    """
+    users_cache.pop(nickname)
@@ -0,0 +1,83 @@
+import json
+import zlib
+from typing import AsyncIterator, Iterator, List, Tuple, Any
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+
+from utils.responses import dumps
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+class InvalidItem(ValueError):
+    """The item couldn't be parsed"""
+
+
+async def read_items(request: Request, batch_size: int) -> AsyncIterator[List[Tuple[int, Any]]]:
+    """Read the items of a JSON array or an NDJSON stream (one JSON document per line) by batches.
+    An NDJSON body is parsed while it is received, so memory depends on the batch size only
+
+    :param request: request with the items in the body
+    :param batch_size: number of items in a batch
+    :return: batches of (index of the item, item or InvalidItem if the item isn't valid JSON)
+    :raise ValueError: the body is not a JSON array
+    """
+    if request.headers.get('content-type', '').split(';')[0].strip() not in NDJSON_TYPES:
+        items = json.loads(await request.body())
+        if not isinstance(items, list):
+            raise ValueError('A JSON array is expected')
+        for start in range(0, len(items), batch_size):
+            yield list(enumerate(items[start:start + batch_size], start))
+        return
+
+    batch, index, rest = [], 0, b''
+    async for chunk in request.stream():
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            if line.strip():
+                batch.append((index, parse_line(line)))
+                index += 1
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+    if rest.strip():
+        batch.append((index, parse_line(rest)))
+    if batch:
+        yield batch
+
+
+def parse_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return InvalidItem(str(e))
+
+
+async def write_items(batches: Iterator[List[Any]], compress: bool = False) -> AsyncIterator[bytes]:
+    """Encode batches of items as NDJSON while they are read. The next batch is read on the threadpool
+    (the iterator may query the database) only after the previous one was sent
+
+    :param batches: iterator with batches of items
+    :param compress: compress the stream with gzip
+    :return: chunks of the body, one per batch
+    """
+    # wbits=31 makes the gzip container, so the stream can be sent with Content-Encoding: gzip
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    try:
+        while True:
+            batch = await run_in_threadpool(next, batches, None)
+            if batch is None:
+                break
+            chunk = b''.join(dumps(item) + b'\n' for item in batch)
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        if compressor is not None:
+            yield compressor.flush()
+    finally:
+        # a generator releases what it holds (e.g. a database session) in its finally
+        if hasattr(batches, 'close'):
+            await run_in_threadpool(batches.close)
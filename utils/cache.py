@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from config import Config
+
+
+class TTLCache:
+    """Bounded LRU cache whose items expire after ttl seconds"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return default
+            value, expire = item
+            if expire <= time.monotonic():
+                del self.items[key]
+                return default
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + ttl)
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+# user id -> {(favorites limit, favorites after): profile without the pending likes}, see service.user.get_profile
+profiles_cache = TTLCache(Config.PROFILE_CACHE_SIZE, Config.PROFILE_CACHE_TTL)
+
+
+def invalidate_profile(user_id: int = None):
+    """Remove the profile of the user (of all users if user_id is None) from the cache after it changed
+
+    :param user_id: user id
+    """
+    if user_id is None:
+        profiles_cache.clear()
+    else:
+        profiles_cache.pop(user_id)
@@ -1,7 +1,7 @@
 from typing import List
 
-from sqlalchemy import and_, func, desc
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, func, distinct, desc
+from sqlalchemy.orm import Session, joinedload
 
 from database import models
 
@@ -14,44 +14,61 @@ def get_user_by_nickname(db: Session, nickname: str) -> models.User:
     return db.query(models.User).filter(models.User.nickname == nickname).first()
 
 
-def get_recipe(db: Session, recipe_id: int) -> models.Recipe:
-    return db.query(and_(models.Recipe.id == recipe_id, models.Recipe.is_active == True)).first()
+def get_user_password(db: Session, nickname: str):
+    return db.query(models.User.id, models.User.hashed_password).filter(models.User.nickname == nickname).first()
+
+
+def query_recipes(db: Session):
+    return db.query(models.Recipe).options(joinedload(models.Recipe.author))
 
 
 def get_recipes(db: Session) -> List[models.Recipe]:
-    return db.query(models.Recipe).filter(models.Recipe.is_active == True).all()
+    return query_recipes(db).filter(models.Recipe.is_active == True).all()
 
 
 def get_recipe_for_admin(db: Session, recipe_id: int) -> models.Recipe:
     return db.query(models.Recipe).filter(models.Recipe.id == recipe_id).first()
 
 
+def get_recipe_photo(db: Session, recipe_id: int):
+    return db.query(models.Recipe.photo, models.Recipe.photo_variants).filter(
+        and_(models.Recipe.id == recipe_id, models.Recipe.is_active == True)).first()
+
+
 def get_recipes_by_id(db: Session, recipes_id: list) -> List[models.Recipe]:
-    return db.query(models.Recipe).filter(and_(models.Recipe.id.in_(recipes_id), models.Recipe.is_active == True)).all()
+    return query_recipes(db).filter(and_(models.Recipe.id.in_(recipes_id), models.Recipe.is_active == True)).all()
 
 
-def get_recipes_by_user(db: Session, user_id: int) -> List[models.Recipe]:
-    return db.query(models.Recipe).filter(and_(models.Recipe.author_id == user_id, models.Recipe.is_active == True)).all()
+def get_recipes_tags(db: Session, recipes_id: list) -> List[tuple]:
+    return db.query(models.RecipeHashtag.recipe_id, models.Hashtag.tag).join(
+        models.Hashtag, models.Hashtag.id == models.RecipeHashtag.tag_id).filter(
+        models.RecipeHashtag.recipe_id.in_(recipes_id)).order_by(models.RecipeHashtag.id).all()
 
 
-def get_recipe_hashtag(db: Session, hashtag_id: int) -> List[models.RecipeHashtag]:
-    return db.query(models.RecipeHashtag).filter(models.RecipeHashtag.tag_id == hashtag_id).all()
+def query_recipes_id_by_tags(db: Session, tags: list, match_all: bool = True):
+    query = db.query(models.RecipeHashtag.recipe_id).join(
+        models.Hashtag, models.Hashtag.id == models.RecipeHashtag.tag_id).filter(models.Hashtag.tag.in_(tags))
+    if match_all:
+        query = query.group_by(models.RecipeHashtag.recipe_id).having(
+            func.count(distinct(models.Hashtag.id)) == len(set(tags)))
+    return query
 
 
 def get_hashtag(db: Session, tag: str) -> models.Hashtag:
     return db.query(models.Hashtag).filter(models.Hashtag.tag == tag).first()
 
 
-def get_hashtags(db: Session) -> List[models.Hashtag]:
-    return db.query(models.Hashtag).all()
-
-
 def get_hashtags_by_tags(db: Session, tags: list) -> List[models.Hashtag]:
     return db.query(models.Hashtag).filter(models.Hashtag.tag.in_(tags)).all()
 
 
-def get_likes_by_user(db: Session, user_id: int) -> List[models.Likes]:
-    return db.query(models.Likes).filter(models.Likes.user_id == user_id).all()
+def get_hashtags_id(db: Session, tags: list) -> List[tuple]:
+    return db.query(models.Hashtag.tag, models.Hashtag.id).filter(models.Hashtag.tag.in_(tags)).all()
+
+
+def get_hashtags_usage(db: Session) -> List[tuple]:
+    return db.query(models.Hashtag.tag, models.Hashtag.id, func.count(models.RecipeHashtag.recipe_id)).outerjoin(
+        models.RecipeHashtag, models.RecipeHashtag.tag_id == models.Hashtag.id).group_by(models.Hashtag.id).all()
 
 
 def get_likes_by_user_recipe(db: Session, user_id: int, recipe_id: int) -> List[models.Likes]:
@@ -59,6 +76,56 @@ def get_likes_by_user_recipe(db: Session, user_id: int, recipe_id: int) -> List[
         and_(models.Likes.user_id == user_id, models.Likes.recipe_id == recipe_id)).first()
 
 
-def get_top_likes(db: Session, limit: int) -> List[models.Likes]:
-    return db.query(models.Likes.recipe_id, func.count(models.Likes.id)).order_by(
-        desc(func.count(models.Likes.id))).group_by(models.Likes.recipe_id).limit(limit).all()
+def get_user_profile(db: Session, user_id: int) -> tuple:
+    recipes_count = db.query(func.count(models.Recipe.id)).filter(
+        models.Recipe.author_id == models.User.id).correlate(models.User).scalar_subquery()
+    return db.query(models.User.id, models.User.nickname, models.User.is_active,
+                    recipes_count.label('number_my_recipe')).filter(
+        models.User.id == user_id).first()
+
+
+def get_favorites_id(db: Session, user_id: int, limit: int = None, after: int = None) -> List[int]:
+    query = db.query(models.Likes.recipe_id).filter(models.Likes.user_id == user_id,
+                                                    models.Likes.recipe_id.isnot(None))
+    if after is not None:
+        query = query.filter(models.Likes.recipe_id > after)
+    return [recipe_id for recipe_id, in query.order_by(models.Likes.recipe_id).limit(limit)]
+
+
+def get_liked_recipes_id(db: Session, user_id: int, recipes_id: list) -> List[int]:
+    return [recipe_id for recipe_id, in db.query(models.Likes.recipe_id).filter(
+        models.Likes.user_id == user_id, models.Likes.recipe_id.in_(recipes_id))]
+
+
+def get_like_state(db: Session, user_id: int, recipe_id: int) -> tuple:
+    return db.query(models.Recipe.id, models.Likes.id).outerjoin(models.Likes, and_(
+        models.Likes.recipe_id == models.Recipe.id, models.Likes.user_id == user_id)).filter(
+        models.Recipe.id == recipe_id).first()
+
+
+def get_existing_recipes_id(db: Session, recipes_id: list) -> List[int]:
+    return [recipe_id for recipe_id, in db.query(models.Recipe.id).filter(models.Recipe.id.in_(recipes_id))]
+
+
+def get_top_likes(db: Session, limit: int) -> List[tuple]:
+    return db.query(models.Recipe.id, models.Recipe.likes_count).filter(models.Recipe.is_active == True).order_by(
+        desc(models.Recipe.likes_count), desc(models.Recipe.id)).limit(limit).all()
+
+
+def get_recipe_tags_id(db: Session, recipe_id: int) -> List[int]:
+    return [tag_id for tag_id, in db.query(models.RecipeHashtag.tag_id).filter(
+        models.RecipeHashtag.recipe_id == recipe_id)]
+
+
+def get_tag_counts(db: Session, type: str = None) -> List[tuple]:
+    count = func.sum(models.TagCount.count)
+    query = db.query(models.Hashtag.tag, count).join(models.TagCount, models.TagCount.tag_id == models.Hashtag.id)
+    if type is not None:
+        query = query.filter(models.TagCount.type == type)
+    return query.group_by(models.Hashtag.tag).having(count > 0).order_by(desc(count), models.Hashtag.tag).all()
+
+
+def count_active_recipes_tags(db: Session) -> List[tuple]:
+    return db.query(models.RecipeHashtag.tag_id, models.Recipe.type, func.count(models.RecipeHashtag.id)).join(
+        models.Recipe, models.Recipe.id == models.RecipeHashtag.recipe_id).filter(
+        models.Recipe.is_active == True).group_by(models.RecipeHashtag.tag_id, models.Recipe.type).all()
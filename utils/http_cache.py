@@ -0,0 +1,91 @@
+import hashlib
+import math
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Iterable
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from config import Config
+from utils.cache import TTLCache
+from utils.responses import FastJSONResponse
+from utils.versions import versions
+
+# key of ConditionalResponse with the epoch -> (body, headers, etag, last_modified)
+response_cache = TTLCache(Config.RESPONSE_CACHE_SIZE, Config.RESPONSE_CACHE_TTL)
+# key of ConditionalResponse -> (etag, last_modified) of the last response made for it, the time is kept
+# while the body is the same, so the validators don't change when the cached response expires
+validators = TTLCache(Config.RESPONSE_CACHE_SIZE, math.inf)
+
+
+class ConditionalResponse:
+    """ETag, Last-Modified and the cached body of a read request. The response is cached by the route,
+    the query, the user and the versions of the data it shows (utils.versions): a write bumps the versions,
+    so the cached responses made before it are not used anymore
+
+    The versions are counted in each process, writes made by other processes are seen when the epoch
+    (Config.RESPONSE_CACHE_TTL seconds) changes and the response is made again. So the validators are
+    derived from the body: the ETag is its hash, Last-Modified is the time the body was first made
+    (the next second, a change within the same second gets the same date).
+    """
+
+    def __init__(self, request: Request, user_id: int, entities: Iterable[str]):
+        self.key = (request.url.path, tuple(sorted(request.query_params.multi_items())), user_id)
+        epoch = int(time.time() // Config.RESPONSE_CACHE_TTL)
+        self.cache_key = (self.key, versions.snapshot(entities), epoch)
+        self.request_headers = request.headers
+
+    @staticmethod
+    def validator_headers(etag: str, last_modified: int) -> dict:
+        headers = {'etag': etag, 'cache-control': 'private, no-cache', 'vary': 'jwt'}
+        # until its second is over another change can get the same date, then only the ETag tells them apart
+        if last_modified <= time.time():
+            headers['last-modified'] = formatdate(last_modified, usegmt=True)
+        return headers
+
+    def not_modified(self, etag: str, last_modified: int) -> bool:
+        # If-Modified-Since is ignored when If-None-Match is sent (RFC 7232, section 6)
+        if 'if-none-match' in self.request_headers:
+            tags = [tag.strip() for tag in self.request_headers['if-none-match'].split(',')]
+            return etag in tags or f'W/{etag}' in tags
+        if 'if-modified-since' in self.request_headers and last_modified <= time.time():
+            try:
+                return last_modified <= parsedate_to_datetime(self.request_headers['if-modified-since']).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def make(self, body: bytes, headers: dict, etag: str, last_modified: int) -> Response:
+        """304 if the client has the response, the response otherwise"""
+        if self.not_modified(etag, last_modified):
+            return Response(status_code=304, headers=self.validator_headers(etag, last_modified))
+        return Response(body, media_type='application/json',
+                        headers=dict(headers, **self.validator_headers(etag, last_modified)))
+
+    def cached(self) -> Response:
+        """Get the response without making it again
+
+        :return: 304 if the client has the cached response, the cached response, None if there is none
+        """
+        cached = response_cache.get(self.cache_key)
+        if cached is None:
+            return None
+        return self.make(*cached)
+
+    def respond(self, content: Any, headers: dict = None) -> Response:
+        """Make the JSON response and cache it
+
+        :param content: data of the response, plain data is encoded without conversion (see utils.responses.dumps)
+        :param headers: headers of the response besides the cache headers (they are cached too)
+        :return: response, 304 if the client has the same body
+        """
+        headers = headers or {}
+        body = FastJSONResponse(content).body
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        previous = validators.get(self.key)
+        # Last-Modified has whole seconds, the time is rounded up
+        last_modified = previous[1] if previous is not None and previous[0] == etag else math.ceil(time.time())
+        validators.set(self.key, (etag, last_modified))
+        response_cache.set(self.cache_key, (body, headers, etag, last_modified))
+        return self.make(body, headers, etag, last_modified)
@@ -0,0 +1,49 @@
+import os
+import tempfile
+from typing import Dict
+
+from PIL import Image, ImageOps
+
+
+def save_variant(image: Image.Image, path: str, max_side: int, quality: int):
+    """Save the image scaled down to fit max_side x max_side as a progressive JPEG.
+    The image is never scaled up
+
+    :param image: source image
+    :param path: path of the variant
+    :param max_side: max width and height of the variant in pixels
+    :param quality: JPEG quality
+    """
+    variant = image.copy()
+    variant.thumbnail((max_side, max_side), Image.LANCZOS)
+    variant.save(path, 'JPEG', quality=quality, optimize=True, progressive=True)
+
+
+def make_variants(path: str, sizes: Dict[str, int], quality: int, directory: str) -> Dict[str, str]:
+    """Make resized and recompressed JPEG copies of the image in temporary files
+
+    :param path: path to the image
+    :param sizes: variant name -> max width and height in pixels
+    :param quality: JPEG quality
+    :param directory: directory for the temporary files
+    :return: variant name -> path to the variant
+    """
+    os.makedirs(directory, exist_ok=True)
+    variants = {}
+    try:
+        with Image.open(path) as source:
+            image = ImageOps.exif_transpose(source)
+            if image.mode != 'RGB':
+                # JPEG has no transparency, it is filled with white
+                background = Image.new('RGB', image.size, 'white')
+                background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+                image = background
+            for name, max_side in sizes.items():
+                descriptor, variants[name] = tempfile.mkstemp(suffix='.jpg', prefix='.variant-', dir=directory)
+                os.close(descriptor)
+                save_variant(image, variants[name], max_side, quality)
+    except BaseException:
+        for variant_path in variants.values():
+            os.unlink(variant_path)
+        raise
+    return variants
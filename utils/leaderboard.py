@@ -0,0 +1,93 @@
+import bisect
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+
+class Leaderboard:
+    """Best entries ordered by score and then by id (both descending), kept in memory
+
+    The board holds at most `size` entries and always holds the real top of its length: after
+    it is built from the best entries it is changed incrementally, and an entry that may have
+    dropped below entries outside the board is removed from it. `exhaustive` means there are no
+    entries outside the board. Keys are (-score, -id), so the best entry is the first one.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.keys: List[Tuple[int, int]] = []
+        self.scores = {}
+        self.exhaustive = False
+        self.built_at = None
+        self.lock = threading.RLock()
+
+    @property
+    def built(self) -> bool:
+        return self.built_at is not None
+
+    def build(self, entries: Iterable[Tuple[int, int]], size: int = None):
+        """Fill the board
+
+        :param entries: (id, score) of the best entries, no more than size
+        :param size: new size of the board
+        """
+        with self.lock:
+            if size:
+                self.size = size
+            self.scores = dict(entries)
+            self.keys = sorted((-score, -entry_id) for entry_id, score in self.scores.items())
+            self.exhaustive = len(self.keys) < self.size
+            self.built_at = time.monotonic()
+
+    def remove(self, entry_id: int):
+        with self.lock:
+            score = self.scores.pop(entry_id, None)
+            if score is not None:
+                self.keys.remove((-score, -entry_id))
+
+    def insert(self, entry_id: int, score: int):
+        with self.lock:
+            key = (-score, -entry_id)
+            if not self.exhaustive and (not self.keys or key > self.keys[-1]):
+                return
+            bisect.insort(self.keys, key)
+            self.scores[entry_id] = score
+            if len(self.keys) > self.size:
+                _, last_id = self.keys.pop()
+                del self.scores[-last_id]
+                self.exhaustive = False
+
+    def change(self, entry_id: int, delta: int) -> bool:
+        """Change the score of an entry on the board
+
+        :param entry_id: entry id
+        :param delta: how much to change the score
+        :return: False if the entry is not on the board
+        """
+        with self.lock:
+            score = self.scores.get(entry_id)
+            if score is None:
+                return False
+            self.remove(entry_id)
+            if delta >= 0 or self.exhaustive or (self.keys and (-score - delta, -entry_id) < self.keys[-1]):
+                bisect.insort(self.keys, (-score - delta, -entry_id))
+                self.scores[entry_id] = score + delta
+            return True
+
+    def update(self, entry_id: int, score: int):
+        with self.lock:
+            if not self.change(entry_id, score - self.scores.get(entry_id, score)):
+                self.insert(entry_id, score)
+
+    def page(self, limit: int, after: Tuple[int, int] = None) -> Optional[List[Tuple[int, int]]]:
+        """Entries after the given one
+
+        :param limit: number of entries
+        :param after: (score, id) of the last entry of the previous page
+        :return: list with (id, score) or None if the board does not hold enough entries
+        """
+        with self.lock:
+            start = 0 if after is None else bisect.bisect_right(self.keys, (-after[0], -after[1]))
+            if start + limit > len(self.keys) and not self.exhaustive:
+                return None
+            return [(-entry_id, -score) for score, entry_id in self.keys[start:start + limit]]
@@ -0,0 +1,109 @@
+import threading
+from typing import Dict, Optional, Tuple
+
+
+class LikeBuffer:
+    """Like toggles that are not written to the database yet, coalesced by (user id, recipe id)
+
+    A pending entry is (stored, liked): whether the database has the like and whether the user
+    likes the recipe now. Toggling the entry back to the stored state removes it, so a like and
+    an unlike in a row write nothing. While a batch is written its entries are kept in `flushing`
+    and still count as the state of the user. `users` indexes both by user: user id -> recipe id ->
+    whether the user likes the recipe, so the changes of one user are found without a scan.
+    """
+
+    def __init__(self):
+        self.pending: Dict[Tuple[int, int], Tuple[bool, bool]] = {}
+        self.flushing: Dict[Tuple[int, int], Tuple[bool, bool]] = {}
+        self.users: Dict[int, Dict[int, bool]] = {}
+        self.events = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def state(self, user_id: int, recipe_id: int) -> Optional[bool]:
+        """Whether the user likes the recipe according to the buffer, None if the buffer doesn't know"""
+        key = (user_id, recipe_id)
+        with self.lock:
+            entry = self.pending.get(key) or self.flushing.get(key)
+            return None if entry is None else entry[1]
+
+    def toggle(self, user_id: int, recipe_id: int, stored: bool = None) -> bool:
+        """Like or unlike the recipe
+
+        :param user_id: user id
+        :param recipe_id: recipe id
+        :param stored: whether the database has the like, used if the buffer doesn't know the state
+        :return: whether the user likes the recipe now
+        """
+        key = (user_id, recipe_id)
+        with self.lock:
+            if key in self.pending:
+                stored, liked = self.pending[key]
+            elif key in self.flushing:
+                # the batch being written will leave this state in the database
+                stored = liked = self.flushing[key][1]
+            else:
+                liked = stored
+            liked = not liked
+            if liked == stored:
+                del self.pending[key]
+            else:
+                self.pending[key] = (stored, liked)
+            self.update_users([key])
+            self.events += 1
+            return liked
+
+    def user_changes(self, user_id: int) -> Dict[int, bool]:
+        """Recipes the user liked or unliked that are not written yet
+
+        :param user_id: user id
+        :return: recipe id -> whether the user likes it
+        """
+        with self.lock:
+            return dict(self.users.get(user_id, {}))
+
+    def take(self) -> Dict[Tuple[int, int], Tuple[bool, bool]]:
+        """Start writing the pending entries, they are kept in flushing until done or restore is called"""
+        with self.lock:
+            left = list(self.flushing)
+            self.flushing, self.pending = self.pending, {}
+            self.update_users(left)
+            self.events = 0
+            return dict(self.flushing)
+
+    def done(self):
+        with self.lock:
+            written, self.flushing = list(self.flushing), {}
+            self.update_users(written)
+
+    def restore(self):
+        """Put the entries that couldn't be written back to the pending ones"""
+        with self.lock:
+            for key, (stored, liked) in self.flushing.items():
+                if key in self.pending:
+                    # the pending entry expected the database to have the state of the failed batch
+                    liked = self.pending.pop(key)[1]
+                if liked != stored:
+                    self.pending[key] = (stored, liked)
+            failed, self.flushing = list(self.flushing), {}
+            self.update_users(failed)
+
+    def update_users(self, keys):
+        """Update the entries of users for the keys after pending or flushing changed, under the lock"""
+        for key in keys:
+            user_id, recipe_id = key
+            entry = self.pending.get(key) or self.flushing.get(key)
+            if entry is not None:
+                self.users.setdefault(user_id, {})[recipe_id] = entry[1]
+                continue
+            changes = self.users.get(user_id)
+            if changes is not None:
+                changes.pop(recipe_id, None)
+                if not changes:
+                    del self.users[user_id]
+
+
+# write-behind mode (Config.LIKES_WRITE_BEHIND): toggles wait here and are written by service.likes
+like_buffer = LikeBuffer()
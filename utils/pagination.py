@@ -0,0 +1,89 @@
+import base64
+import binascii
+import json
+from datetime import date
+from typing import List
+
+from sqlalchemy import and_, or_, desc
+from sqlalchemy.orm import Query
+
+from config import Config
+
+
+class Page(list):
+    """List of rows of one page, next_cursor points to the next page (None on the last page)"""
+
+    def __init__(self, rows: list, next_cursor: str = None):
+        super().__init__(rows)
+        self.next_cursor = next_cursor
+
+
+def encode_cursor(values: list) -> str:
+    data = json.dumps([value.isoformat() if isinstance(value, date) else value for value in values])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor: str, columns: list) -> list:
+    """Get the values of the columns from the cursor, checked against the Python types of the columns
+
+    :param cursor: cursor from encode_cursor
+    :param columns: columns (or typed expressions) the cursor was made for
+    :return: values of the columns
+    :raise ValueError: the cursor is malformed or its values don't fit the columns
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [decode_value(column, value) for column, value in zip(columns, values)]
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError('Invalid cursor')
+
+
+def decode_value(column, value):
+    """Check a value of the cursor against the Python type of its column, dates come as ISO strings"""
+    try:
+        expected = column.type.python_type
+    except NotImplementedError:
+        return value
+    if isinstance(value, bool):
+        raise ValueError
+    if expected is date:
+        return date.fromisoformat(value)
+    if expected is float and isinstance(value, int):
+        return float(value)
+    if not isinstance(value, expected):
+        raise ValueError
+    return value
+
+
+def after(columns: list, values: list):
+    """Condition for rows that go after the key (values) when ordering by the columns descending"""
+    column, value = columns[0], values[0]
+    if len(columns) == 1:
+        return column < value
+    return or_(column < value, and_(column == value, after(columns[1:], values[1:])))
+
+
+def paginate(query: Query, columns: list, cursor: str = None, limit: int = Config.PAGE_LIMIT,
+             key=None) -> Page:
+    """Get a page of the query ordered by the columns descending (keyset pagination)
+
+    :param query: query with filters
+    :param columns: columns for ordering, the last one must be unique (for example id)
+    :param cursor: cursor from the previous page
+    :param limit: page size, no more than Config.PAGE_LIMIT_MAX
+    :param key: function that returns the values of the columns for a row
+    :return: list with rows and cursor to the next page
+    """
+    limit = max(1, min(limit, Config.PAGE_LIMIT_MAX))
+    if key is None:
+        def key(row):
+            return [getattr(row, column.key) for column in columns]
+    if cursor:
+        query = query.filter(after(columns, decode_cursor(cursor, columns)))
+    rows: List = query.order_by(*[desc(column) for column in columns]).limit(limit + 1).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return Page(rows, encode_cursor(key(rows[-1])))
+    return Page(rows)
@@ -0,0 +1,180 @@
+import json
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from mimetypes import guess_type
+from typing import Any, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import Response, JSONResponse
+from starlette.types import Scope, Receive, Send
+
+try:
+    import orjson
+except ImportError:  # the responses are encoded with the json module
+    orjson = None
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# ASGI extension to send a file with sendfile, see the ASGI HTTP "Zero Copy Send" extension
+ZERO_COPY_SEND = 'http.response.zerocopysend'
+
+
+def dumps(content: Any) -> bytes:
+    """Encode JSON with orjson if it is installed. orjson encodes dates, datetimes and UUIDs itself,
+    other values that aren't plain data (pydantic models) go through jsonable_encoder"""
+    if orjson is not None:
+        return orjson.dumps(content, default=jsonable_encoder)
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode()
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    """Whether the client accepts the content encoding by its Accept-Encoding header, q=0 means it doesn't
+
+    :param accept_encoding: value of the header, e.g. 'gzip;q=0.8, br'
+    :param encoding: content encoding, e.g. 'gzip'
+    :return: the encoding is acceptable
+    """
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    quality = qualities.get(encoding, qualities.get('*', 0.0))
+    return quality > 0
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response encoded by dumps, the content is expected to be plain data (dicts, lists, dates)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def file_etag(stat_result: os.stat_result) -> str:
+    """Strong ETag of a file. Files are replaced atomically (a new inode), so a changed file gets a new ETag"""
+    return f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def parse_range(value: str, size: int) -> Tuple[int, int]:
+    """Parse a Range header with a single byte range
+
+    :param value: value of the header
+    :param size: size of the file
+    :return: first and last byte of the range, None if the header isn't a single byte range
+    :raise ValueError: the range is not satisfiable
+    """
+    match = RANGE_PATTERN.match(value.replace(' ', ''))
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    if match.group(1) == '':
+        start, end = max(size - int(match.group(2)), 0), size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if start > end or start >= size:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+class FileRangeResponse(Response):
+    """Response with a file that supports conditional requests (If-None-Match, If-Modified-Since) and
+    single byte ranges (Range, If-Range)
+
+    The body is sent by the server with sendfile when it supports the ASGI zero copy send extension,
+    otherwise the file is read by chunks in the threadpool.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, path: str, stat_result: os.stat_result, request_headers: Headers, method: str = 'GET',
+                 headers: dict = None, media_type: str = None, background: BackgroundTask = None):
+        self.path = path
+        self.background = background
+        self.etag = file_etag(stat_result)
+        self.start, self.end = 0, stat_result.st_size - 1
+        self.media_type = media_type or guess_type(path)[0] or 'application/octet-stream'
+        self.send_body = method != 'HEAD'
+        self.status_code = 200
+        headers = dict(headers or {}, etag=self.etag, **{
+            'last-modified': formatdate(stat_result.st_mtime, usegmt=True), 'accept-ranges': 'bytes'})
+
+        if self.not_modified(request_headers, stat_result):
+            self.status_code, self.send_body = 304, False
+            self.init_headers(headers)
+            return
+        if 'range' in request_headers and self.if_range(request_headers, stat_result):
+            try:
+                byte_range = parse_range(request_headers['range'], stat_result.st_size)
+            except ValueError:
+                self.status_code, self.send_body = 416, False
+                headers['content-range'] = f'bytes */{stat_result.st_size}'
+                headers['content-length'] = '0'
+                self.init_headers(headers)
+                return
+            if byte_range is not None:
+                self.status_code = 206
+                self.start, self.end = byte_range
+                headers['content-range'] = f'bytes {self.start}-{self.end}/{stat_result.st_size}'
+        headers['content-length'] = str(self.end - self.start + 1)
+        self.init_headers(headers)
+
+    def not_modified(self, request_headers: Headers, stat_result: os.stat_result) -> bool:
+        if 'if-none-match' in request_headers:
+            tags = [tag.strip() for tag in request_headers['if-none-match'].split(',')]
+            return '*' in tags or any(tag.replace('W/', '', 1) == self.etag for tag in tags)
+        if 'if-modified-since' in request_headers:
+            try:
+                return int(stat_result.st_mtime) <= parsedate_to_datetime(
+                    request_headers['if-modified-since']).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def if_range(self, request_headers: Headers, stat_result: os.stat_result) -> bool:
+        """The range is sent only if the file is the one the client has a part of"""
+        if 'if-range' not in request_headers:
+            return True
+        value = request_headers['if-range']
+        if value.startswith('"'):
+            return value == self.etag
+        try:
+            return int(stat_result.st_mtime) == parsedate_to_datetime(value).timestamp()
+        except (TypeError, ValueError):
+            return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        if self.send_body:
+            await self.send_file(scope, send)
+        else:
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        if self.background is not None:
+            await self.background()
+
+    async def send_file(self, scope: Scope, send: Send):
+        with open(self.path, 'rb') as file:
+            count = self.end - self.start + 1
+            if ZERO_COPY_SEND in scope.get('extensions', {}):
+                await send({'type': ZERO_COPY_SEND, 'file': file, 'offset': self.start, 'count': count,
+                            'more_body': False})
+                return
+            offset = self.start
+            more_body = True
+            while more_body:
+                chunk = await run_in_threadpool(os.pread, file.fileno(), min(self.chunk_size, count), offset) \
+                    if count > 0 else b''
+                offset += len(chunk)
+                count -= len(chunk)
+                # an empty chunk before the end means the file was truncated while it was sent
+                more_body = bool(chunk) and count > 0
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
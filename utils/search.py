@@ -0,0 +1,73 @@
+import re
+
+from sqlalchemy import and_, func, cast, Float, literal, select
+from sqlalchemy.orm import Session
+
+from config import Config
+
+WORD = re.compile(r'\w+', re.UNICODE)
+# Weights of the recipe fields in the SQLite search text: words are repeated this many times
+WEIGHTS = (3, 2, 1)
+
+
+def words(text: str) -> list:
+    return [word.lower() for word in WORD.findall(text or '')]
+
+
+def recipe_vector(dialect: str, name: str, description: str, steps_making: str):
+    """Search vector of a recipe: name is more important than description and description than steps
+
+    PostgreSQL gets a tsvector expression, other databases get the words of the recipe wrapped
+    in spaces (' word  word ') so that a word can be found with LIKE '% word %'.
+
+    :param dialect: name of the database dialect
+    :param name: recipe name (value or column)
+    :param description: recipe description
+    :param steps_making: recipe steps
+    :return: value for Recipe.search_vector
+    """
+    fields = (name, description, steps_making)
+    if dialect == 'postgresql':
+        vectors = [func.setweight(func.to_tsvector(Config.SEARCH_CONFIG, func.coalesce(field, '')), weight)
+                   for field, weight in zip(fields, 'ABC')]
+        return vectors[0].op('||')(vectors[1]).op('||')(vectors[2])
+    return ''.join(f' {word} ' for field, weight in zip(fields, WEIGHTS) for word in words(field) * weight)
+
+
+def search(db: Session, vector, q: str) -> tuple:
+    """Full-text search condition and relevance of a row for the query
+
+    :param db: database connection
+    :param vector: column with the search vector (see recipe_vector)
+    :param q: search query
+    :return: condition for filter and rank expression (greater is more relevant)
+    """
+    if db.bind.dialect.name == 'postgresql':
+        query = func.plainto_tsquery(Config.SEARCH_CONFIG, q)
+        return vector.op('@@')(query), cast(func.ts_rank(vector, query), Float)
+    terms = set(words(q))
+    if not terms:
+        return literal(False), literal(0)
+    conditions, rank = [], literal(0)
+    for term in terms:
+        term = f' {term} '
+        conditions.append(vector.like(f"%{term.replace('_', '/_')}%", escape='/'))
+        rank = rank + (func.length(vector) - func.length(func.replace(vector, term, ''))) / len(term)
+    return and_(*conditions), cast(rank, Float)
+
+
+def trigram_search(db: Session, column, text: str) -> tuple:
+    """Fuzzy (trigram similarity) search condition and similarity of a row to the text for PostgreSQL
+    (pg_trgm and its GIN index on the column). Other databases use the in-process index of the column
+    values instead, see service.recipe.get_fuzzy_page
+
+    The % operator compares with pg_trgm.similarity_threshold, it is set to Config.FUZZY_THRESHOLD for
+    the current transaction so that the threshold is the same on all databases.
+
+    :param db: database connection
+    :param column: column to search in
+    :param text: text to search
+    :return: condition for filter and rank expression (greater is more similar)
+    """
+    db.execute(select(func.set_config('pg_trgm.similarity_threshold', str(Config.FUZZY_THRESHOLD), True)))
+    return column.op('%')(text), cast(func.similarity(column, text), Float)
@@ -0,0 +1,135 @@
+import abc
+import os
+import shutil
+import tempfile
+
+from config import Config
+
+
+def content_key(sha256: str, extension: str) -> str:
+    """Key of a file by its content, sharded by the first bytes of the hash: ab/cd/abcd....jpg
+
+    :param sha256: hex sha256 of the content
+    :param extension: file extension
+    :return: key of the file
+    """
+    return f'{sha256[:2]}/{sha256[2:4]}/{sha256}.{extension}'
+
+
+def derived_key(key: str, name: str, extension: str = 'jpg') -> str:
+    """Key of a file made from another one (e.g. a photo variant): ab/cd/abcd..._<name>.jpg"""
+    return f'{os.path.splitext(key)[0]}_{name}.{extension}'
+
+
+class StorageBackend(abc.ABC):
+    """Where the files are kept. Files are written once under their key and never changed"""
+
+    @abc.abstractmethod
+    def temp_dir(self) -> str:
+        """Local directory for files that are being written before put"""
+
+    @abc.abstractmethod
+    def put(self, key: str, local_path: str):
+        """Move a complete local file to the storage. If the key already exists, the file is dropped,
+        the stored one has the same content"""
+
+    @abc.abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether there is a file under the key"""
+
+    @abc.abstractmethod
+    def local_path(self, key: str) -> str:
+        """Path of the file on this server to read or send it, None if there is no such file"""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """Delete the file under the key, if there is one"""
+
+    def new_temp_file(self):
+        os.makedirs(self.temp_dir(), exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=self.temp_dir(), prefix='.upload-', delete=False)
+
+
+class LocalStorage(StorageBackend):
+    """Files in a directory tree on the local file system: <root>/ab/cd/abcd....jpg
+
+    Keys that are absolute paths (photos saved before the storage was introduced) are used as they are.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def temp_dir(self) -> str:
+        return os.path.join(self.root, '.tmp')
+
+    def put(self, key: str, local_path: str):
+        path = self.path(key)
+        if os.path.exists(path):
+            os.unlink(local_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # temporary files are private, the stored file is readable like a usual file
+        os.chmod(local_path, 0o644)
+        os.replace(local_path, path)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def local_path(self, key: str) -> str:
+        path = self.path(key)
+        return path if os.path.isfile(path) else None
+
+    def delete(self, key: str):
+        try:
+            os.unlink(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+class ObjectStorage(StorageBackend):
+    """Local stand-in for an object storage (S3 and the like): objects are uploaded to a bucket by copying
+    and downloaded to a local cache to be read or sent, nothing is renamed or listed in the bucket.
+    A client of a real object storage implements the same methods
+    """
+
+    def __init__(self, bucket: str, cache: str):
+        self.bucket = LocalStorage(bucket)
+        self.cache = LocalStorage(cache)
+
+    def temp_dir(self) -> str:
+        return self.cache.temp_dir()
+
+    def put(self, key: str, local_path: str):
+        if not self.bucket.exists(key):
+            with open(local_path, 'rb') as source, self.bucket.new_temp_file() as target:
+                shutil.copyfileobj(source, target)
+            self.bucket.put(key, target.name)
+        self.cache.put(key, local_path)
+
+    def exists(self, key: str) -> bool:
+        return self.bucket.exists(key)
+
+    def local_path(self, key: str) -> str:
+        path = self.cache.local_path(key)
+        if path is None and self.bucket.exists(key):
+            with open(self.bucket.path(key), 'rb') as source, self.cache.new_temp_file() as target:
+                shutil.copyfileobj(source, target)
+            self.cache.put(key, target.name)
+            path = self.cache.local_path(key)
+        return path
+
+    def delete(self, key: str):
+        self.bucket.delete(key)
+        self.cache.delete(key)
+
+
+def make_storage() -> StorageBackend:
+    if Config.STORAGE_BACKEND == 'object':
+        return ObjectStorage(Config.OBJECT_STORAGE_BUCKET, os.path.join(Config.BASE_DIR_IMAGES, 'cache'))
+    return LocalStorage(Config.BASE_DIR_IMAGES)
+
+
+storage = make_storage()
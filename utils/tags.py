@@ -0,0 +1,93 @@
+import bisect
+import heapq
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# suggestions for prefixes shorter than this scan many tags, they are cached until the dictionary changes
+SHORT_PREFIX = 3
+
+
+class TagDictionary:
+    """Hashtags of the service kept in memory: tag -> id and how many recipes use the tag
+
+    Tags are also kept in a list sorted by the casefolded tag, so the tags starting with a prefix
+    are a contiguous slice of it found with bisect. A hashtag id never changes once it is created,
+    so an id found here can be used by writes without asking the database.
+    """
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.usage: Dict[str, int] = {}
+        self.keys: List[Tuple[str, str]] = []
+        self.short_prefixes = {}
+        self.built_at = None
+        self.lock = threading.RLock()
+
+    @property
+    def built(self) -> bool:
+        return self.built_at is not None
+
+    def build(self, entries: Iterable[Tuple[str, int, int]]):
+        """Fill the dictionary
+
+        :param entries: (tag, id, number of recipes with the tag)
+        """
+        with self.lock:
+            self.ids, self.usage = {}, {}
+            for tag, tag_id, count in entries:
+                self.ids[tag] = tag_id
+                self.usage[tag] = count or 0
+            self.keys = sorted((tag.casefold(), tag) for tag in self.ids)
+            self.short_prefixes = {}
+            self.built_at = time.monotonic()
+
+    def clear(self):
+        with self.lock:
+            self.ids, self.usage, self.keys, self.short_prefixes = {}, {}, [], {}
+            self.built_at = None
+
+    def get(self, tag: str) -> Optional[int]:
+        return self.ids.get(tag)
+
+    def add(self, tag: str, tag_id: int, delta: int = 0):
+        """Add the hashtag if it is new and change the number of recipes using it
+
+        :param tag: hashtag
+        :param tag_id: hashtag id
+        :param delta: change of the number of recipes with the hashtag
+        """
+        with self.lock:
+            if tag not in self.ids:
+                self.ids[tag] = tag_id
+                self.usage[tag] = 0
+                bisect.insort(self.keys, (tag.casefold(), tag))
+                self.short_prefixes = {}
+            self.count(tag, delta)
+
+    def count(self, tag: str, delta: int):
+        """Change the number of recipes using the hashtag if it is in the dictionary"""
+        with self.lock:
+            if tag in self.usage:
+                self.usage[tag] = max(self.usage[tag] + delta, 0)
+                self.short_prefixes = {}
+
+    def suggest(self, prefix: str, limit: int) -> List[Tuple[str, int]]:
+        """Hashtags starting with the prefix (case-insensitive), the most used first
+
+        :param prefix: beginning of the hashtag
+        :param limit: number of hashtags
+        :return: list with (hashtag, number of recipes with it)
+        """
+        prefix = prefix.casefold()
+        with self.lock:
+            cached = self.short_prefixes.get((prefix, limit))
+            if cached is not None:
+                return cached
+            start = bisect.bisect_left(self.keys, (prefix,))
+            end = bisect.bisect_left(self.keys, (prefix + '\U0010ffff',), start)
+            matches = [(tag, self.usage[tag]) for _, tag in self.keys[start:end]]
+            suggestions = heapq.nsmallest(limit, matches, key=lambda match: (-match[1], match[0]))
+            if len(prefix) < SHORT_PREFIX:
+                self.short_prefixes[(prefix, limit)] = suggestions
+            return suggestions
@@ -0,0 +1,80 @@
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Tuple
+
+WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def trigrams(text: str) -> set:
+    """Trigrams of a text the same way as pg_trgm makes them: every word is lowercased
+    and padded with two spaces in front and one space at the end
+
+    :param text: text
+    :return: set with trigrams
+    """
+    result = set()
+    for word in WORD.findall((text or '').lower()):
+        word = f'  {word} '
+        result.update(word[i:i + 3] for i in range(len(word) - 2))
+    return result
+
+
+class TrigramIndex:
+    """In-process trigram index (posting list of documents for every trigram)
+
+    A search only reads the posting lists of the trigrams of the query, so its cost depends
+    on how many documents share trigrams with the query rather than on the number of documents.
+    Similarity is the same as in pg_trgm: shared trigrams / all distinct trigrams of both texts.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, set] = defaultdict(set)
+        self.documents: Dict[int, set] = {}
+        self.built = False
+        self.lock = threading.RLock()
+
+    def build(self, documents: Iterable[Tuple[int, str]]):
+        with self.lock:
+            self.postings.clear()
+            self.documents.clear()
+            for doc_id, text in documents:
+                self.add(doc_id, text)
+            self.built = True
+
+    def add(self, doc_id: int, text: str):
+        with self.lock:
+            self.remove(doc_id)
+            doc_trigrams = trigrams(text)
+            self.documents[doc_id] = doc_trigrams
+            for trigram in doc_trigrams:
+                self.postings[trigram].add(doc_id)
+
+    def remove(self, doc_id: int):
+        with self.lock:
+            for trigram in self.documents.pop(doc_id, ()):
+                posting = self.postings[trigram]
+                posting.discard(doc_id)
+                if not posting:
+                    del self.postings[trigram]
+
+    def search(self, text: str, threshold: float = 0.3) -> Dict[int, float]:
+        """Documents similar to the text
+
+        :param text: text to search
+        :param threshold: minimal similarity
+        :return: dictionary document id -> similarity
+        """
+        query = trigrams(text)
+        if not query:
+            return {}
+        with self.lock:
+            shared = Counter()
+            for trigram in query:
+                shared.update(self.postings.get(trigram, ()))
+            result = {}
+            for doc_id, count in shared.items():
+                similarity = count / (len(query) + len(self.documents[doc_id]) - count)
+                if similarity >= threshold:
+                    result[doc_id] = similarity
+        return result
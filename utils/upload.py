@@ -0,0 +1,101 @@
+import hashlib
+import os
+from typing import BinaryIO, NamedTuple
+
+from config import Config
+from utils.storage import StorageBackend, content_key
+
+# magic bytes of the accepted image formats -> file extension
+IMAGE_SIGNATURES = {
+    b'\xff\xd8\xff': 'jpg',
+    b'\x89PNG\r\n\x1a\n': 'png',
+}
+
+
+class InvalidImage(Exception):
+    """The file is not an image of an accepted format"""
+
+
+class PhotoTooLarge(Exception):
+    """The file is larger than Config.MAX_PHOTO_SIZE"""
+
+
+class StoredFile(NamedTuple):
+    key: str
+    sha256: str
+    size: int
+    extension: str
+    # temporary file with the content until it is put to the storage (see receive_upload)
+    path: str = None
+
+
+def image_extension(head: bytes) -> str:
+    """Get the extension of an image by its first bytes
+
+    :param head: first bytes of the file
+    :return: extension of the image, None if the format is not accepted
+    """
+    for signature, extension in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return extension
+    return None
+
+
+def store_upload(file: BinaryIO, storage: StorageBackend, max_size: int = Config.MAX_PHOTO_SIZE) -> StoredFile:
+    """Copy an uploaded image to the storage by chunks of Config.UPLOAD_CHUNK_SIZE, so memory doesn't depend
+    on the file size. The file is written to a temporary file and put to the storage under the hash of its
+    content when it is complete, so a reader never sees a partial file and identical images are stored once
+
+    :param file: uploaded file
+    :param storage: storage for the file
+    :param max_size: max size of the file in bytes
+    :return: object StoredFile with the key, the content hash, the size and the extension of the file
+    :raise InvalidImage: the file is not a jpg or png image
+    :raise PhotoTooLarge: the file is larger than max_size
+    """
+    received = receive_upload(file, storage, max_size)
+    try:
+        storage.put(received.key, received.path)
+    finally:
+        discard_upload(received)
+    return received._replace(path=None)
+
+
+def receive_upload(file: BinaryIO, storage: StorageBackend, max_size: int = Config.MAX_PHOTO_SIZE) -> StoredFile:
+    """Copy an uploaded image to a temporary file of the storage by chunks of Config.UPLOAD_CHUNK_SIZE
+    and find its key. The caller puts it to the storage (storage.put) or removes it (discard_upload)
+
+    :param file: uploaded file
+    :param storage: storage for the file
+    :param max_size: max size of the file in bytes
+    :return: object StoredFile with the key, the content hash, the size, the extension and the temporary file
+    :raise InvalidImage: the file is not a jpg or png image
+    :raise PhotoTooLarge: the file is larger than max_size
+    """
+    head = file.read(Config.UPLOAD_CHUNK_SIZE)
+    extension = image_extension(head)
+    if extension is None:
+        raise InvalidImage()
+    sha256 = hashlib.sha256()
+    size = 0
+    temp = storage.new_temp_file()
+    try:
+        with temp:
+            chunk = head
+            while chunk:
+                size += len(chunk)
+                if size > max_size:
+                    raise PhotoTooLarge()
+                sha256.update(chunk)
+                temp.write(chunk)
+                chunk = file.read(Config.UPLOAD_CHUNK_SIZE)
+    except BaseException:
+        os.unlink(temp.name)
+        raise
+    return StoredFile(content_key(sha256.hexdigest(), extension), sha256.hexdigest(), size, extension, temp.name)
+
+
+def discard_upload(received: StoredFile):
+    """Remove the temporary file of the upload if it wasn't put to the storage"""
+    if received.path and os.path.exists(received.path):
+        os.unlink(received.path)
@@ -0,0 +1,33 @@
+import threading
+from typing import Iterable
+
+RECIPES = 'recipes'
+LIKES = 'likes'
+TAGS = 'tags'
+
+
+class Versions:
+    """Version of each kind of data (recipes, likes, tags) in this process.
+    A write bumps the versions of what it changed, so anything computed from the data can be keyed
+    by the versions it was computed with"""
+
+    def __init__(self):
+        self.versions = {}
+        self.lock = threading.Lock()
+
+    def bump(self, *entities: str):
+        with self.lock:
+            for entity in entities:
+                self.versions[entity] = self.versions.get(entity, 0) + 1
+
+    def snapshot(self, entities: Iterable[str]) -> tuple:
+        """Get the versions of the entities
+
+        :param entities: names of the entities
+        :return: versions of the entities
+        """
+        with self.lock:
+            return tuple(self.versions.get(entity, 0) for entity in entities)
+
+
+versions = Versions()